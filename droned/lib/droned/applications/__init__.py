@@ -18,7 +18,7 @@ from twisted.internet import defer, reactor
 from twisted.python.failure import Failure
 from kitt.util import dictwrapper
 from kitt.decorators import debugCall, deferredAsThread
-from kitt.proc import Process, listProcesses, findProcesses
+from kitt.proc import Process, listProcesses, findProcesses, processTable
 from kitt.blaster import DIGEST_INIT
 from droned.clients import command
 from droned.protocols.application import ApplicationProtocol
@@ -239,8 +239,6 @@ class ApplicationPlugin(object):
             result = Failure()
         yield result
 
-#NOTE runs hot due to IO read on Linux and Solaris
-    @deferredAsThread
     def findProcesses(self):
         """Attempt to find a process by an ASSIMILATION pattern.
            This is a relatively naive attempt to find an application
@@ -253,11 +251,23 @@ class ApplicationPlugin(object):
              read the environment settings from the application that
              will be inlcuded in the result dictionary as well. 
 
+           The processes come from the shared ``kitt.proc.processTable``
+           snapshot, the parent pid and command line of a process are read
+           once per snapshot no matter how many plugins look at them.
 
            @callback (list) -  sorted([(int('PID'), dict), ...])
            @errback (twisted.python.failure.Failure())
            @return defer.Deferred()
         """
+        if not processTable.tick: processTable.scan() #only in the reactor
+        return self._findProcesses(processTable.snapshot())
+
+    @deferredAsThread
+    def _findProcesses(self, table):
+        """runs in a thread, see findProcesses
+
+           @param table (kitt.proc.TableSnapshot)
+        """
         candidates = {}
         def safe_process(pid):
             try: #because processes can be invalid
@@ -265,20 +275,22 @@ class ApplicationPlugin(object):
             except: return None
 
         if self.PROCESS_REGEX:
-            #rescan the whole system for processes
-            for process in ( safe_process(pid) for pid in listProcesses() ):
+            for process in ( safe_process(pid) for pid in table ):
                 try:
                     if not process: continue 
                     if not process.__class__.isValid(process): continue
                     if process.pid in candidates: continue
-                    if process.ppid != 1: continue #droned wants your daemons
-                    if not process.running: continue
-                    if not process.localInstall: continue
-                    if process.managed: continue #already managed
-                    cmd = ' '.join(process.cmdline)
+                    #droned wants your daemons
+                    if table.memo(process.pid, 'ppid', getattr, process, 'ppid') != 1:
+                        continue
+                    cmd = table.memo(process.pid, 'cmdline',
+                            lambda: ' '.join(process.cmdline))
                     if not cmd: continue
                     match = self.PROCESS_REGEX.search(cmd)
                     if not match: continue
+                    if not process.running: continue
+                    if not process.localInstall: continue
+                    if process.managed: continue #already managed
                     #remember we tried to set some VARS on startInstance
                     _result = dict(**process.environ)
                     #allows us to set interesting parameters in the regex
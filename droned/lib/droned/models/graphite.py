@@ -20,8 +20,11 @@ from twisted.internet import defer, reactor
 from twisted.python.failure import Failure
 from kitt.decorators import synchronizedDeferred
 from kitt.util import dictwrapper
+from kitt.numeric.buffers import PointStore
 from droned.clients import connect
+from droned.protocols.graphite import frames
 import time
+import re
 
 
 class IDataPoint(Interface):
@@ -29,6 +32,7 @@ class IDataPoint(Interface):
     def __getattr__(self,name): pass
     def __iter__(self): pass
     def items(self):pass
+    def set_sample(self,time_value,value):pass
     def set_meta_data(self,name,value):pass
     def update_meta_data(self,other):pass
     def del_meta_data(self,name):pass
@@ -85,6 +89,18 @@ class DataPoint(object):
         for k,v in self.meta_data.items():
             yield (k,v)
     
+    def set_sample(self,time_value,value):
+        '''move this data point to a new sample, meta data is untouched.
+           @param time_value: <int|float> (epoch time)
+           @param value: <int|float> value for this data point
+        '''
+        self.time = time_value
+        self.time_int = int(time_value)
+        self.value = value
+        self._core.update({"time":self.time,
+                           "time_int":self.time_int,
+                           "value":self.value})
+    
     def set_meta_data(self,name,value):
         '''add/update a single meta datum on this object
            @param name: name of our meta data item
@@ -108,43 +124,95 @@ class DataPoint(object):
         
         
 
+class Rollup(object):
+    """incremental per bucket aggregation of the samples of one series,
+       only one value per bucket is ever stored.
+
+       #1 running state is kept for the newest buckets only, a sample for
+          an older bucket starts over and replaces the stored value.
+    """
+    METHODS = ('avg', 'max', 'min', 'sum', 'last', 'count')
+    KEEP = 2 #1
+    def __init__(self, width, method='avg'):
+        if method not in self.METHODS:
+            errmsg = 'rollup method must be one of %s' % ','.join(self.METHODS)
+            raise AssertionError(errmsg)
+        self.width = max(1, int(width))
+        self.method = method
+        self.states = {} #bucket -> [count, sum, max, min, last]
+
+
+    def update(self, stamp, value):
+        """fold a sample into its bucket
+
+           @param stamp (int|float)
+           @param value (int|float)
+
+           @return (tuple) - (bucket stamp, aggregate of the bucket so far)
+        """
+        bucket = int(stamp) - int(stamp) % self.width
+        state = self.states.get(bucket)
+        if state is None:
+            state = self.states[bucket] = [0, 0.0, value, value, value]
+            if len(self.states) > self.KEEP: #1
+                del self.states[min(self.states)]
+        state[0] += 1
+        state[1] += value
+        if value > state[2]: state[2] = value
+        if value < state[3]: state[3] = value
+        state[4] = value
+        method = self.method
+        if method == 'avg': return (bucket, state[1] / state[0])
+        if method == 'sum': return (bucket, state[1])
+        if method == 'max': return (bucket, state[2])
+        if method == 'min': return (bucket, state[3])
+        if method == 'last': return (bucket, state[4])
+        return (bucket, state[0])
+
+
 class TimeSeriesData(Entity):
     """A serializable model to store graphite style time series data"""
     metricID = property(lambda s: s._name)
-    pending = property(lambda s: bool(s.dataPoints))
-    serializable = True #save metrics that haven't been sent yet
+    pending = property(lambda s: bool(len(s.dataPoints)))
+    spool = None #kitt.spool.SegmentSpool for unsent points, set by the service
+    dirty = set() #instances that may have pending points, see pendingObjects()
+    rollups = [] #(compiled regex, width, method) see setRollups()
+    #the journal saves metrics that haven't been sent yet, unless they are spooled
+    serializable = property(lambda s: s.spool is None)
     def __init__(self, metricID):
         self._name = metricID
-        self.dataPoints = {}
+        self.dataPoints = PointStore() #sorted by stamp
+        self.touched = time.time() #last time a point was added
+        self.rollup = TimeSeriesData.rollupFor(metricID)
         busy = defer.DeferredLock()
         sync = synchronizedDeferred(busy)
-        #protect the storage
-        self.add = sync(self.add)
+        #protect the storage while it is being sent, adding only ever
+        #appends and does not need the lock.
         self.produce = sync(self.produce)
         self.produce_all = sync(self.produce_all)
+        self.drain = sync(self.drain)
+        self.restore = sync(self.restore)
 
 
     def __getstate__(self):
         return {
             'name': self.metricID,
-            'data': self.dataPoints
+            'data': dict(self.dataPoints)
         }
 
 
     @staticmethod
     def construct(state):
         metric = TimeSeriesData(state['name'])
-        metric.dataPoints = state['data']
+        for stamp, value in state['data'].iteritems():
+            metric.append(stamp, value)
         return metric
 
 
     def add(self, value):
         """add a metric value to this metric id
 
-           Note: this method is wrapped in a deferred on class instantiation
-
            @value (int|float)
-           @raise AssertionError
 
            @callback (NoneType)
            @errback (twisted.python.failure.Failure())
@@ -153,13 +221,55 @@ class TimeSeriesData(Entity):
         """
         if not isinstance(value, (int,float,DataPoint)):
             errmsg = 'input must be `int` , `float` or `droned.models.graphite.DataPoint`'
-            raise AssertionError(errmsg)
-        
-        #lose some precision on purpose
-        updater = self.dataPoints.update
-        if type(value) == DataPoint: updater({value.time_int: value.value})
-        else: updater({int(time.time()): value})
-        
+            return defer.fail(AssertionError(errmsg))
+        if type(value) == DataPoint: self.append(value.time, value.value)
+        else: self.append(time.time(), value)
+        return defer.succeed(None)
+
+
+    def append(self, stamp, value):
+        """add a sample to this metric id, the fast path of add().
+           a later sample with the same second replaces the earlier one,
+           unless the series has a rollup which aggregates all samples of a
+           bucket into a single point.
+
+           @param stamp (int|float) - seconds since the epoch
+           @param value (int|float)
+        """
+        if self.rollup: stamp, value = self.rollup.update(stamp, value)
+        self.dataPoints.add(int(stamp), value) #lose some precision on purpose
+        self.touched = stamp
+        TimeSeriesData.dirty.add(self)
+
+
+
+    def drain(self):
+        """take every pending point out of this metric id
+
+           Note: this method is wrapped in a deferred on class instantiation
+
+           @callback (list) - [(metricID, (stamp, value)), ...]
+
+           @return defer.Deferred()
+        """
+        points = [(self.metricID, item) for item in self.dataPoints]
+        self.dataPoints.clear()
+        return points
+
+
+    def restore(self, points):
+        """put back points taken by drain() that could not be sent, points
+           added in the mean time win.
+
+           Note: this method is wrapped in a deferred on class instantiation
+
+           @param points (list) - [(metricID, (stamp, value)), ...]
+
+           @return defer.Deferred()
+        """
+        for (metricID, (stamp, value)) in points:
+            self.dataPoints.add(stamp, value, replace=False)
+        if self.pending: TimeSeriesData.dirty.add(self)
 
 
     @defer.deferredGenerator
@@ -180,8 +290,7 @@ class TimeSeriesData(Entity):
         """
         result = 0
         if self.pending:
-            stamp = sorted(self.dataPoints.keys())[0] #send oldest first
-            value = self.dataPoints[stamp]
+            stamp, value = self.dataPoints.oldest() #send oldest first
             proto_args = ([(self.metricID, (stamp, value))],)
             proto_kwargs = {'timeout': timeout}
             try:
@@ -190,14 +299,14 @@ class TimeSeriesData(Entity):
                 yield wfd
                 wfd.getResult()
                 result += 1
-                del self.dataPoints[stamp] #remove the metric
+                self.dataPoints.discard([stamp]) #remove the metric
             except:
                 result = Failure()
         yield result
          
 
     @defer.deferredGenerator
-    def produce_all(self, host, port, protocol, timeout=5.0):
+    def produce_all(self, host, port, protocol, timeout=5.0, pool=None):
         """Produce ALL metrics to the endpoint
 
            Note: this method is wrapped in a deferred on class instantiation
@@ -206,6 +315,8 @@ class TimeSeriesData(Entity):
            @param port (int)
            @param protocol (class) - twisted.internet.protocol.Protocol
            @param timeout (int|float) - timeout parameter for the protocol
+           @param pool (droned.protocols.graphite.GraphitePool) - send over
+               the pool's persistent connections instead of connecting
 
            @callback (int) - how many metrics were sent
            @errback (twisted.python.failure.Failure())
@@ -214,18 +325,19 @@ class TimeSeriesData(Entity):
         """
         result = 0
         if self.pending:
-            metrics = set()
-            for stamp, value in self.dataPoints.iteritems():
-                metrics.add((self.metricID, (stamp, value)))
-            proto_args = (list(metrics),)
+            sent = list(self.dataPoints)
+            metrics = [(self.metricID, item) for item in sent]
+            proto_args = (metrics,)
             proto_kwargs = {'timeout': timeout}
             try:
-                d = connect(host, port, protocol, *proto_args, **proto_kwargs)
+                if pool: d = pool.send(*proto_args)
+                else: d = connect(host, port, protocol, *proto_args, **proto_kwargs)
                 wfd = defer.waitForDeferred(d)
                 yield wfd
                 wfd.getResult()
                 result += 1
-                self.dataPoints = {} #reset storage
+                #points added meanwhile stay
+                self.dataPoints.discard([item[0] for item in sent])
             except:
                 result = Failure()
         yield result
@@ -233,7 +345,7 @@ class TimeSeriesData(Entity):
 
     @staticmethod
     @defer.deferredGenerator
-    def produceAllMetrics(host, port, protocol, timeout=5.0, delay=0.0):
+    def produceAllMetrics(host, port, protocol, timeout=5.0, delay=0.0, pool=None):
         """Produce ALL metrics of ALL metricID's to the endpoint with some 
            delay in between.
 
@@ -242,6 +354,7 @@ class TimeSeriesData(Entity):
            @param protocol (class) - twisted.internet.protocol.Protocol
            @param timeout (int|float) - timeout parameter for the protocol
            @param delay (int|float) - delay between sends
+           @param pool (droned.protocols.graphite.GraphitePool) - optional
 
            @callback (int) - how many metrics were sent
            @errback N/A
@@ -249,10 +362,11 @@ class TimeSeriesData(Entity):
            @return defer.Deferred()
         """
         result = 0
-        for obj in TimeSeriesData.objects:
+        for obj in TimeSeriesData.pendingObjects():
             while obj.pending:
                 try:
-                    d = obj.produce_all(host, port, protocol, timeout=timeout)
+                    d = obj.produce_all(host, port, protocol, timeout=timeout,
+                            pool=pool)
                     wfd = defer.waitForDeferred(d)
                     yield wfd
                     result += wfd.getResult()
@@ -262,5 +376,195 @@ class TimeSeriesData(Entity):
                         wfd = defer.waitForDeferred(d)
                         yield wfd
                         wfd.getResult()
-                except: pass #swallow errors
+                except: break #swallow errors, retry on the next call
+        yield result
+
+
+    @staticmethod
+    @defer.deferredGenerator
+    def sendPoints(host, port, protocol, points, timeout=5.0, pool=None,
+            batch_size=500, batch_bytes=65536):
+        """Send points in frames, once a frame fails the rest are not tried.
+
+           @param host (string)
+           @param port (int)
+           @param protocol (class) - twisted.internet.protocol.Protocol
+           @param points (list) - [(metricID, (stamp, value)), ...]
+           @param timeout (int|float) - timeout parameter for the protocol
+           @param pool (droned.protocols.graphite.GraphitePool) - optional,
+               or a GraphiteRouter which may write only part of a batch.
+               pooled sends fail when no connection is up or when they
+               are not written within the pool's timeout.
+           @param batch_size (int) - most points in one frame
+           @param batch_bytes (int) - rough upper bound of bytes in one frame
+
+           @callback (tuple) - (points sent, [points not sent])
+           @errback N/A
+
+           @return defer.Deferred()
+        """
+        sent, unsent = 0, []
+        if pool and not pool.available: #nobody to send to, spool right away
+            yield (sent, list(points))
+            return
+        if pool: batches = [points] #the pool frames a batch by itself
+        else: batches = frames(points, batch_size, batch_bytes)
+        for batch in batches:
+            if not batch: continue
+            if unsent: #the receiver is having problems, leave it alone
+                unsent.extend(batch)
+                continue
+            try:
+                if pool: d = pool.send(batch)
+                else: d = connect(host, port, protocol, batch, timeout=timeout)
+                wfd = defer.waitForDeferred(d)
+                yield wfd
+                wfd.getResult()
+                sent += len(batch)
+            except:
+                missed = getattr(Failure().value, 'unsent', batch)
+                sent += len(batch) - len(missed)
+                unsent.extend(missed)
+        yield (sent, unsent)
+
+
+    @staticmethod
+    @defer.deferredGenerator
+    def produceBatchedMetrics(host, port, protocol, timeout=5.0, pool=None,
+            batch_size=500, batch_bytes=65536):
+        """Produce ALL metrics of ALL metricID's to the endpoint, the points
+           of every metricID are gathered into as few frames as possible.
+           spooled points are replayed oldest first before new points are
+           sent. points that can not be sent go to the spool if there is
+           one, otherwise they are restored to their metricID's.
+
+           #1 a segment leaves the spool only once all of it was replayed,
+              what is left of it stays at the head of the spool.
+
+           @param host (string)
+           @param port (int)
+           @param protocol (class) - twisted.internet.protocol.Protocol
+           @param timeout (int|float) - timeout parameter for the protocol
+           @param pool (droned.protocols.graphite.GraphitePool) - optional
+           @param batch_size (int) - most points in one frame
+           @param batch_bytes (int) - rough upper bound of bytes in one frame
+
+           @callback (int) - how many metrics were sent
+           @errback N/A
+
+           @return defer.Deferred()
+        """
+        result = 0
+        spool = TimeSeriesData.spool
+        options = dict(timeout=timeout, pool=pool, batch_size=batch_size,
+                batch_bytes=batch_bytes)
+        pending = []
+        for obj in TimeSeriesData.pendingObjects():
+            d = obj.drain()
+            wfd = defer.waitForDeferred(d)
+            yield wfd
+            pending.extend(wfd.getResult())
+        unsent = []
+        while spool is not None and len(spool) and not unsent:
+            seq, records = spool.oldest()
+            points = [point for record in records for point in record]
+            d = TimeSeriesData.sendPoints(host, port, protocol, points, **options)
+            wfd = defer.waitForDeferred(d)
+            yield wfd
+            sent, unsent = wfd.getResult()
+            result += sent
+            if not unsent: spool.remove(seq) #1
+            elif sent: spool.rewrite(seq, [unsent])
+        if unsent: unsent = pending #still down, don't bother
+        elif pending:
+            d = TimeSeriesData.sendPoints(host, port, protocol, pending, **options)
+            wfd = defer.waitForDeferred(d)
+            yield wfd
+            sent, unsent = wfd.getResult()
+            result += sent
+        if unsent and spool is not None: spool.append(unsent)
+        elif unsent: TimeSeriesData.restoreAll(unsent)
         yield result
+
+
+    @staticmethod
+    def spoolAll():
+        """move every pending point into the spool, used on shutdown so
+           nothing is lost while the journal skips TimeSeriesData.
+
+           @return (int) - how many points were spooled
+        """
+        spool = TimeSeriesData.spool
+        if spool is None: return 0
+        points = []
+        for obj in TimeSeriesData.pendingObjects():
+            points.extend([(obj.metricID, item) for item in obj.dataPoints])
+            obj.dataPoints.clear()
+        if points: spool.append(points)
+        return len(points)
+
+
+    @staticmethod
+    def setRollups(rules):
+        """configure rollups, the first matching rule applies to a series.
+
+           @param rules (list) - [(regex, width, method), ...]
+        """
+        TimeSeriesData.rollups = [(re.compile(regex), int(width), method) \
+                for (regex, width, method) in rules]
+        for obj in TimeSeriesData.objects:
+            obj.rollup = TimeSeriesData.rollupFor(obj.metricID)
+
+
+    @staticmethod
+    def rollupFor(metricID):
+        """@return (Rollup) for metricID or None"""
+        for (regex, width, method) in TimeSeriesData.rollups:
+            if regex.match(metricID): return Rollup(width, method)
+        return None
+
+
+    @staticmethod
+    def pendingObjects():
+        """only series added to since the previous call, or still pending
+           from it, are looked at instead of every series ever created.
+
+           @return (list) - instances with points to send
+        """
+        dirty, TimeSeriesData.dirty = TimeSeriesData.dirty, set()
+        for obj in dirty:
+            if obj.pending and TimeSeriesData.isValid(obj):
+                TimeSeriesData.dirty.add(obj) #in case sending fails
+        return list(TimeSeriesData.dirty)
+
+
+    @staticmethod
+    def evictIdle(ttl):
+        """forget series that have not been added to for ttl seconds and
+           have nothing left to send.
+
+           @param ttl (int|float) - seconds
+
+           @return (int) - how many series were evicted
+        """
+        cutoff = time.time() - ttl
+        instances = TimeSeriesData._instanceMap
+        #one pass over the map, Entity.delete scans it for every instance
+        idle = [instanceID for instanceID, obj in instances.items() \
+                if not obj.pending and obj.touched < cutoff]
+        for instanceID in idle:
+            TimeSeriesData.dirty.discard(instances.pop(instanceID))
+        return len(idle)
+
+
+    @staticmethod
+    def restoreAll(points):
+        """hand points that could not be sent back to their metricID's
+
+           @param points (list) - [(metricID, (stamp, value)), ...]
+        """
+        byID = {}
+        for point in points:
+            byID.setdefault(point[0], []).append(point)
+        for metricID, metricPoints in byID.items():
+            TimeSeriesData(metricID).restore(metricPoints)
@@ -0,0 +1,132 @@
+###############################################################################
+#   Copyright 2006 to the present, Orbitz Worldwide, LLC.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+###############################################################################
+
+from bisect import insort
+import re
+
+__doc__ = """
+The current value of every exposed metric kept as OpenMetrics text.
+Producers update single samples as they are collected, the text of a
+family is only rebuilt when one of its samples changed and the whole
+exposition only when a family changed. Rendering a scrape returns the
+cached text.
+"""
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+invalid_name = re.compile('[^a-zA-Z0-9_:]')
+invalid_label = re.compile('[^a-zA-Z0-9_]')
+
+def metric_name(*parts):
+    """@return (string) a valid metric name made of the dotted parts"""
+    name = invalid_name.sub('_', '_'.join(parts))
+    if name[:1].isdigit(): name = '_' + name
+    return name
+
+
+def label_name(key):
+    """@return (string) a valid label name, unlike metric names no ':'"""
+    name = invalid_label.sub('_', key)
+    if name[:1].isdigit(): name = '_' + name
+    return name
+
+
+def format_labels(labels):
+    """@param labels (dict)
+       @return (string) - the label set, '' when there are none
+    """
+    if not labels: return ''
+    pairs = []
+    for key in sorted(labels):
+        value = str(labels[key]).replace('\\', '\\\\').replace('"', '\\"')
+        pairs.append('%s="%s"' % (label_name(key), value.replace('\n', '\\n')))
+    return '{%s}' % ','.join(pairs)
+
+
+def format_value(value):
+    value = float(value)
+    if value != value: return 'NaN'
+    if value == float('inf'): return '+Inf'
+    if value == float('-inf'): return '-Inf'
+    return repr(value)
+
+
+class Exposition(object):
+    """OpenMetrics families of samples.
+
+       #1 family -> [header, {labels: sample line}, cached text or None]
+    """
+    SUFFIX = {'counter': '_total'}
+
+    def __init__(self):
+        self.families = {} #1
+        self.order = [] #family names, sorted
+        self.kinds = {}
+        self.text = None
+
+    def set(self, name, value, labels='', kind='gauge', help=None):
+        """set the current value of a sample
+
+           @param name (string) - family name, see metric_name()
+           @param value (int|float)
+           @param labels (string) - see format_labels()
+           @param kind (string) - gauge, counter or unknown
+           @param help (string) - only used when the family is new
+        """
+        family = self.families.get(name)
+        if family is None:
+            header = '# TYPE %s %s\n' % (name, kind)
+            if help: header += '# HELP %s %s\n' % (name, help)
+            family = self.families[name] = [header, {}, None]
+            self.kinds[name] = kind
+            insort(self.order, name)
+        family[1][labels] = '%s%s%s %s\n' % (name,
+                self.SUFFIX.get(self.kinds[name], ''), labels,
+                format_value(value))
+        family[2] = None
+        self.text = None
+
+    def remove(self, name, labels=''):
+        """forget a sample, the family goes with its last sample"""
+        family = self.families.get(name)
+        if not family or labels not in family[1]: return
+        del family[1][labels]
+        family[2] = None
+        if not family[1]:
+            del self.families[name]
+            del self.kinds[name]
+            self.order.remove(name)
+        self.text = None
+
+    def render(self):
+        """@return (string) the exposition in OpenMetrics text format"""
+        if self.text is not None: return self.text
+        chunks = []
+        for name in self.order:
+            family = self.families[name]
+            if family[2] is None:
+                samples = family[1]
+                family[2] = family[0] + ''.join([samples[k] for k in sorted(samples)])
+            chunks.append(family[2])
+        chunks.append('# EOF\n')
+        self.text = ''.join(chunks)
+        return self.text
+
+#shared by every producer and the /metrics resource
+exposition = Exposition()
+
+__all__ = ['CONTENT_TYPE', 'Exposition', 'exposition', 'format_labels',
+        'label_name', 'metric_name']
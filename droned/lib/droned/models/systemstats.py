@@ -56,14 +56,18 @@ parent the protocol exists to ensure some consistency of data format.
 import time,os,sys
 import config
 import re
+import threading
+import math
 
 from zope.interface import implements, Interface, Attribute
 
 #the below are common imports you may not have need for them all and likely will need additional.
 from twisted.python.failure import Failure
 from twisted.python.log import err
-from twisted.internet import task
+from twisted.internet import task, threads, reactor
 from twisted.internet.task import LoopingCall
+from twisted.python.threadpool import ThreadPool
+from twisted.internet import defer
 from twisted.internet.defer import TimeoutError, deferredGenerator, waitForDeferred, maybeDeferred
 
 #these are typical droned objects. Same as twsited. Common are included but do not reprsent all imports.
@@ -72,11 +76,13 @@ from droned.logging import log, debug, err
 from droned.models.event import Event
 from droned.models.timedefs import Interval
 from droned.models.graphite import IDataPoint,DataPoint,TimeSeriesData
+from droned.models.openmetrics import exposition, metric_name, format_labels
 
 #kitt based imports
 from kitt.decorators import raises
 from kitt.util import ClassLoader
 from kitt.numeric.vectors import SimpleVectorTransformLoader, VectorTransform 
+from kitt.numeric.buffers import RingBuffer
 
 try:
     import psutil
@@ -90,6 +96,143 @@ except:
 class InvalidStatBlockDefinition(Exception):pass
 class InvalidOutputBlockDefinition(Exception):pass
 
+
+class SampleSnapshot(object):
+    '''a single reading of the kernel sources used by the stat blocks.
+       each source (/proc/stat, /proc/diskstats, /proc/net/dev, ...) is
+       read the first time a block or metric handler asks for it and the
+       parsed result is handed to every later caller in the same tick.
+    '''
+    def __init__(self,stamp):
+        self.time = stamp
+        self._cache = {}
+        self._lock = threading.Lock() #blocks collect from the worker pool
+
+    def _read(self,key,func,*args,**kwargs):
+        self._lock.acquire()
+        try:
+            if key not in self._cache:
+                self._cache[key] = func(*args,**kwargs)
+            return self._cache[key]
+        finally:
+            self._lock.release()
+
+    def cpu_times(self,percpu=False):
+        return self._read(("cpu_times",percpu),psutil.cpu_times,percpu=percpu)
+
+    def disk_partitions(self):
+        return self._read(("disk_partitions",),psutil.disk_partitions)
+
+    def disk_usage(self,partition):
+        return self._read(("disk_usage",partition),psutil.disk_usage,partition)
+
+    def disk_io_counters(self,perdisk=False):
+        return self._read(("disk_io_counters",perdisk),
+                          psutil.disk_io_counters,perdisk=perdisk)
+
+    def network_io_counters(self,pernic=False):
+        return self._read(("network_io_counters",pernic),
+                          psutil.network_io_counters,pernic=pernic)
+
+    def phymem_usage(self):
+        return self._read(("phymem_usage",),psutil.phymem_usage)
+
+    def virtmem_usage(self):
+        return self._read(("virtmem_usage",),psutil.virtmem_usage)
+
+    def phymem_buffers(self):
+        return self._read(("phymem_buffers",),psutil.phymem_buffers)
+
+    def cached_phymem(self):
+        return self._read(("cached_phymem",),psutil.cached_phymem)
+
+
+class SystemSampler(object):
+    '''hands out the current SampleSnapshot. every StatBlock shares the
+       module level `sampler` so blocks ticking together (they are all
+       started at service load) read each kernel source once per tick
+       instead of once per block per metric.
+       the sampler also owns the bounded worker pool collection runs in
+       so that slow reads never block the reactor.
+       #1 a snapshot older than max_age belongs to a previous tick.
+       #2 until the systemstats service starts a pool use the reactor's.
+    '''
+    def __init__(self,max_age=0.5):
+        self.max_age = max_age
+        self.current = None
+        self.pool = None
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        self._lock.acquire()
+        try:
+            now = time.time()
+            if self.current is None or (now - self.current.time) > self.max_age: #1
+                self.current = SampleSnapshot(now)
+            return self.current
+        finally:
+            self._lock.release()
+
+    def start_pool(self,size):
+        '''start a worker pool of at most `size` threads for collection.'''
+        self.stop_pool()
+        self.pool = ThreadPool(minthreads=1,maxthreads=max(1,int(size)),
+                               name="systemstats")
+        self.pool.start()
+
+    def stop_pool(self):
+        if not self.pool: return
+        self.pool.stop()
+        self.pool = None
+
+    def run(self,func,*args,**kwargs):
+        '''run func in the collection pool.
+           @return: <Deferred> fires in the reactor with func's result.
+        '''
+        pool = self.pool or reactor.getThreadPool() #2
+        return threads.deferToThreadPool(reactor,pool,func,*args,**kwargs)
+
+sampler = SystemSampler()
+
+
+class MetricSeries(object):
+    '''all samples saved for one series of a StatBlock (a metric, or a
+       metric on one partition/cpu/nic/pid) between two outputs.
+       samples are stored in a preallocated ring buffer, the meta data
+       is stored once by keeping only the most recently saved DataPoint.
+    '''
+    def __init__(self,name,capacity):
+        self.name = name
+        self.buffer = RingBuffer(capacity)
+        self.datapoint = None #meta data template
+        self.last_value = None #survives clear(), used by adaptive collection
+        self.family = None #exposition family and labels, see StatBlock.expose
+        self.labels = ''
+        self.kind = 'gauge'
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def save(self,datapoint):
+        self.datapoint = datapoint
+        self.last_value = datapoint.value
+        self.buffer.append(datapoint.time,datapoint.value)
+
+    def datapoints(self):
+        '''yields the template DataPoint once per stored sample, moved to
+           that sample and run through its meta data validator. the same
+           object is yielded every time so callers must not hold on to it.
+        '''
+        datapoint = self.datapoint
+        for stamp,value in self.buffer:
+            datapoint.set_sample(stamp,value)
+            datapoint.meta_data_validator(datapoint)
+            yield datapoint
+
+    def clear(self):
+        self.buffer.clear()
+
+
 class IStatBlock(Interface):
     TYPE = Attribute("<string> name of STAT>TYPE block this object supports/backs.")
     
@@ -177,6 +320,7 @@ class StatBlock(object):
     '''
     implements(IStatBlock)
     TYPE = "null"
+    COUNTER_METRICS = () #cumulative metrics, exposed as counters
     
     @raises(InvalidStatBlockDefinition)
     def __init__(self,block):
@@ -186,6 +330,7 @@ class StatBlock(object):
               question for its value NOW. 
         '''
         self.config_block = block
+        self.NAME = str(block.get('NAME',self.TYPE)) #tells blocks apart on /metrics
         self.PROVIDED_METRICS = {} #1
         self.REQUESTED_METRICS = []
         self.COLLECT_INTERVAL = Interval(block.get("COLLECT_INTERVAL","60s"))
@@ -193,15 +338,38 @@ class StatBlock(object):
         self.OUTPUTS = []
         self.PROTOCOLS = [BasicMetaData()]
         self.AGGREGATION_METHOD = self.get_aggregator(block.get('AGGREGATION_METHOD',"none"))
-        self.requested_metric_data = {} #holds the intermediate data
+        self.requested_metric_data = {} #holds the intermediate MetricSeries
+        self.sampler = sampler #shared across all blocks
+        self.snapshot = self.sampler.snapshot()
+        self.collecting = defer.succeed(None)
+        #adaptive collection, see adapt_interval
+        self.MIN_COLLECT_INTERVAL = None
+        if 'MIN_COLLECT_INTERVAL' in block:
+            self.MIN_COLLECT_INTERVAL = Interval(block['MIN_COLLECT_INTERVAL'])
+        self.ADAPTIVE_CHANGE = float(block.get('ADAPTIVE_CHANGE',0.0))
+        thresholds = block.get('ADAPTIVE_THRESHOLD',{})
+        assert isinstance(thresholds,dict), "ADAPTIVE_THRESHOLD maps metric names to values"
+        self.ADAPTIVE_THRESHOLD = dict((self.metric_key(m),float(v)) \
+                for m,v in thresholds.items())
+        self.collect_interval = self.COLLECT_INTERVAL.seconds
+        fastest = self.collect_interval
+        if self.MIN_COLLECT_INTERVAL: fastest = self.MIN_COLLECT_INTERVAL.seconds
+        #enough room for every sample of an output interval plus a late one
+        self.series_capacity = int(math.ceil(
+            self.OUTPUT_INTERVAL.seconds / max(fastest,1))) + 1
         #let the fun begin
         self.REQUESTED_METRICS = block['METRICS']
         self.collect_task = task.LoopingCall(self.collect)
-        self.collect_task.start(self.COLLECT_INTERVAL.seconds,False)
+        self.collect_task.start(self.collect_interval,False)
         self.output_task = task.LoopingCall(self.output)
         self.output_task.start(self.OUTPUT_INTERVAL.seconds,False)
         self.current_log_level = "info"
-        self.log_levels = ("debug","info","debug")
+        self.log_levels = ("info","error","debug")
+        self.diagnostics = False #per datapoint logging, see set_log_level
+        self.points_saved = 0
+        self.points_dropped = 0 #failed protocol validation
+        self.points_sent = 0 #handed to an output
+        self.set_log_level(block.get("LOG_LEVEL","info"))
         outputs = []
         for OUTPUT in block['OUTPUTS']:
             if 'OUTPUT' in OUTPUT:
@@ -219,8 +387,21 @@ class StatBlock(object):
                     break
                 
     def set_log_level(self,level):
+        '''per datapoint diagnostics are only built when the
+           level would actually log them, the hot path keeps
+           counters instead. see counters().
+        '''
         if level in self.log_levels:
             self.current_log_level = level
+            self.diagnostics = level != "info"
+            
+    def counters(self):
+        '''@return: <dict> datapoint counters since this block started.'''
+        return {
+            'points_saved': self.points_saved,
+            'points_dropped': self.points_dropped,
+            'points_sent': self.points_sent,
+        }
     
     def info(self,msg):
         log(msg)
@@ -265,11 +446,36 @@ class StatBlock(object):
            valid requested metrics. Those data points are stored in
            the requested_metric_data object to be shipped off to one
            or more outputs after OUTPU_INTERVAL seconds.
+           the reads happen in gather() on the sampler's worker pool,
+           the results come back to the reactor as one batch which is
+           then saved by save_batch(). if the previous tick is still
+           gathering this tick is skipped.
+        '''
+        if not self.collecting.called:
+            self.error("%s stats are still being gathered, skipping this interval" % self.TYPE)
+            return
+        self.snapshot = self.sampler.snapshot()
+        self.collecting = self.sampler.run(self.gather)
+        self.collecting.addCallback(self.save_batch)
+        self.collecting.addErrback(self.collect_failed)
+        
+    def collect_failed(self,failure):
+        self.info("Error while collecting %s stats: %s" % (self.TYPE,failure.getErrorMessage()))
+        return None
+    
+    def gather(self):
+        '''runs in the collection pool. calls each requested metric
+           handler and returns every data point they saved as a list
+           of (metric_name,datapoint) tuples. nothing in here may touch
+           reactor owned state (events, requested_metric_data).
            #1 fully qualified name of provided metric from config
            #2 short name of metric in case fqn was given
            #3 actual name we found (hopefuly) in provided_metrics 
               to match up logic of request(config) and provide(code) sides.
+           metric handlers should read kernel sources through self.snapshot
+           so the read is shared with every other block in this tick.
         '''
+        batch = []
         pm = self.PROVIDED_METRICS
         for m in self.REQUESTED_METRICS:
             fqn = self.TYPE + "." + m #1
@@ -281,29 +487,128 @@ class StatBlock(object):
                     break
             if not matched_name: continue
             try: 
-                if matched_name not in self.requested_metric_data:
-                    self.requested_metric_data[matched_name] = []
-                collected_metrics = self.requested_metric_data[matched_name]
                 handler = pm[matched_name]
-                def save(data_point):
+                def save(data_point,matched_name=matched_name):
                     '''this allows us to ensure output consistency'''
                     err = "Invalid return type got %s expected IDataPoint"
                     assert IDataPoint.implementedBy(data_point.__class__), err % type(data_point)
-                    self.on_save(data_point)
-                    if not self.validate_protocols(data_point): return
-                    Event('datapoint_save').fire(datapoint=data_point)
-                    collected_metrics.append(data_point)
-                    self.save_diag_output(data_point)
+                    batch.append((matched_name,data_point))
                 handler(save)
             except:
-                err = Failure().value
                 fn = pm[matched_name].__name__
                 self.error("Error while loading data point via %s" % fn)
                 self.debug("")
                 continue
-        #perform exit clean up of any empty metrics.
-        nulls =[k for k,v in self.requested_metric_data.items() if not v ]
-        for null in nulls: del self.requested_metric_data[null]
+        return batch
+    
+    def save_batch(self,batch):
+        '''runs in the reactor with the output of gather().
+           protocol checks, the datapoint_save event and storage
+           all happen here.
+        '''
+        volatile = False
+        for matched_name,data_point in batch:
+            self.on_save(data_point)
+            if not self.validate_protocols(data_point):
+                self.points_dropped += 1
+                continue
+            Event('datapoint_save').fire(datapoint=data_point)
+            key = self.series_key(matched_name,data_point)
+            series = self.requested_metric_data.get(key)
+            if series is None:
+                series = MetricSeries(key,self.series_capacity)
+                series.family = self.series_family(matched_name)
+                series.labels = format_labels(self.series_labels(data_point))
+                series.kind = self.series_kind(matched_name)
+                self.requested_metric_data[key] = series
+            if self.MIN_COLLECT_INTERVAL and not volatile:
+                volatile = self.is_volatile(matched_name,series.last_value,data_point.value)
+            series.save(data_point)
+            exposition.set(series.family,data_point.value,series.labels,kind=series.kind)
+            self.points_saved += 1
+            if self.diagnostics: self.save_diag_output(data_point)
+        if self.MIN_COLLECT_INTERVAL: self.adapt_interval(volatile)
+        self.expose_counters()
+            
+    def is_volatile(self,metric,previous,value):
+        '''@return: <bool> True if a sample crossed the ADAPTIVE_THRESHOLD
+           of its metric or changed by more than the ADAPTIVE_CHANGE
+           fraction since the previous sample of its series.
+        '''
+        try:
+            threshold = self.ADAPTIVE_THRESHOLD.get(self.metric_key(metric))
+            if threshold is not None and value >= threshold:
+                return True
+            if not self.ADAPTIVE_CHANGE or previous is None: return False
+            base = abs(previous) or 1.0
+            return abs(value - previous) / float(base) >= self.ADAPTIVE_CHANGE
+        except TypeError: return False
+        
+    def adapt_interval(self,volatile):
+        '''drops the collect interval to MIN_COLLECT_INTERVAL as soon as a
+           volatile sample is seen, then doubles it every quiet tick until
+           it is back at COLLECT_INTERVAL.
+        '''
+        if volatile: interval = self.MIN_COLLECT_INTERVAL.seconds
+        else: interval = min(self.collect_interval * 2,self.COLLECT_INTERVAL.seconds)
+        if interval == self.collect_interval: return
+        self.collect_interval = interval
+        if self.diagnostics:
+            self.error("%s collect interval is now %ss" % (self.TYPE,interval))
+        if not self.collect_task.running: return
+        self.collect_task.stop()
+        self.collect_task.start(interval,False)
+    
+    def series_key(self,metric,datapoint):
+        '''name of the series a saved datapoint belongs to. blocks that
+           report one metric for several partitions/cpus/etc. override
+           this so each of those is stored and aggregated on its own.
+        '''
+        return metric
+    
+    def series_family(self,metric):
+        '''@return: <string> /metrics family of a requested metric, which
+           may be given with or without the block TYPE in front of it.
+        '''
+        if metric.startswith(self.TYPE + "."): return metric_name('droned',metric)
+        return metric_name('droned',self.TYPE,metric)
+        
+    def metric_key(self,metric):
+        '''@return: <string> a requested metric without the block TYPE
+           in front of it.
+        '''
+        if metric.startswith(self.TYPE + "."): return metric[len(self.TYPE) + 1:]
+        return metric
+        
+    def series_kind(self,metric):
+        '''@return: <string> counter for the COUNTER_METRICS, which only
+           ever grow, gauge for everything else.
+        '''
+        if self.metric_key(metric) in self.COUNTER_METRICS: return 'counter'
+        return 'gauge'
+        
+    def series_labels(self,datapoint):
+        '''@return: <dict> labels telling the series of a datapoint apart
+           on the /metrics page, blocks overriding series_key() override
+           this as well.
+        '''
+        return {}
+        
+    def expose_counters(self):
+        '''publish counters() on the /metrics page.'''
+        labels = format_labels({'block': self.NAME})
+        for name,value in self.counters().items():
+            exposition.set(metric_name('droned_systemstats',name),value,labels,kind='counter')
+    
+    def unexpose(self):
+        '''remove the counters and series of this block from the /metrics
+           page, used when the block stops.
+        '''
+        labels = format_labels({'block': self.NAME})
+        for name in self.counters():
+            exposition.remove(metric_name('droned_systemstats',name),labels)
+        for series in self.requested_metric_data.values():
+            exposition.remove(series.family,series.labels)
     
     def save_diag_output(self,datapoint):
         '''this method is used to augment diagnostic statements
@@ -326,7 +631,7 @@ class StatBlock(object):
     def enable_collect(self):
         '''enables the collect task. on by default
         '''
-        self.collect_task.start(self.COLLECT_INTERVAL.seconds)
+        self.collect_task.start(self.collect_interval)
     
     def disable_output(self):
         '''disables the output task. on by default
@@ -350,55 +655,35 @@ class StatBlock(object):
         datapoint.meta_data.get("")
         
     def clear_data(self):
-        '''thank goodness for memory mgt '''
-        self.requested_metric_data = {}
+        '''empty every series, their buffers are reused next interval.
+           series that received nothing during the last interval
+           (partitions unmounted, processes gone) are dropped.
+        '''
+        for key,series in self.requested_metric_data.items():
+            if not len(series):
+                exposition.remove(series.family,series.labels)
+                del self.requested_metric_data[key]
+            else: series.clear()
             
     def aggregate_data(self):
-        updates = {}
-        for metric,datapoints in self.requested_metric_data.items():
-            values = [d.value for d in datapoints]
-            values = self.AGGREGATION_METHOD.compute(values)
-            if len(values) > len(datapoints): 
-                output_array = self.fill_meta_data(datapoints,values)
-            elif len(values) < len(datapoints): 
-                output_array = self.merge_meta_data(datapoints,values)
-            else: 
-                for d,v in zip(datapoints,values): d.value = v
-                output_array = datapoints
-            for o in output_array:
-                o.meta_data_validator(o)
-            updates[metric] = output_array
-        self.requested_metric_data.update(updates)
+        '''apply AGGREGATION_METHOD to every series in place. all series
+           are handed to the transform at once so it can batch them. when
+           the aggregate is shorter than the series it takes the stamps of
+           the newest samples.
+        '''
+        batch = [s for s in self.requested_metric_data.values() if len(s)]
+        if not batch: return
+        stamps = [s.buffer.get_stamps() for s in batch]
+        vectors = [s.buffer.get_values() for s in batch]
+        results = self.AGGREGATION_METHOD.compute_many(vectors,stamps)
+        for series,times,values in zip(batch,stamps,results):
+            if len(values) <= len(times): times = times[len(times) - len(values):]
+            while len(times) < len(values): times.append(times[-1])
+            series.buffer.replace(times,values)
         
     def after_aggregation(self,datapoint):
         return None
         
-    def fill_meta_data(self,datapoints,values):
-        '''values grew during aggregation. use last datapoint
-           as template to make new datapoints for extra values.
-        '''
-        diff = len(datapoints) - len(values)
-        last = datapoints[-1]
-        for value in values[diff:]:
-            datapoints.append(DataPoint(value=value,meta_data=last.meta_data.copy()))
-        return datapoints
-        
-    def merge_meta_data(self,datapoints,values):
-        '''values shrank during aggregation. this is expected.
-           merge all meta data fields and return the last
-           len(values) datapints with the updated meta data
-           and values.
-        '''
-        diff = len(datapoints) - len(values)
-        rest = datapoints[diff:]
-        updates = {}
-        for d in datapoints:
-            updates.update(d.meta_data)
-            for d,v in zip(rest,values):
-                d.value = v
-                d.meta_data.update(updates)
-        return rest
-    
     def remove_invalid_request_metrics(self):
         '''see interface for doc.
         '''
@@ -426,6 +711,7 @@ class StatBlock(object):
     def validate_protocols(self,datapoint):
         for p in self.PROTOCOLS:
             if not p.conforms(datapoint):
+                if not self.diagnostics: return False
                 msg = "datapoint captured in usage_percent does not conform "
                 msg += "to protocol %s" % p
                 self.error(msg)
@@ -435,6 +721,8 @@ class StatBlock(object):
         
 class DiskStat(StatBlock):
     TYPE = "disk"
+    COUNTER_METRICS = ("counters.read","counters.write","bytes.read",
+            "bytes.write","time.read","time.write")
     
     @raises(InvalidStatBlockDefinition)
     def __init__(self,block):
@@ -466,26 +754,20 @@ class DiskStat(StatBlock):
         if partition.endswith(sep):partition = partition[:-1]
         return partition.replace(sep,"_")
     
-    def aggregate_data(self):
-        '''disk data represents a special case and we need to do a
-           custom aggregation as a result. even though a metric
+    def series_key(self,metric,datapoint):
+        '''disk data represents a special case. even though a metric
            requested may be the same, example usage.percent
            that metric will have multiple partitions and should
-           be treated as different metrics. so we need to aggregate
-           by partition and metric type. 
+           be treated as different metrics. so we need to store
+           and aggregate by partition and metric type. 
         '''
-        partition_groups = {}
-        for metric,datapoints in self.requested_metric_data.items():
-            for datapoint in datapoints:
-                mpID = metric + "::" + datapoint.partition
-                if mpID not in partition_groups:
-                    partition_groups[mpID]  = []
-                partition_groups[mpID].append(datapoint)
-        self.requested_metric_data = partition_groups
-        StatBlock.aggregate_data(self)
+        return metric + "::" + datapoint.partition
+        
+    def series_labels(self,datapoint):
+        return {'partition': datapoint.partition}
         
     def partition_map(self,name,func):
-        pmask = [a.mountpoint for a in psutil.disk_partitions()]
+        pmask = [a.mountpoint for a in self.snapshot.disk_partitions()]
         for partition in self.PARTITIONS:
             if partition not in pmask: continue
             try: func(partition)
@@ -495,9 +777,9 @@ class DiskStat(StatBlock):
                 self.debug("")
     
     def get_disk_by_partition(self,partition):
-        disks = psutil.disk_io_counters(perdisk=True).keys()
+        disks = self.snapshot.disk_io_counters(perdisk=True).keys()
         findID = ""
-        for p in psutil.disk_partitions():
+        for p in self.snapshot.disk_partitions():
             if p.mountpoint != partition: continue
             findID = p.device.split("/")[-1]
             if findID in disks: break 
@@ -514,7 +796,7 @@ class DiskStat(StatBlock):
             datapoint.meta_data['usage.percent'] = datapoint.value
             
         def _run(partition):
-            pobj = psutil.disk_usage(partition)
+            pobj = self.snapshot.disk_usage(partition)
             meta = {"variables": ["partition","disk.usage.percent","usage.percent"],
                     "partition":self.format_partition(partition),
                     "disk.usage.percent":pobj.percent,
@@ -530,7 +812,7 @@ class DiskStat(StatBlock):
             datapoint.meta_data['usage.free'] = datapoint.value
             
         def _run(partition):
-            pobj = psutil.disk_usage(partition)
+            pobj = self.snapshot.disk_usage(partition)
             meta = {"variables": ["partition","disk.usage.free","usage.free"],
                     "partition":self.format_partition(partition),
                     "disk.usage.free":pobj.free,
@@ -546,7 +828,7 @@ class DiskStat(StatBlock):
             datapoint.meta_data['usage.total'] = datapoint.value
          
         def _run(partition):
-            pobj = psutil.disk_usage(partition)
+            pobj = self.snapshot.disk_usage(partition)
             meta = {"variables": ["partition","disk.usage.total","usage.total"],
                     "partition":self.format_partition(partition),
                     "disk.usage.total":pobj.total,
@@ -562,7 +844,7 @@ class DiskStat(StatBlock):
             datapoint.meta_data['usage.used'] = datapoint.value
          
         def _run(partition):
-            pobj = psutil.disk_usage(partition)
+            pobj = self.snapshot.disk_usage(partition)
             meta = {"variables": ["partition","disk.usage.used","usage.used"],
                     "partition":self.format_partition(partition),
                     "disk.usage.used":pobj.used,
@@ -573,7 +855,7 @@ class DiskStat(StatBlock):
         self.partition_map("disk.usage.used", _run)
         
     def counters_read(self,save):
-        disk_stats = psutil.disk_io_counters(perdisk=True) 
+        disk_stats = self.snapshot.disk_io_counters(perdisk=True)
         def _validate(datapoint):
             datapoint.meta_data['disk.counters.read'] = datapoint.value
             datapoint.meta_data['counters.read'] = datapoint.value
@@ -592,7 +874,7 @@ class DiskStat(StatBlock):
         self.partition_map("disk.counters.read", _run)
         
     def counters_write(self,save):
-        disk_stats = psutil.disk_io_counters(perdisk=True) 
+        disk_stats = self.snapshot.disk_io_counters(perdisk=True)
         def _validate(datapoint):
             datapoint.meta_data['disk.counters.write'] = datapoint.value
             datapoint.meta_data['counters.write'] = datapoint.value
@@ -611,7 +893,7 @@ class DiskStat(StatBlock):
         self.partition_map("disk.counters.write", _run)
         
     def bytes_read(self,save):
-        disk_stats = psutil.disk_io_counters(perdisk=True) 
+        disk_stats = self.snapshot.disk_io_counters(perdisk=True)
         def _validate(datapoint):
             datapoint.meta_data['disk.bytes.read'] = datapoint.value
             datapoint.meta_data['bytes.read'] = datapoint.value
@@ -630,7 +912,7 @@ class DiskStat(StatBlock):
         self.partition_map("disk.bytes.read", _run)
         
     def bytes_write(self,save):
-        disk_stats = psutil.disk_io_counters(perdisk=True) 
+        disk_stats = self.snapshot.disk_io_counters(perdisk=True)
         def _validate(datapoint):
             datapoint.meta_data['disk.bytes.write'] = datapoint.value
             datapoint.meta_data['bytes.write'] = datapoint.value
@@ -649,7 +931,7 @@ class DiskStat(StatBlock):
         self.partition_map("disk.bytes.write", _run)
         
     def time_read(self,save):
-        disk_stats = psutil.disk_io_counters(perdisk=True) 
+        disk_stats = self.snapshot.disk_io_counters(perdisk=True)
         def _validate(datapoint):
             datapoint.meta_data['disk.time.read'] = datapoint.value
             datapoint.meta_data['time.read'] = datapoint.value
@@ -668,7 +950,7 @@ class DiskStat(StatBlock):
         self.partition_map("disk.time.read", _run)
         
     def time_write(self,save):
-        disk_stats = psutil.disk_io_counters(perdisk=True) 
+        disk_stats = self.snapshot.disk_io_counters(perdisk=True)
         def _validate(datapoint):
             datapoint.meta_data['disk.time.write'] = datapoint.value
             datapoint.meta_data['time.write'] = datapoint.value
@@ -689,6 +971,8 @@ class DiskStat(StatBlock):
         
 class CpuStat(StatBlock):
     TYPE = "cpu"
+    COUNTER_METRICS = ("time.user","time.system","time.nice","time.iowait",
+            "time.irq","time.softirq")
     def __init__(self,block):
         global SYSSTAT_PSUTIL_AVAILABLE
         if not SYSSTAT_PSUTIL_AVAILABLE: 
@@ -722,26 +1006,16 @@ class CpuStat(StatBlock):
         per_check = bool(self.PER_CPU or self.CPUS)
         self.cpu_percent = psutil.cpu_percent(interval=0,percpu=per_check)
         
-    def aggregate_data(self):
-        '''disk data represents a special case and we need to do a
-           custom aggregation as a result. even though a metric
-           requested may be the same, example usage.percent
-           that metric will have multiple partitions and should
-           be treated as different metrics. so we need to aggregate
-           by partition and metric type. 
+    def series_key(self,metric,datapoint):
+        '''like disk data every cpu is its own series when
+           cpus are reported individually.
         '''
-        if not self.PER_CPU and not self.CPUS:
-                StatBlock.aggregate_data(self)
-                return
-        sub_groups = {}
-        for metric,datapoints in self.requested_metric_data.items():
-            for datapoint in datapoints:
-                mpID = metric + "::" + datapoint.cpu
-                if mpID not in sub_groups:
-                    sub_groups[mpID]  = []
-                sub_groups[mpID].append(datapoint)
-        self.requested_metric_data = sub_groups
-        StatBlock.aggregate_data(self)
+        if not self.PER_CPU and not self.CPUS: return metric
+        return metric + "::" + datapoint.cpu
+        
+    def series_labels(self,datapoint):
+        if not self.PER_CPU and not self.CPUS: return {}
+        return {'cpu': datapoint.cpu}
         
     def cpu_map(self,name,func):
         '''since cpu stat count costs time , our most expensive resource
@@ -749,7 +1023,7 @@ class CpuStat(StatBlock):
            to stat generators.
         '''
         if not self.PER_CPU and not self.CPUS:
-            cputime = psutil.cpu_times()
+            cputime = self.snapshot.cpu_times()
             try: 
                 func(cpu_str='ALL',cpu_int=-1,cpu_pct=self.cpu_percent,cpu_times=cputime)
                 return
@@ -758,7 +1032,7 @@ class CpuStat(StatBlock):
                 self.error(msg)
                 self.debug("")
         else:
-            cputime = psutil.cpu_times(percpu=True)
+            cputime = self.snapshot.cpu_times(percpu=True)
             cpu_count = len(self.cpu_percent)
             for cpu in range(cpu_count):
                 if self.CPUS and cpu not in self.CPUS: continue
@@ -915,7 +1189,7 @@ class MemoryStat(StatBlock):
     def phymem_free(self,save):
         ln = "memory.phymem.free"
         sn = "phymem.free"
-        value = psutil.phymem_usage().free
+        value = self.snapshot.phymem_usage().free
         def _validate(datapoint):
             datapoint.meta_data[ln] = datapoint.value
             datapoint.meta_data[sn] = datapoint.value
@@ -930,7 +1204,7 @@ class MemoryStat(StatBlock):
     def phymem_used(self,save):
         ln = "memory.phymem.used"
         sn = "phymem.used"
-        value = psutil.phymem_usage().used
+        value = self.snapshot.phymem_usage().used
         def _validate(datapoint):
             datapoint.meta_data[ln] = datapoint.value
             datapoint.meta_data[sn] = datapoint.value
@@ -945,7 +1219,7 @@ class MemoryStat(StatBlock):
     def phymem_total(self,save):
         ln = "memory.phymem.total"
         sn = "phymem.total"
-        value = psutil.phymem_usage().free
+        value = self.snapshot.phymem_usage().free
         def _validate(datapoint):
             datapoint.meta_data[ln] = datapoint.value
             datapoint.meta_data[sn] = datapoint.value
@@ -960,7 +1234,7 @@ class MemoryStat(StatBlock):
     def phymem_percent(self,save):
         ln = "memory.phymem.percent"
         sn = "phymem.percent"
-        value = psutil.phymem_usage().percent
+        value = self.snapshot.phymem_usage().percent
         def _validate(datapoint):
             datapoint.meta_data[ln] = datapoint.value
             datapoint.meta_data[sn] = datapoint.value
@@ -975,7 +1249,7 @@ class MemoryStat(StatBlock):
     def phymem_buffers(self,save):
         ln = "memory.phymem.buffers"
         sn = "phymem.buffers"
-        value = psutil.phymem_buffers()
+        value = self.snapshot.phymem_buffers()
         def _validate(datapoint):
             datapoint.meta_data[ln] = datapoint.value
             datapoint.meta_data[sn] = datapoint.value
@@ -990,7 +1264,7 @@ class MemoryStat(StatBlock):
     def phymem_cached(self,save):
         ln = "memory.phymem.cached"
         sn = "phymem.cached"
-        value = psutil.cached_phymem()
+        value = self.snapshot.cached_phymem()
         def _validate(datapoint):
             datapoint.meta_data[ln] = datapoint.value
             datapoint.meta_data[sn] = datapoint.value
@@ -1005,7 +1279,7 @@ class MemoryStat(StatBlock):
     def virtmem_total(self,save):
         ln = "memory.virtmem.total"
         sn = "virtmem.total"
-        value = psutil.virtmem_usage().total
+        value = self.snapshot.virtmem_usage().total
         def _validate(datapoint):
             datapoint.meta_data[ln] = datapoint.value
             datapoint.meta_data[sn] = datapoint.value
@@ -1020,7 +1294,7 @@ class MemoryStat(StatBlock):
     def virtmem_free(self,save):
         ln = "memory.virtmem.free"
         sn = "virtmem.free"
-        value = psutil.virtmem_usage().free
+        value = self.snapshot.virtmem_usage().free
         def _validate(datapoint):
             datapoint.meta_data[ln] = datapoint.value
             datapoint.meta_data[sn] = datapoint.value
@@ -1035,7 +1309,7 @@ class MemoryStat(StatBlock):
     def virtmem_used(self,save):
         ln = "memory.virtmem.used"
         sn = "virtmem.used"
-        value = psutil.virtmem_usage().used
+        value = self.snapshot.virtmem_usage().used
         def _validate(datapoint):
             datapoint.meta_data[ln] = datapoint.value
             datapoint.meta_data[sn] = datapoint.value
@@ -1050,7 +1324,7 @@ class MemoryStat(StatBlock):
     def virtmem_percent(self,save):
         ln = "memory.virtmem.percent"
         sn = "virtmem.percent"
-        value = psutil.virtmem_usage().percent
+        value = self.snapshot.virtmem_usage().percent
         def _validate(datapoint):
             datapoint.meta_data[ln] = datapoint.value
             datapoint.meta_data[sn] = datapoint.value
@@ -1065,6 +1339,7 @@ class MemoryStat(StatBlock):
 
 class NetworkStat(StatBlock):
     TYPE = "network"
+    COUNTER_METRICS = ("bytes.sent","bytes.recv","packets.sent","packets.recv")
     def __init__(self,block):
         global SYSSTAT_PSUTIL_AVAILABLE
         if not SYSSTAT_PSUTIL_AVAILABLE: 
@@ -1085,26 +1360,16 @@ class NetworkStat(StatBlock):
         self.PROTOCOLS += [NetworkStatMetaData()]
         self.remove_invalid_request_metrics()
         
-    def aggregate_data(self):
-        '''disk data represents a special case and we need to do a
-           custom aggregation as a result. even though a metric
-           requested may be the same, example usage.percent
-           that metric will have multiple partitions and should
-           be treated as different metrics. so we need to aggregate
-           by partition and metric type. 
+    def series_key(self,metric,datapoint):
+        '''like disk data every interface is its own series when
+           interfaces are reported individually.
         '''
-        if not self.PER_INTERFACE and not self.INTERFACES:
-                StatBlock.aggregate_data(self)
-                return
-        sub_groups = {}
-        for metric,datapoints in self.requested_metric_data.items():
-            for datapoint in datapoints:
-                mpID = metric + "::" + datapoint.nic
-                if mpID not in sub_groups:
-                    sub_groups[mpID]  = []
-                sub_groups[mpID].append(datapoint)
-        self.requested_metric_data = sub_groups
-        StatBlock.aggregate_data(self)
+        if not self.PER_INTERFACE and not self.INTERFACES: return metric
+        return metric + "::" + datapoint.nic
+        
+    def series_labels(self,datapoint):
+        if not self.PER_INTERFACE and not self.INTERFACES: return {}
+        return {'nic': datapoint.nic}
         
     def nic_map(self,name,func):
         '''since cpu stat count costs time , our most expensive resource
@@ -1112,7 +1377,7 @@ class NetworkStat(StatBlock):
            to stat generators.
         '''
         if not self.PER_INTERFACE and not self.INTERFACES:
-            nic_counters = psutil.network_io_counters(pernic=False)
+            nic_counters = self.snapshot.network_io_counters(pernic=False)
             try: 
                 func("ALL",nic_counters)
                 return
@@ -1121,7 +1386,7 @@ class NetworkStat(StatBlock):
                 self.error(msg)
                 self.debug("")
         else:
-            nic_counters = psutil.network_io_counters(pernic=True)
+            nic_counters = self.snapshot.network_io_counters(pernic=True)
             for nic in nic_counters:
                 nic_str = nic.split(":")[0]
                 if self.INTERFACES and nic not in self.INTERFACES: continue
@@ -1208,8 +1473,139 @@ class NetworkStat(StatBlock):
         self.nic_map(ln, _run)
         
     
+class ProcessIdentity(object):
+    '''the attributes of a process that are fixed for its lifetime,
+       read once when the pid is first seen. a process we may not 
+       inspect is kept as inaccessible so it is not retried every tick.
+    '''
+    def __init__(self,proc,create_time):
+        self.proc = proc
+        self.pid = proc.pid
+        self.create_time = create_time
+        self.static_match = None #filled in by ProcessStat.apply_filters
+        try:
+            self.exe = proc.exe
+            self.name = proc.name
+            self.cmdline = proc.cmdline
+            self.user = proc.username
+            self.accessible = True
+        except psutil.AccessDenied:
+            self.accessible = False
+            
+            
+class ProcessSample(object):
+    '''the values read from one process during one tick. each psutil 
+       accessor is called at most once no matter how many metrics are
+       derived from it.
+       #1 a reader that fails only loses its own metric.
+    '''
+    def __init__(self,ident,status_map):
+        self.ident = ident
+        self.proc = ident.proc
+        self.status_map = status_map
+        self.values = {}
+        self.errors = []
+        self._cache = {}
+        self._meta = None
+        
+    def _read(self,key,func,*args,**kwargs):
+        if key not in self._cache:
+            self._cache[key] = func(*args,**kwargs)
+        return self._cache[key]
+        
+    def read(self,readers):
+        '''@param readers: <list> short metric names of ProcessStat.METRIC_READERS'''
+        self.meta_data() #fails fast on a process that has gone away
+        for sn in readers:
+            try: self.values[sn] = ProcessStat.METRIC_READERS[sn](self)
+            except: self.errors.append((sn,Failure().getErrorMessage())) #1
+            
+    def meta_data(self):
+        '''@return: <dict> a copy of the meta data every process datapoint carries.'''
+        if self._meta is None:
+            ident = self.ident
+            self._meta = {
+                "pid": str(ident.pid),
+                "ppid": str(self.proc.ppid),
+                "pname": ident.name.replace(" ","_"),
+                "exe": ident.exe,
+                "user": ident.user,
+                "status": self.status_map[self.proc.status],
+            }
+        return dict(self._meta)
+        
+    def cpu_times(self):
+        return self._read("cpu_times",self.proc.get_cpu_times)
+        
+    def cpu_percent(self):
+        return self._read("cpu_percent",self.proc.get_cpu_percent,interval=0)
+        
+    def io_counters(self):
+        return self._read("io_counters",self.proc.get_io_counters)
+        
+    def memory_info(self):
+        return self._read("memory_info",self.proc.get_memory_info)
+        
+    def connections(self,kind):
+        return self._read("connections."+kind,self.proc.get_connections,kind=kind)
+        
+    def open_files(self):
+        return self._read("open_files",self.proc.get_open_files)
+        
+    def children(self):
+        return self._read("children",self.proc.get_children)
+        
+    def threads(self):
+        return self._read("threads",self.proc.get_threads)
+            
+            
+class ProcessGroup(object):
+    '''several ProcessSamples reported as one, see ProcessStat GROUP_BY.
+       quacks like a ProcessSample as far as proc_map is concerned.
+       #1 meta data comes from the group root when the group is named after
+          a pid (tree), otherwise from the lowest pid in the group.
+    '''
+    def __init__(self,key,members,method):
+        self.key = str(key).replace(" ","_")
+        self.members = members
+        root = [m for m in members if str(m.ident.pid) == str(key)] #1
+        if not root: root = [min(members,key=lambda m: m.ident.pid)] #1
+        self._meta = root[0].meta_data()
+        self._meta["group"] = self.key
+        self.values = {}
+        for sn in ProcessStat.METRIC_READERS:
+            vector = [m.values[sn] for m in members if sn in m.values]
+            if vector: self.values[sn] = method.compute(vector)[0]
+            
+    def meta_data(self):
+        return dict(self._meta)
+            
+            
 class ProcessStat(StatBlock):
     TYPE = "process"
+    COUNTER_METRICS = ("disk.counters.read","disk.counters.write",
+            "disk.bytes.read","disk.bytes.write","cpu.time.user","cpu.time.system")
+    GROUPINGS = ("none","tree","name","user","appinstance")
+    #short metric name -> how to read it from a ProcessSample
+    METRIC_READERS = {
+        "threads.count": lambda s: len(s.threads()),
+        "children.count": lambda s: len(s.children()),
+        "files.count": lambda s: len(s.open_files()),
+        "memory.rss": lambda s: s.memory_info().rss,
+        "memory.vms": lambda s: s.memory_info().vms,
+        "network.connection.count": lambda s: len(s.connections('all')),
+        "network.connection.tcp.count": lambda s: len(s.connections('tcp')),
+        "network.connection.udp.count": lambda s: len(s.connections('udp')),
+        "disk.counters.read": lambda s: s.io_counters().read_count,
+        "disk.counters.write": lambda s: s.io_counters().write_count,
+        "disk.bytes.read": lambda s: s.io_counters().read_bytes,
+        "disk.bytes.write": lambda s: s.io_counters().write_bytes,
+        "cpu.usage.percent": lambda s: s.cpu_percent(),
+        "cpu.time.user": lambda s: s.cpu_times().user,
+        "cpu.time.system": lambda s: s.cpu_times().system,
+    }
+    STATIC_MATCH_LISTS = ["MATCH_PID","MATCH_NAME","MATCH_EXE","MATCH_USER","MATCH_CMDLINE"]
+    DYNAMIC_MATCH_LISTS = ["MATCH_PPID","MATCH_STATUS"]
     
     def __init__(self,block):
         global SYSSTAT_PSUTIL_AVAILABLE
@@ -1223,15 +1619,17 @@ class ProcessStat(StatBlock):
         #we want the string name not the integer.
         self.status_map = dict([(getattr(psutil,d),d.replace("STATUS_","")) 
                                 for d in dir(psutil) if d.startswith("STATUS") ])
-        self.match_lists = {
-             "MATCH_PID":     self.compile_all("MATCH_PID"),
-             "MATCH_PPID":    self.compile_all("MATCH_PPID"),
-             "MATCH_NAME":    self.compile_all("MATCH_NAME"),
-             "MATCH_EXE":     self.compile_all("MATCH_EXE"),
-             "MATCH_USER":    self.compile_all("MATCH_USER"),
-             "MATCH_CMDLINE": self.compile_all("MATCH_CMDLINE"),
-             "MATCH_STATUS":  self.compile_all("MATCH_STATUS"),
-        }
+        self.match_lists = dict([(name,self.compile_all(name)) for name in 
+                                 self.STATIC_MATCH_LISTS + self.DYNAMIC_MATCH_LISTS])
+        self.identities = {} #pid -> ProcessIdentity, see apply_filters
+        self.matched = [] #identities that passed the filters this tick
+        self.samples = [] #ProcessSample of every matched process this tick
+        self.GROUP_BY = block.get("GROUP_BY","none")
+        if self.GROUP_BY not in self.GROUPINGS:
+            msg = "GROUP_BY must be one of %s" % ",".join(self.GROUPINGS)
+            raise InvalidStatBlockDefinition(msg)
+        self.GROUP_METHOD = self.get_aggregator(block.get("GROUP_METHOD","sum"))
+        self.instance_pids = {} #pid -> group name, see appinstance_pids
         self.PROVIDED_METRICS.update({
             "threads.count": self.threads_count,
             "children.count": self.children_count,
@@ -1251,464 +1649,250 @@ class ProcessStat(StatBlock):
             })
         self.PROTOCOLS += [ProcessStatMetaData()]
         self.remove_invalid_request_metrics()
+        self.readers = self.requested_readers()
         
     def compile_all(self,name):
+        '''all patterns of a match list are combined into a single
+           alternation so a value is tested with one match() call.
+           each pattern is compiled on its own first so a bad one is
+           reported by itself.
+        '''
         ml = self.config_block.get(name,[])
+        if not ml: return None
+        for m in ml: re.compile(m)
+        self.error("%s patterns loaded for match list %s" % ( len(ml), name) )
+        return re.compile("|".join(["(?:%s)" % m for m in ml]))
+        
+    def series_key(self,metric,datapoint):
+        '''every process or process group is its own series.'''
+        if datapoint.group: return metric + "::" + datapoint.group
+        return metric + "::" + str(datapoint.pid)
+        
+    def series_labels(self,datapoint):
+        if datapoint.group: return {'group': datapoint.group}
+        return {'pid': datapoint.pid, 'pname': datapoint.pname}
+        
+    def gather(self):
+        '''the process table is filtered once per tick. every requested
+           value of a matched process is then read in a single pass
+           and the metric handlers only fan those values out.
+        '''
+        self.matched = list(self.apply_filters())
+        self.samples = []
+        for ident in self.matched:
+            sample = ProcessSample(ident,self.status_map)
+            try: sample.read(self.readers)
+            except (psutil.NoSuchProcess,psutil.AccessDenied): continue
+            for sn,failure in sample.errors:
+                if self.diagnostics:
+                    self.error("Error reading %s of pid %s: %s" % (sn,ident.pid,failure))
+            self.samples.append(sample)
+        if self.GROUP_BY != "none":
+            self.samples = self.group_samples(self.samples)
+        return StatBlock.gather(self)
+        
+    def collect(self):
+        '''appinstance grouping needs the droned models which may
+           only be read in the reactor, so that map is built here.
+        '''
+        if self.GROUP_BY == "appinstance" and self.collecting.called:
+            self.instance_pids = self.appinstance_pids()
+        StatBlock.collect(self)
+        
+    def appinstance_pids(self):
+        '''@return: <dict> main pid of every local AppInstance to its group name.'''
+        out = {}
+        for ai in AppInstance.objects:
+            try:
+                if not ai.localInstall: continue
+                pid = ai.pid
+                if pid: out[pid] = "%s_%s" % (ai.app.name,ai.label)
+            except: continue
+        return out
+        
+    def group_samples(self,samples):
+        '''combines the samples of this tick into one ProcessGroup per
+           GROUP_BY key using GROUP_METHOD. processes that do not belong
+           to any group are dropped.
+        '''
+        parents = {}
+        for sample in samples:
+            parents[sample.ident.pid] = int(sample.meta_data()["ppid"])
+        groups = {}
+        for sample in samples:
+            key = self.group_key(sample,parents)
+            if key is None: continue
+            groups.setdefault(key,[]).append(sample)
+        return [ProcessGroup(k,m,self.GROUP_METHOD) for k,m in groups.items()]
+        
+    def group_key(self,sample,parents):
+        '''@return: <str> the group a sample belongs to or None.
+           #1 the top most matched ancestor of a process names its tree.
+           #2 a process belongs to the instance whose pid is found walking
+              up its matched ancestors.
+        '''
+        pid = sample.ident.pid
+        if self.GROUP_BY == "name": return sample.ident.name
+        if self.GROUP_BY == "user": return sample.ident.user
+        seen = set([pid])
+        if self.GROUP_BY == "tree": #1
+            while parents.get(pid) in parents and parents[pid] not in seen:
+                pid = parents[pid]
+                seen.add(pid)
+            return str(pid)
+        while pid not in self.instance_pids: #2
+            if pid not in parents or parents[pid] in seen: return None
+            pid = parents[pid]
+            seen.add(pid)
+        return self.instance_pids[pid]
+        
+    def requested_readers(self):
+        '''@return: <list> short names of METRIC_READERS that were requested.'''
         out = []
-        for m in ml:
-            out.append(re.compile(m))
-        self.error("%s patterns loaded for match list %s" % ( len(out), name) )
+        for m in self.REQUESTED_METRICS:
+            sn = ".".join( m.split(".")[1:] )
+            for n in [m,self.TYPE + "." + m,sn]:
+                if n in self.METRIC_READERS:
+                    if n not in out: out.append(n)
+                    break
         return out
         
-    def aggregate_data(self):
-        '''disk data represents a special case and we need to do a
-           custom aggregation as a result. even though a metric
-           requested may be the same, example usage.percent
-           that metric will have multiple partitions and should
-           be treated as different metrics. so we need to aggregate
-           by partition and metric type. 
+    def identify(self,proc):
+        '''@return: <ProcessIdentity> cached by pid, a pid with a different
+           start time is a new process and gets a fresh identity.
         '''
-        sub_groups = {}
-        for metric,datapoints in self.requested_metric_data.items():
-            for datapoint in datapoints:
-                mpID = metric + "::" + str(datapoint.pid)
-                if mpID not in sub_groups:
-                    sub_groups[mpID]  = []
-                sub_groups[mpID].append(datapoint)
-        self.requested_metric_data = sub_groups
-        StatBlock.aggregate_data(self)
+        ident = self.identities.get(proc.pid)
+        create_time = proc.create_time
+        if ident is None or ident.create_time != create_time:
+            ident = ProcessIdentity(proc,create_time)
+        return ident
         
     def apply_filters(self):
-        '''for all proces on system
-           take a proc and iterate over all defined match lists
-           for each match list pass the proc and the match list
-           to a handler function that knows how to check contents of that list
-           the result of that list check func is true or false
-           true if any items matched, false if all failed to match.
-           if result is true for any given list (ml) stop right there
-           we must have at least one match per list (i.e. true from handler)
+        '''for all proces on system take a proc and check it against all
+           defined match lists. a proc must match at least one pattern of 
+           every list.
+           #1 lists over values that never change for a process are only
+              checked the first time its identity is seen.
+           #2 pids that are gone are forgotten.
         '''
+        identities = {}
         for proc in psutil.process_iter():
-            fpassed = True
-            for k,ml in self.match_lists.items():
-                if not ml: continue
-                fn = k.lower()+"_filter"
-                if not hasattr(self,fn):
-                    msg = "filter: %s was specified by has not handler logic."
-                    raise Exception(msg)
-                fpassed = getattr(self,fn)(proc,ml)
-                if not fpassed: break
-                msg = "match found for pid %s in match list %s" % (proc.pid,k)
-                self.debug(msg)
-            if not fpassed: continue
-            yield proc
+            try:
+                ident = self.identify(proc)
+                identities[ident.pid] = ident
+                if not ident.accessible: continue
+                if ident.static_match is None: #1
+                    ident.static_match = self.match(ident,self.STATIC_MATCH_LISTS)
+                if not ident.static_match: continue
+                if not self.match(ident,self.DYNAMIC_MATCH_LISTS): continue
+            except (psutil.NoSuchProcess,psutil.AccessDenied): continue
+            if self.diagnostics:
+                self.debug("match found for pid %s" % (ident.pid,))
+            yield ident
+        self.identities = identities #2
+        
+    def match(self,ident,names):
+        '''@return: <bool> True if ident passes every given match list.'''
+        for k in names:
+            pattern = self.match_lists[k]
+            if not pattern: continue
+            fn = k.lower()+"_filter"
+            if not hasattr(self,fn):
+                msg = "filter: %s was specified by has not handler logic."
+                raise Exception(msg)
+            if not getattr(self,fn)(ident,pattern): return False
+        return True
                 
-    def match_pid_filter(self,proc,match_list):
-        pid = str(proc.pid) 
-        for m in match_list:
-            match = m.match(pid)
-            if match: return True
-        return False
+    def match_pid_filter(self,ident,pattern):
+        return bool(pattern.match(str(ident.pid)))
     
-    def match_ppid_filter(self,proc,match_list):
-        ppid = str(proc.ppid)
-        for m in match_list:
-            match = m.match(ppid)
-            if match: return True
-        return False
+    def match_ppid_filter(self,ident,pattern):
+        return bool(pattern.match(str(ident.proc.ppid)))
     
-    def match_name_filter(self,proc,match_list):
-        name = proc.name
-        for m in match_list:
-            match = m.match(name)
-            if match: return True
-        return False
+    def match_name_filter(self,ident,pattern):
+        return bool(pattern.match(ident.name))
     
-    def match_exe_filter(self,proc,match_list):
-        exe = proc.exe
-        for m in match_list:
-            match = m.match(exe)
-            if match: return True
-        return False
+    def match_exe_filter(self,ident,pattern):
+        return bool(pattern.match(ident.exe))
     
-    def match_user_filter(self,proc,match_list):
-        user = proc.username
-        for m in match_list:
-            match = m.match(user)
-            if match: return True
-        return False
+    def match_user_filter(self,ident,pattern):
+        return bool(pattern.match(ident.user))
     
-    def match_cmdline_filter(self,proc,match_list):
-        cmd_array = proc.cmdline
-        for m in match_list:
-            for cmd in cmd_array:
-                match = m.match(cmd)
-                if match: return True
+    def match_cmdline_filter(self,ident,pattern):
+        for cmd in ident.cmdline:
+            if pattern.match(cmd): return True
         return False
         
-    def match_status_filter(self,proc,match_list):
-        status = self.status_map[proc.status]
-        for m in match_list:
-            match = m.match(status)
-            if match: return True
-        return False
+    def match_status_filter(self,ident,pattern):
+        return bool(pattern.match(self.status_map[ident.proc.status]))
        
-    def proc_map(self,name,func):
-        for proc in self.apply_filters():
-            try:
-                #in case our process doesn't have access to target just skip.                
-                try: proc.exe
-                except psutil.AccessDenied: continue 
-                func(proc)
-            except:
-                msg = "Error while processing %s" % name
-                self.error(msg)
-                self.debug("")
-                  
-    def cpu_time_system(self,save):
-        ln = "process.cpu.time.system"
-        sn = "cpu.time.system"
+    def proc_map(self,sn,save):
+        '''fans the values read by gather() out to datapoints for
+           metric sn, one per matched process.
+        '''
+        ln = self.TYPE + "." + sn
         def _validate(datapoint):
             datapoint.meta_data[ln] = datapoint.value
             datapoint.meta_data[sn] = datapoint.value
-                
-        def _run(proc):
-            value = proc.get_cpu_times().system
-            meta = {"variables": ["pid","ppid","pname","exe","user","status",ln,sn],
-                    "pid": str(proc.pid),
-                    "ppid": str(proc.ppid),
-                    "pname": proc.name.replace(" ","_"),
-                    "exe": proc.exe,
-                    "user": proc.username,
-                    "status": self.status_map[proc.status],
-                    ln:value,
-                    sn:value,
-                    "meta_data_validator": _validate}
+            
+        for sample in self.samples:
+            if sn not in sample.values: continue
+            value = sample.values[sn]
+            meta = sample.meta_data()
+            variables = ["pid","ppid","pname","exe","user","status",ln,sn]
+            if "group" in meta: variables.append("group")
+            meta.update({
+                "variables": variables,
+                ln:value,
+                sn:value,
+                "meta_data_validator": _validate})
             dp = DataPoint(value=value,meta_data=meta)
             save(dp)
-        self.proc_map(ln, _run)
                   
+    def cpu_time_system(self,save):
+        self.proc_map("cpu.time.system",save)
+        
     def cpu_time_user(self,save):
-        ln = "process.cpu.time.user"
-        sn = "cpu.time.user"
-        def _validate(datapoint):
-            datapoint.meta_data[ln] = datapoint.value
-            datapoint.meta_data[sn] = datapoint.value
-                
-        def _run(proc):
-            value = proc.get_cpu_times().user
-            meta = {"variables": ["pid","ppid","pname","exe","user","status",ln,sn],
-                    "pid": str(proc.pid),
-                    "ppid": str(proc.ppid),
-                    "pname": proc.name.replace(" ","_"),
-                    "exe": proc.exe,
-                    "user": proc.username,
-                    "status": self.status_map[proc.status],
-                    ln:value,
-                    sn:value,
-                    "meta_data_validator": _validate}
-            dp = DataPoint(value=value,meta_data=meta)
-            save(dp)
-        self.proc_map(ln, _run)
-                 
+        self.proc_map("cpu.time.user",save)
+        
     def cpu_usage_percent(self,save):
-        ln = "process.cpu.usage.percent"
-        sn = "cpu.usage.percent"
-        def _validate(datapoint):
-            datapoint.meta_data[ln] = datapoint.value
-            datapoint.meta_data[sn] = datapoint.value
-                
-        def _run(proc):
-            value = proc.get_cpu_percent()
-            meta = {"variables": ["pid","ppid","pname","exe","user","status",ln,sn],
-                    "pid": str(proc.pid),
-                    "ppid": str(proc.ppid),
-                    "pname": proc.name.replace(" ","_"),
-                    "exe": proc.exe,
-                    "user": proc.username,
-                    "status": self.status_map[proc.status],
-                    ln:value,
-                    sn:value,
-                    "meta_data_validator": _validate}
-            dp = DataPoint(value=value,meta_data=meta)
-            save(dp)
-        self.proc_map(ln, _run)
-                
+        self.proc_map("cpu.usage.percent",save)
+        
     def disk_write_bytes(self,save):
-        ln = "process.disk.bytes.write"
-        sn = "disk.bytes.write"
-        def _validate(datapoint):
-            datapoint.meta_data[ln] = datapoint.value
-            datapoint.meta_data[sn] = datapoint.value
-                
-        def _run(proc):
-            value = proc.get_io_counters().write_bytes 
-            meta = {"variables": ["pid","ppid","pname","exe","user","status",ln,sn],
-                    "pid": str(proc.pid),
-                    "ppid": str(proc.ppid),
-                    "pname": proc.name.replace(" ","_"),
-                    "exe": proc.exe,
-                    "user": proc.username,
-                    "status": self.status_map[proc.status],
-                    ln:value,
-                    sn:value,
-                    "meta_data_validator": _validate}
-            dp = DataPoint(value=value,meta_data=meta)
-            save(dp)
-        self.proc_map(ln, _run)
-               
+        self.proc_map("disk.bytes.write",save)
+        
     def disk_read_bytes(self,save):
-        ln = "process.disk.bytes.read"
-        sn = "disk.bytes.read"
-        def _validate(datapoint):
-            datapoint.meta_data[ln] = datapoint.value
-            datapoint.meta_data[sn] = datapoint.value
-                
-        def _run(proc):
-            value = proc.get_io_counters().read_bytes 
-            meta = {"variables": ["pid","ppid","pname","exe","user","status",ln,sn],
-                    "pid": str(proc.pid),
-                    "ppid": str(proc.ppid),
-                    "pname": proc.name.replace(" ","_"),
-                    "exe": proc.exe,
-                    "user": proc.username,
-                    "status": self.status_map[proc.status],
-                    ln:value,
-                    sn:value,
-                    "meta_data_validator": _validate}
-            dp = DataPoint(value=value,meta_data=meta)
-            save(dp)
-        self.proc_map(ln, _run)
-              
+        self.proc_map("disk.bytes.read",save)
+        
     def disk_write_count(self,save):
-        ln = "process.disk.counters.write"
-        sn = "disk.counters.write"
-        def _validate(datapoint):
-            datapoint.meta_data[ln] = datapoint.value
-            datapoint.meta_data[sn] = datapoint.value
-                
-        def _run(proc):
-            value = proc.get_io_counters().write_count 
-            meta = {"variables": ["pid","ppid","pname","exe","user","status",ln,sn],
-                    "pid": str(proc.pid),
-                    "ppid": str(proc.ppid),
-                    "pname": proc.name.replace(" ","_"),
-                    "exe": proc.exe,
-                    "user": proc.username,
-                    "status": self.status_map[proc.status],
-                    ln:value,
-                    sn:value,
-                    "meta_data_validator": _validate}
-            dp = DataPoint(value=value,meta_data=meta)
-            save(dp)
-        self.proc_map(ln, _run)
-             
+        self.proc_map("disk.counters.write",save)
+        
     def disk_read_count(self,save):
-        ln = "process.disk.counters.read"
-        sn = "disk.counters.read"
-        def _validate(datapoint):
-            datapoint.meta_data[ln] = datapoint.value
-            datapoint.meta_data[sn] = datapoint.value
-                
-        def _run(proc):
-            value = proc.get_io_counters().read_count 
-            meta = {"variables": ["pid","ppid","pname","exe","user","status",ln,sn],
-                    "pid": str(proc.pid),
-                    "ppid": str(proc.ppid),
-                    "pname": proc.name.replace(" ","_"),
-                    "exe": proc.exe,
-                    "user": proc.username,
-                    "status": self.status_map[proc.status],
-                    ln:value,
-                    sn:value,
-                    "meta_data_validator": _validate}
-            dp = DataPoint(value=value,meta_data=meta)
-            save(dp)
-        self.proc_map(ln, _run)
-            
+        self.proc_map("disk.counters.read",save)
+        
     def net_conn_udp_count(self,save):
-        ln = "process.network.connection.udp.count"
-        sn = "network.connection.udp.count"
-        def _validate(datapoint):
-            datapoint.meta_data[ln] = datapoint.value
-            datapoint.meta_data[sn] = datapoint.value
-                
-        def _run(proc):
-            value = len(proc.get_connections(kind="udp")) 
-            meta = {"variables": ["pid","ppid","pname","exe","user","status",ln,sn],
-                    "pid": str(proc.pid),
-                    "ppid": str(proc.ppid),
-                    "pname": proc.name.replace(" ","_"),
-                    "exe": proc.exe,
-                    "user": proc.username,
-                    "status": self.status_map[proc.status],
-                    ln:value,
-                    sn:value,
-                    "meta_data_validator": _validate}
-            dp = DataPoint(value=value,meta_data=meta)
-            save(dp)
-        self.proc_map(ln, _run)
-           
+        self.proc_map("network.connection.udp.count",save)
+        
     def net_conn_tcp_count(self,save):
-        ln = "process.network.connection.tcp.count"
-        sn = "network.connection.tcp.count"
-        def _validate(datapoint):
-            datapoint.meta_data[ln] = datapoint.value
-            datapoint.meta_data[sn] = datapoint.value
-                
-        def _run(proc):
-            value = len(proc.get_connections(kind="tcp")) 
-            meta = {"variables": ["pid","ppid","pname","exe","user","status",ln,sn],
-                    "pid": str(proc.pid),
-                    "ppid": str(proc.ppid),
-                    "pname": proc.name.replace(" ","_"),
-                    "exe": proc.exe,
-                    "user": proc.username,
-                    "status": self.status_map[proc.status],
-                    ln:value,
-                    sn:value,
-                    "meta_data_validator": _validate}
-            dp = DataPoint(value=value,meta_data=meta)
-            save(dp)
-        self.proc_map(ln, _run)
-          
+        self.proc_map("network.connection.tcp.count",save)
+        
     def net_conn_count(self,save):
-        ln = "process.network.connection.count"
-        sn = "network.connection.count"
-        def _validate(datapoint):
-            datapoint.meta_data[ln] = datapoint.value
-            datapoint.meta_data[sn] = datapoint.value
-                
-        def _run(proc):
-            value = len(proc.get_connections(kind='all')) 
-            meta = {"variables": ["pid","ppid","pname","exe","user","status",ln,sn],
-                    "pid": str(proc.pid),
-                    "ppid": str(proc.ppid),
-                    "pname": proc.name.replace(" ","_"),
-                    "exe": proc.exe,
-                    "user": proc.username,
-                    "status": self.status_map[proc.status],
-                    ln:value,
-                    sn:value,
-                    "meta_data_validator": _validate}
-            dp = DataPoint(value=value,meta_data=meta)
-            save(dp)
-        self.proc_map(ln, _run)
-         
+        self.proc_map("network.connection.count",save)
+        
     def memory_rss(self,save):
-        ln = "process.memory.rss"
-        sn = "memory.rss"
-        def _validate(datapoint):
-            datapoint.meta_data[ln] = datapoint.value
-            datapoint.meta_data[sn] = datapoint.value
-                
-        def _run(proc):
-            value = proc.get_memory_info().rss 
-            meta = {"variables": ["pid","ppid","pname","exe","user","status",ln,sn],
-                    "pid": str(proc.pid),
-                    "ppid": str(proc.ppid),
-                    "pname": proc.name.replace(" ","_"),
-                    "exe": proc.exe,
-                    "user": proc.username,
-                    "status": self.status_map[proc.status],
-                    ln:value,
-                    sn:value,
-                    "meta_data_validator": _validate}
-            dp = DataPoint(value=value,meta_data=meta)
-            save(dp)
-        self.proc_map(ln, _run)
+        self.proc_map("memory.rss",save)
         
     def memory_vms(self,save):
-        ln = "process.memory.vms"
-        sn = "memory.vms"
-        def _validate(datapoint):
-            datapoint.meta_data[ln] = datapoint.value
-            datapoint.meta_data[sn] = datapoint.value
-                
-        def _run(proc):
-            value = proc.get_memory_info().vms 
-            meta = {"variables": ["pid","ppid","pname","exe","user","status",ln,sn],
-                    "pid": str(proc.pid),
-                    "ppid": str(proc.ppid),
-                    "pname": proc.name.replace(" ","_"),
-                    "exe": proc.exe,
-                    "user": proc.username,
-                    "status": self.status_map[proc.status],
-                    ln:value,
-                    sn:value,
-                    "meta_data_validator": _validate}
-            dp = DataPoint(value=value,meta_data=meta)
-            save(dp)
-        self.proc_map(ln, _run)
-       
+        self.proc_map("memory.vms",save)
+        
     def files_count(self,save):
-        ln = "process.files.count"
-        sn = "files.count"
-        def _validate(datapoint):
-            datapoint.meta_data[ln] = datapoint.value
-            datapoint.meta_data[sn] = datapoint.value
-                
-        def _run(proc):
-            value = len(proc.get_open_files())
-            meta = {"variables": ["pid","ppid","pname","exe","user","status",ln,sn],
-                    "pid": str(proc.pid),
-                    "ppid": str(proc.ppid),
-                    "pname": proc.name.replace(" ","_"),
-                    "exe": proc.exe,
-                    "user": proc.username,
-                    "status": self.status_map[proc.status],
-                    ln:value,
-                    sn:value,
-                    "meta_data_validator": _validate}
-            dp = DataPoint(value=value,meta_data=meta)
-            save(dp)
-        self.proc_map(ln, _run)
+        self.proc_map("files.count",save)
         
     def children_count(self,save):
-        ln = "process.children.count"
-        sn = "children.count"
-        def _validate(datapoint):
-            datapoint.meta_data[ln] = datapoint.value
-            datapoint.meta_data[sn] = datapoint.value
-                
-        def _run(proc):
-            value = len(proc.get_children())
-            meta = {"variables": ["pid","ppid","pname","exe","user","status",ln,sn],
-                    "pid": str(proc.pid),
-                    "ppid": str(proc.ppid),
-                    "pname": proc.name.replace(" ","_"),
-                    "exe": proc.exe,
-                    "user": proc.username,
-                    "status": self.status_map[proc.status],
-                    ln:value,
-                    sn:value,
-                    "meta_data_validator": _validate}
-            dp = DataPoint(value=value,meta_data=meta)
-            save(dp)
-        self.proc_map(ln, _run)
-                
+        self.proc_map("children.count",save)
+        
     def threads_count(self,save):
-        ln = "process.threads.count"
-        sn = "threads.count"
-        def _validate(datapoint):
-            datapoint.meta_data[ln] = datapoint.value
-            datapoint.meta_data[sn] = datapoint.value
-                
-        def _run(proc):
-            value = len(proc.get_threads())
-            meta = {"variables": ["pid","ppid","pname","exe","user","status",ln,sn],
-                    "pid": str(proc.pid),
-                    "ppid": str(proc.ppid),
-                    "pname": proc.name.replace(" ","_"),
-                    "exe": proc.exe,
-                    "user": proc.username,
-                    "status": self.status_map[proc.status],
-                    ln:value,
-                    sn:value,
-                    "meta_data_validator": _validate}
-            dp = DataPoint(value=value,meta_data=meta)
-            save(dp)
-        self.proc_map(ln, _run)
+        self.proc_map("threads.count",save)
         
         
         
@@ -1836,7 +2020,15 @@ class MemoryStatMetaData(object):
     implements(IDataPointMetaDataProtocol)
     _keys = ["phymem.total",
              "phymem.used",
-             "phymem.free",             "phymem.percent",             "phymem.cached",             "phymem.buffers",             "virtmem.total",             "virtmem.used",             "virtmem.free",             "virtmem.percent"]    
+             "phymem.free",
+             "phymem.percent",
+             "phymem.cached",
+             "phymem.buffers",
+             "virtmem.total",
+             "virtmem.used",
+             "virtmem.free",
+             "virtmem.percent"]
+    
     def conforms(self,datapoint):
         prefix = "memory."
         found = [k for k in self._keys if k in datapoint]
@@ -1918,6 +2110,7 @@ class ProcessStatMetaData(object):
     
     def key_value_type(self,key):
         if key in self.provides_keys(): return (str,)
+        if key == "group": return (str,)
         number = (int,float,long)
         if key in self._keys: return number
         sn = ".".join(key.split(".")[1:])
@@ -1991,21 +2184,72 @@ class StatOutputHandler(object):
     def map_metrics(self,callback,*args,**kwargs):
         '''convenience function that maps each datapoint
            to the given callback with the provided args
-           passed to that callback(datapoint,*args)
+           passed to that callback(datapoint,*args).
+           protocols are checked once per series, the datapoint
+           passed in is the series template moved to each sample.
         '''
         out = []
         gaurd_len = len(self.REQUIRED_PROTOCOLS)
-        for name,datapoints in self.stat.requested_metric_data.items():
-            for datapoint in datapoints:
-                gaurd = [p for p in self.REQUIRED_PROTOCOLS if p.conforms(datapoint)]
-                if len(gaurd) != gaurd_len: continue
+        for name,series in self.stat.requested_metric_data.items():
+            if not len(series): continue
+            gaurd = [p for p in self.REQUIRED_PROTOCOLS if p.conforms(series.datapoint)]
+            if len(gaurd) != gaurd_len: continue
+            for datapoint in series.datapoints():
                 ret = callback(datapoint,*args,**kwargs)
                 out.append(ret)
         return out
         
+class MetricTemplate(object):
+    '''an OUTPUT METRICS entry of the form "<metric_name> <value_variable>"
+       compiled once so that naming a datapoint is a single format call.
+       #1 split() with a capture group alternates literal text and variables.
+       #2 literal percent signs must survive the format.
+    '''
+    var_reg = re.compile("(<[^>]+>)")
+    
+    def __init__(self,metric):
+        self.metric = metric
+        parts = metric.split()
+        if len(parts) != 2:
+            msg = "metric '%s' is not of the form <metric_name> <value_variable>"
+            raise InvalidOutputBlockDefinition(msg % metric)
+        name,value = parts
+        value_vars = self.var_reg.findall(value)
+        if not value_vars:
+            msg = "metric '%s' has no value variable"
+            raise InvalidOutputBlockDefinition(msg % metric)
+        self.value = value_vars[0][1:-1]
+        fmt = []
+        names = []
+        for i,piece in enumerate(self.var_reg.split(name)): #1
+            if i % 2:
+                names.append(piece[1:-1])
+                fmt.append("%s")
+            else: fmt.append(piece.replace("%","%%")) #2
+        self.format = "".join(fmt)
+        self.names = tuple(names)
+        self.variables = frozenset(names + [self.value])
+    
+    def resolve(self,meta_data):
+        '''@param meta_data: <dict> datapoint meta data holding every variable.
+           @return: <str> the metric name, periods in values become underscores.
+        '''
+        values = []
+        for name in self.names:
+            val = meta_data.get(name)
+            if type(val) == str: val = val.replace(".","_")
+            values.append(val)
+        return self.format % tuple(values)
+        
+        
 class GraphiteOutputHandler(StatOutputHandler):
     OUTPUT_TYPE = "graphite"
     
+    @raises(InvalidOutputBlockDefinition)
+    def __init__(self,block,stat):
+        StatOutputHandler.__init__(self,block,stat)
+        self.templates = [MetricTemplate(m) for m in self.block['METRICS']]
+    
     def do_output(self):
         '''look through all datapoint and figure out which ones
            can build the metric names we have been asked to genterate.
@@ -2014,9 +2258,8 @@ class GraphiteOutputHandler(StatOutputHandler):
            supply all variable values. each one is a unique metric
            however and will get its own TimeSeriesData Entity 
         '''
-        metrics = self.block['METRICS']
-        for m in metrics:
-            self.map_metrics(self.resolve_metric,m)
+        for template in self.templates:
+            self.map_metrics(self.resolve_metric,template)
             
     def issue_value_warning(self,datapoint,metric,value):
         '''we have detected that our value does not appear to be correct.
@@ -2034,7 +2277,7 @@ class GraphiteOutputHandler(StatOutputHandler):
         self.stat.error(msg2)
         self.stat.error(msg3)
                     
-    def resolve_metric(self,datapoint,metric):
+    def resolve_metric(self,datapoint,template):
         '''basically just extracts variables from datapoint metadata
            and inserts them into the metric string.
            #1 make sure this datapoint has all the meta data we need
@@ -2058,34 +2301,26 @@ class GraphiteOutputHandler(StatOutputHandler):
               period replaced with underscore. example:
               myhost.company.com -> myhost_company_com
         '''
-        variables = datapoint.variables
-        text_vars = self.extract_variables(metric)
-        tvl = len(text_vars)
-        found = [v for v in text_vars if v in variables]
-        if len(found) != tvl: return #1
-        name,value = [m.strip() for m in metric.split()] #1
-        value = self.extract_variables(value).pop() #2
-        meta_value = datapoint.meta_data[value]
+        if not template.variables.issubset(datapoint.variables): return #1
+        meta_value = datapoint.meta_data[template.value]
         if datapoint.value != meta_value: #2
             if not isinstance(meta_value, (int,float)): 
-                self.issue_value_warning(datapoint,metric,meta_value)
-            datapoint.value = datapoint.meta_data[value] #2
-        varmap = {}
-        meta_data = datapoint.meta_data
-        for tvar in text_vars: #3
-            val = getattr(meta_data,tvar) #3
-            if type(val) ==  str: val = val.replace(".","_") #4
-            varmap[tvar] = val #3
-        resolved_metric = self.input_variables(name,varmap) #3
-        dpID = id(datapoint)
-        self.stat.error("datapoint[%s] - sending metric to graphite via output" % dpID)
-        self.stat.debug("datapoint[%s] - value = %s" %(dpID,datapoint.value))
-        self.stat.debug("datapoint[%s] - metric = %s" % (dpID,resolved_metric))
-        TimeSeriesData(resolved_metric).add(datapoint)
+                self.issue_value_warning(datapoint,template.metric,meta_value)
+            datapoint.value = meta_value #2
+        resolved_metric = template.resolve(datapoint.meta_data) #3,#4
+        self.stat.points_sent += 1
+        if self.stat.diagnostics:
+            dpID = id(datapoint)
+            self.stat.error("datapoint[%s] - sending metric to graphite via output" % dpID)
+            self.stat.debug("datapoint[%s] - value = %s" %(dpID,datapoint.value))
+            self.stat.debug("datapoint[%s] - metric = %s" % (dpID,resolved_metric))
+        #the datapoint is reused for the next sample, only its sample is stored
+        TimeSeriesData(resolved_metric).append(datapoint.time,datapoint.value)
         
         
 
 
 # These come after our class definitions to avoid circular import dependencies
 from droned.models.droneserver import DroneD
+from droned.models.app import AppInstance
 from droned.management.server import ServerManager
@@ -18,25 +18,77 @@ try:
     import cPickle as pickle
 except ImportError:
     import pickle
-from twisted.internet.protocol import Protocol
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+try: #newer versions of python
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+import struct
+import zlib
+from bisect import bisect_left, insort
+from collections import deque
+from twisted.internet.protocol import Protocol, ReconnectingClientFactory
+from twisted.internet import defer, reactor
 from twisted.python.failure import Failure
 from twisted.protocols.basic import Int32StringReceiver
+from droned.logging import logWithContext
+
+log = logWithContext(type='graphite')
+
+HEADER = struct.Struct('!L')
+PICKLE_PROTOCOL = 2 #understood by every carbon release
+#wbits for zlib.compressobj, see GraphitePool
+COMPRESSION = {
+    'zlib': zlib.MAX_WBITS,
+    'gzip': zlib.MAX_WBITS | 16,
+}
+
+class GraphiteBackpressure(Exception):
+    """raised when the pool already holds as many unsent batches as allowed"""
+
+
+def frames(metricData, frame_size, frame_bytes):
+    """split a list of (metric, (stamp, value)) into lists of at most
+       frame_size points and roughly frame_bytes encoded bytes.
+    """
+    chunks = [[]]
+    size = 0
+    for point in metricData:
+        cost = len(point[0]) + 32 #name plus stamp and value
+        if chunks[-1] and (len(chunks[-1]) >= frame_size or \
+                size + cost > frame_bytes):
+            chunks.append([])
+            size = 0
+        chunks[-1].append(point)
+        size += cost
+    return chunks
+
 
 class GraphiteProtocol(Int32StringReceiver):
-    """base protocol for sending metrics to a Graphite Receiver"""
+    """base protocol for sending metrics to a Graphite Receiver.
+       subclasses implement encode() which turns a list of
+       (metric, (stamp, value)) into bytes ready for the wire.
+    """
     metric = property(lambda s: s.get_metric())
     def __init__(self, *args, **kwargs):
         self.metricData = args[0]
         self.deferred = args[-1] #deferred must always be the last argument
         self.METRIC_SENT = False
 
-    def get_metric(self):
+    @classmethod
+    def encode(cls, metricData):
         raise NotImplemented('you must implement this')
 
+    def get_metric(self):
+        return self.encode(self.metricData)
+
     def connectionMade(self):
         data = self.metric
         if data: #if we don't have data don't write
-            self.sendString(data)
+            self.transport.write(data)
             self.METRIC_SENT = True
         self.transport.loseConnection()
 
@@ -50,20 +102,345 @@ class GraphiteProtocol(Int32StringReceiver):
 
 
 class PickleEmitter(GraphiteProtocol):
-    """Send Graphite Data in Pickle Receiver Format"""
-    def get_metric(self):
-        return pickle.dumps(self.metricData)
+    """Send Graphite Data in Pickle Receiver Format
+
+       #1 the pickle is written straight into a reused buffer behind
+          room for its length header, which is filled in afterwards.
+    """
+    buf = StringIO()
+
+    @classmethod
+    def encode(cls, metricData):
+        buf = cls.buf
+        buf.seek(0)
+        buf.truncate()
+        buf.write(HEADER.pack(0)) #1
+        pickle.Pickler(buf, PICKLE_PROTOCOL).dump(metricData)
+        size = buf.tell() - HEADER.size
+        buf.seek(0)
+        buf.write(HEADER.pack(size))
+        return buf.getvalue()
 
 
 class LineEmitter(GraphiteProtocol):
     """Send Graphite Data in Line Receiver Format"""
-    def get_metric(self):
-        metrics = []
-        for (metric, (value, stamp)) in self.metricData:
-            metrics.append("%(metric)s %(value)s %(stamp)d" % locals())
-        metrics = '\n'.join(metrics)
-        if metrics and not metrics.endswith('\n'):
-            metrics += '\n'
-        return metrics
-
-__all__ = ['LineEmitter', 'PickleEmitter']
+    buf = StringIO()
+
+    @classmethod
+    def encode(cls, metricData):
+        buf = cls.buf
+        buf.seek(0)
+        buf.truncate()
+        write = buf.write
+        for (metric, (stamp, value)) in metricData:
+            write('%s %r %d\n' % (metric, value, stamp))
+        return buf.getvalue()
+
+
+class GraphiteClient(Protocol):
+    """long lived connection owned by a GraphitePool. the transport
+       tells us when its write buffer is full through the push producer
+       api, while paused the pool hands its batches to another connection
+       or keeps them queued.
+
+       #1 a compressed stream starts over with every connection, each
+          write is flushed so the relay can decode it right away.
+    """
+    paused = False
+    compressor = None
+
+    def connectionMade(self):
+        self.compressor = self.factory.pool.compressor() #1
+        self.transport.registerProducer(self, True)
+        self.factory.resetDelay()
+        self.factory.pool.connected(self)
+
+    def connectionLost(self, reason):
+        self.factory.pool.disconnected(self)
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        self.factory.pool.flush()
+
+    def stopProducing(self):
+        self.paused = True
+
+    def write(self, frame):
+        if self.compressor: #1
+            frame = self.compressor.compress(frame) + \
+                    self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.transport.write(frame)
+
+
+class GraphiteClientFactory(ReconnectingClientFactory):
+    """reconnects with exponential backoff, see ReconnectingClientFactory"""
+    protocol = GraphiteClient
+    maxDelay = 60
+    def __init__(self, pool):
+        self.pool = pool
+
+
+class GraphitePool(object):
+    """A small pool of persistent connections to one graphite receiver.
+       batches are encoded once, queued and streamed over whichever
+       connection is up and not paused.
+
+       #1 carbon rejects oversized pickles, large batches are split by
+          point count and by a rough estimate of their encoded size.
+       #2 a full queue means graphite can not keep up, the caller keeps
+          its data and tries again later.
+       #3 zlib or gzip compression of the whole stream, only relays that
+          expect it (carbon-c-relay with a compressed listener) can read it.
+       #4 batches are never held for a receiver that is not there, they
+          fail when no connection is up and after waiting timeout seconds
+          for a connection to drain, so the caller can spool them.
+    """
+    def __init__(self, host, port, emitter, size=1, timeout=5.0,
+            max_pending=1000, frame_size=500, frame_bytes=65536,
+            compression=None, compress_level=6):
+        if compression and compression not in COMPRESSION: #3
+            raise AssertionError('compression must be one of %s' % \
+                    ','.join(sorted(COMPRESSION)))
+        self.host = host
+        self.port = port
+        self.emitter = emitter
+        self.size = max(1, int(size))
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.frame_size = max(1, int(frame_size)) #1
+        self.frame_bytes = max(1, int(frame_bytes)) #1
+        self.compression = compression
+        self.compress_level = int(compress_level)
+        self.factories = []
+        self.connections = []
+        self.queue = deque()
+        self.turn = 0
+        self.running = False
+
+    available = property(lambda s: s.running and bool(s.connections))
+
+    def start(self):
+        """connect every member of the pool"""
+        self.running = True
+        for i in range(self.size):
+            factory = GraphiteClientFactory(self)
+            self.factories.append(factory)
+            reactor.connectTCP(self.host, self.port, factory,
+                    timeout=self.timeout)
+
+    def stop(self):
+        """disconnect, batches that were never written are failed"""
+        self.running = False
+        for factory in self.factories:
+            factory.stopTrying()
+        for proto in list(self.connections):
+            proto.transport.loseConnection()
+        self.factories = []
+        self.fail_queue('graphite pool stopped')
+
+    def fail_queue(self, reason):
+        """errback every queued batch"""
+        while self.queue:
+            self.fail(self.queue[0], reason)
+
+    def fail(self, entry, reason):
+        """errback one queued batch, entry is [encoded, count, d, timer]"""
+        if entry in self.queue: self.queue.remove(entry)
+        timer = entry[3]
+        if timer and timer.active(): timer.cancel()
+        entry[2].errback(Failure(GraphiteBackpressure(reason)))
+
+    def compressor(self):
+        """@return a new zlib compressor for a connection or None"""
+        if not self.compression: return None
+        return zlib.compressobj(self.compress_level, zlib.DEFLATED,
+                COMPRESSION[self.compression])
+
+    def connected(self, proto):
+        log('connected to %s:%d' % (self.host, self.port))
+        self.connections.append(proto)
+        self.flush()
+
+    def disconnected(self, proto):
+        if proto in self.connections:
+            self.connections.remove(proto)
+        if not self.connections: #4
+            self.fail_queue('lost every connection to %s:%d' % \
+                    (self.host, self.port))
+
+    def ready(self):
+        """@return the next writable connection or None"""
+        for i in range(len(self.connections)):
+            self.turn = (self.turn + 1) % len(self.connections)
+            proto = self.connections[self.turn]
+            if not proto.paused: return proto
+        return None
+
+    def send(self, metricData):
+        """queue a list of (metric, (stamp, value)) for sending
+
+           @callback (int) - how many points were written to a connection
+           @errback (twisted.python.failure.Failure())
+
+           @return defer.Deferred()
+        """
+        if not self.running:
+            return defer.fail(GraphiteBackpressure('graphite pool stopped'))
+        if not self.connections: #4
+            return defer.fail(GraphiteBackpressure('no connection to %s:%d' % \
+                    (self.host, self.port)))
+        if len(self.queue) >= self.max_pending: #2
+            return defer.fail(GraphiteBackpressure(
+                '%d batches are waiting to be written' % len(self.queue)))
+        encoded = [self.emitter.encode(f) for f in \
+                frames(metricData, self.frame_size, self.frame_bytes)]
+        d = defer.Deferred()
+        entry = [encoded, len(metricData), d, None]
+        self.queue.append(entry)
+        self.flush()
+        if not d.called: #4
+            entry[3] = reactor.callLater(self.timeout, self.fail, entry,
+                    'batch was not written within %ss' % (self.timeout,))
+        return d
+
+    def flush(self):
+        """write queued batches until the queue or the connections run dry"""
+        while self.queue:
+            proto = self.ready()
+            if not proto: break
+            encoded, count, d, timer = self.queue.popleft()
+            if timer and timer.active(): timer.cancel()
+            proto.write(''.join(encoded)) #one write for the whole batch
+            d.callback(count)
+
+
+class ConsistentHashRing(object):
+    """the consistent hash ring carbon-relay uses, a metric is sent to
+       the same (host, instance) that carbon-relay would pick for it.
+
+       #1 the first 16 bits of the md5 of "<node>:<replica>", nodes are
+          formatted as the (host, instance) tuple they are in carbon.
+       #2 a position is never shared, carbon moves the newcomer along.
+    """
+    def __init__(self, nodes, replica_count=100):
+        self.replica_count = replica_count
+        self.ring = []
+        self.nodes = []
+        for node in nodes:
+            self.add_node(node)
+
+    @staticmethod
+    def position(key):
+        return int(md5(key).hexdigest()[:4], 16) #1
+
+    def add_node(self, node):
+        self.nodes.append(node)
+        taken = set(r[0] for r in self.ring)
+        for i in range(self.replica_count):
+            position = self.position('%s:%d' % (node, i))
+            while position in taken: position += 1 #2
+            taken.add(position)
+            insort(self.ring, (position, node))
+
+    def get_nodes(self, key):
+        """@return (list) every node, starting with the one that owns key"""
+        if not self.ring: return []
+        nodes = []
+        index = bisect_left(self.ring, (self.position(key), None)) % len(self.ring)
+        for i in range(len(self.ring)):
+            node = self.ring[(index + i) % len(self.ring)][1]
+            if node in nodes: continue
+            nodes.append(node)
+            if len(nodes) == len(self.nodes): break
+        return nodes
+
+    def get_node(self, key):
+        return self.get_nodes(key)[0]
+
+
+class GraphiteRouter(object):
+    """shards metrics over several relays with a GraphitePool each. a
+       metric goes to its node on the hash ring, while that relay has no
+       connection up it goes to the next connected node of the ring.
+
+       #1 route lookups hash, remember them for the metric ids we see.
+       #2 nothing is connected, the points are failed so they get spooled.
+    """
+    MAX_ROUTES = 100000
+
+    def __init__(self, relays, emitter, replica_count=100, **kwargs):
+        """@param relays (list) - [(host, port, instance), ...]
+           @param emitter (class) - PickleEmitter or LineEmitter
+           @param kwargs - passed to every GraphitePool
+        """
+        self.pools = {}
+        nodes = []
+        for (host, port, instance) in relays:
+            node = (host, instance)
+            self.pools[node] = GraphitePool(host, port, emitter, **kwargs)
+            nodes.append(node)
+        self.ring = ConsistentHashRing(nodes, replica_count)
+        self.routes = {} #1
+
+    running = property(lambda s: any(p.running for p in s.pools.values()))
+    available = property(lambda s: any(p.available for p in s.pools.values()))
+
+    def start(self):
+        for pool in self.pools.values():
+            pool.start()
+
+    def stop(self):
+        for pool in self.pools.values():
+            pool.stop()
+
+    def healthy(self, node):
+        pool = self.pools[node]
+        return pool.running and bool(pool.connections)
+
+    def route(self, metric):
+        """@return (tuple) the node metric is sent to right now or None
+           when no relay is connected.
+        """
+        nodes = self.routes.get(metric)
+        if nodes is None:
+            if len(self.routes) >= self.MAX_ROUTES: self.routes.clear()
+            nodes = self.routes[metric] = self.ring.get_nodes(metric)
+        for node in nodes:
+            if self.healthy(node): return node
+        return None #2
+
+    def send(self, metricData):
+        """queue a list of (metric, (stamp, value)) on the pool of each
+           metric's relay, the relays are written to concurrently.
+
+           @callback (int) - how many points were written to a connection
+           @errback (twisted.python.failure.Failure()) - GraphiteBackpressure
+               with the points that were not written in its unsent attribute.
+
+           @return defer.Deferred()
+        """
+        shards = {}
+        for point in metricData:
+            shards.setdefault(self.route(point[0]), []).append(point)
+        unrouted = shards.pop(None, []) #2
+        nodes = shards.keys()
+        d = defer.DeferredList([self.pools[n].send(shards[n]) for n in nodes],
+                consumeErrors=True)
+        def _sent(results):
+            count, unsent = 0, list(unrouted)
+            for node, (success, value) in zip(nodes, results):
+                if success: count += value
+                else: unsent.extend(shards[node])
+            if unsent:
+                failure = GraphiteBackpressure('%d points were not written' % \
+                        len(unsent))
+                failure.unsent = unsent
+                raise failure
+            return count
+        return d.addCallback(_sent)
+
+__all__ = ['LineEmitter', 'PickleEmitter', 'GraphitePool', 'GraphiteBackpressure',
+        'GraphiteRouter', 'ConsistentHashRing', 'frames']
@@ -0,0 +1,67 @@
+###############################################################################
+#   Copyright 2006 to the present, Orbitz Worldwide, LLC.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+###############################################################################
+
+from twisted.internet.protocol import DatagramProtocol
+from droned.logging import logWithContext
+
+log = logWithContext(type='statsd')
+
+def parse(line):
+    """parse one statsd line, `name:value|type[|@rate]`
+
+       @param line (string)
+
+       @return (tuple) - (name, value, type, rate, relative) relative is
+           True for gauges sent as +N or -N.
+       @raise ValueError - when the line is malformed
+    """
+    name, _, rest = line.partition(':')
+    fields = rest.split('|')
+    if not name or len(fields) < 2:
+        raise ValueError('malformed statsd line %r' % (line,))
+    value, kind = fields[0], fields[1]
+    rate = 1.0
+    if len(fields) > 2 and fields[2].startswith('@'):
+        rate = float(fields[2][1:])
+        if not 0.0 < rate <= 1.0:
+            raise ValueError('bad sample rate in %r' % (line,))
+    relative = kind == 'g' and value[:1] in ('+', '-')
+    return (name.replace('/', '-').replace(' ', '_'), float(value), kind,
+            rate, relative)
+
+
+class StatsdProtocol(DatagramProtocol):
+    """receives statsd datagrams, every well formed line is handed to
+       `handler(name, value, type, rate, relative)`.
+    """
+    def __init__(self, handler):
+        self.handler = handler
+        self.received = 0
+        self.malformed = 0
+
+    def datagramReceived(self, data, address):
+        for line in data.split('\n'):
+            line = line.strip()
+            if not line: continue
+            try:
+                sample = parse(line)
+            except ValueError:
+                self.malformed += 1
+                continue
+            self.received += 1
+            self.handler(*sample)
+
+__all__ = ['parse', 'StatsdProtocol']
@@ -0,0 +1,226 @@
+###############################################################################
+#   Copyright 2006 to the present, Orbitz Worldwide, LLC.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+###############################################################################
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+import struct
+import unittest
+import zlib
+from twisted.internet.task import Clock
+from droned.protocols import graphite
+from droned.protocols.graphite import PickleEmitter, LineEmitter, \
+        GraphitePool, GraphiteRouter, GraphiteBackpressure, \
+        ConsistentHashRing, frames
+
+POINTS = [('a.b', (1300000000, 1.5)), ('a.c', (1300000001, 2.0))]
+
+
+class FakeClient(object):
+    """stands in for a connected GraphiteClient"""
+    paused = False
+    def __init__(self):
+        self.written = []
+
+    def write(self, data):
+        self.written.append(data)
+
+
+class EmitterTest(unittest.TestCase):
+    def test_pickle(self):
+        data = PickleEmitter.encode(POINTS)
+        size, = struct.unpack('!L', data[:4])
+        self.assertEqual(size, len(data) - 4)
+        self.assertEqual(pickle.loads(data[4:]), POINTS)
+
+    def test_pickle_protocol(self):
+        self.assertEqual(PickleEmitter.encode(POINTS)[4:6], '\x80\x02')
+
+    def test_pickle_buffer_reused(self):
+        first = PickleEmitter.encode(POINTS)
+        PickleEmitter.encode(POINTS * 10)
+        self.assertEqual(PickleEmitter.encode(POINTS), first)
+
+    def test_line(self):
+        self.assertEqual(LineEmitter.encode(POINTS),
+                'a.b 1.5 1300000000\na.c 2.0 1300000001\n')
+        self.assertEqual(LineEmitter.encode(POINTS[:1]), 'a.b 1.5 1300000000\n')
+
+
+class FrameTest(unittest.TestCase):
+    def test_frames(self):
+        chunks = frames(POINTS * 3, 4, 65536)
+        self.assertEqual([len(c) for c in chunks], [4, 2])
+        chunks = frames(POINTS, 500, 1)
+        self.assertEqual([len(c) for c in chunks], [1, 1])
+
+    def test_pool_writes_frames_at_once(self):
+        pool = GraphitePool('localhost', 2004, PickleEmitter, frame_size=1)
+        pool.running = True
+        client = FakeClient()
+        pool.connected(client)
+        pool.send(POINTS)
+        self.assertEqual(client.written, [PickleEmitter.encode(POINTS[:1]) + \
+                PickleEmitter.encode(POINTS[1:])])
+
+
+class ConsistentHashRingTest(unittest.TestCase):
+    nodes = [('10.0.0.1', 'a'), ('10.0.0.2', 'b'), ('10.0.0.3', 'c')]
+
+    def test_position(self):
+        #first 16 bits of the md5, like carbon.hashing
+        self.assertEqual(ConsistentHashRing.position('a.b'), 0xe32b)
+
+    def test_every_node_once(self):
+        ring = ConsistentHashRing(self.nodes)
+        self.assertEqual(len(ring.ring), 300)
+        self.assertEqual(len(set(r[0] for r in ring.ring)), 300)
+        for key in ('a.b', 'servers.web1.cpu', 'x'):
+            nodes = ring.get_nodes(key)
+            self.assertEqual(sorted(nodes), sorted(self.nodes))
+            self.assertEqual(ring.get_node(key), nodes[0])
+
+    def test_stable(self):
+        first = ConsistentHashRing(self.nodes)
+        second = ConsistentHashRing(list(reversed(self.nodes)))
+        for i in range(100):
+            key = 'metric.%d' % i
+            self.assertEqual(first.get_node(key), second.get_node(key))
+
+    def test_spreads_keys(self):
+        ring = ConsistentHashRing(self.nodes)
+        owners = set(ring.get_node('metric.%d' % i) for i in range(100))
+        self.assertEqual(owners, set(self.nodes))
+
+    def test_empty(self):
+        self.assertEqual(ConsistentHashRing([]).get_nodes('a'), [])
+
+
+class PoolTest(unittest.TestCase):
+    def setUp(self):
+        self.reactor = graphite.reactor
+        self.clock = graphite.reactor = Clock()
+        self.pool = GraphitePool('localhost', 2004, PickleEmitter, timeout=5)
+        self.pool.running = True
+
+    def tearDown(self):
+        graphite.reactor = self.reactor
+
+    def result(self, d):
+        out = []
+        d.addBoth(out.append)
+        return out[0]
+
+    def test_writes_batch(self):
+        client = FakeClient()
+        self.pool.connected(client)
+        self.assertEqual(self.result(self.pool.send(POINTS)), 2)
+        self.assertEqual(client.written, [PickleEmitter.encode(POINTS)])
+
+    def test_fails_without_connection(self):
+        failure = self.result(self.pool.send(POINTS))
+        self.assertTrue(failure.check(GraphiteBackpressure))
+
+    def test_fails_when_stopped(self):
+        self.pool.running = False
+        self.pool.connected(FakeClient())
+        failure = self.result(self.pool.send(POINTS))
+        self.assertTrue(failure.check(GraphiteBackpressure))
+
+    def test_times_out(self):
+        client = FakeClient()
+        client.paused = True
+        self.pool.connected(client)
+        out = []
+        self.pool.send(POINTS).addBoth(out.append)
+        self.assertEqual(out, [])
+        self.clock.advance(5)
+        self.assertTrue(out[0].check(GraphiteBackpressure))
+        self.assertEqual(len(self.pool.queue), 0)
+
+    def test_resume_cancels_timeout(self):
+        client = FakeClient()
+        client.paused = True
+        self.pool.connected(client)
+        out = []
+        self.pool.send(POINTS).addBoth(out.append)
+        client.paused = False
+        self.pool.flush()
+        self.assertEqual(out, [2])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_disconnect_fails_queue(self):
+        client = FakeClient()
+        client.paused = True
+        self.pool.connected(client)
+        out = []
+        self.pool.send(POINTS).addBoth(out.append)
+        self.pool.disconnected(client)
+        self.assertTrue(out[0].check(GraphiteBackpressure))
+
+    def test_compression(self):
+        pool = GraphitePool('localhost', 2004, LineEmitter, compression='gzip')
+        compressor = pool.compressor()
+        data = compressor.compress('a.b 1.5 1\n') + \
+                compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.assertEqual(zlib.decompressobj(zlib.MAX_WBITS | 16).decompress(data),
+                'a.b 1.5 1\n')
+        self.assertEqual(GraphitePool('h', 1, LineEmitter).compressor(), None)
+
+
+class RouterTest(unittest.TestCase):
+    relays = [('10.0.0.1', 2004, 'a'), ('10.0.0.2', 2004, 'b')]
+
+    def setUp(self):
+        self.router = GraphiteRouter(self.relays, LineEmitter)
+        self.clients = {}
+        for node, pool in self.router.pools.items():
+            pool.running = True
+            self.clients[node] = FakeClient()
+            pool.connected(self.clients[node])
+
+    def result(self, d):
+        out = []
+        d.addBoth(out.append)
+        return out[0]
+
+    def test_shards_by_ring(self):
+        points = [('metric.%d' % i, (1, 1.0)) for i in range(20)]
+        self.assertEqual(self.result(self.router.send(points)), 20)
+        for node, client in self.clients.items():
+            lines = ''.join(client.written).splitlines()
+            for line in lines:
+                self.assertEqual(self.router.ring.get_node(line.split()[0]), node)
+
+    def test_skips_dead_relay(self):
+        dead = self.router.ring.get_node('a.b')
+        self.router.pools[dead].disconnected(self.clients[dead])
+        self.assertNotEqual(self.router.route('a.b'), dead)
+        self.assertEqual(self.result(self.router.send(POINTS)), 2)
+
+    def test_fails_without_relays(self):
+        for node, pool in self.router.pools.items():
+            pool.disconnected(self.clients[node])
+        self.assertEqual(self.router.route('a.b'), None)
+        self.assertFalse(self.router.available)
+        failure = self.result(self.router.send(POINTS))
+        self.assertTrue(failure.check(GraphiteBackpressure))
+        self.assertEqual(sorted(failure.value.unsent), sorted(POINTS))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+###############################################################################
+#   Copyright 2006 to the present, Orbitz Worldwide, LLC.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+###############################################################################
+
+import unittest
+from droned.models.openmetrics import Exposition, metric_name, label_name, \
+        format_labels, format_value
+
+
+class FormatTest(unittest.TestCase):
+    def test_metric_name(self):
+        self.assertEqual(metric_name('droned', 'disk.usage-percent'),
+                'droned_disk_usage_percent')
+        self.assertEqual(metric_name('a:b'), 'a:b')
+        self.assertEqual(metric_name('1x'), '_1x')
+
+    def test_label_name(self):
+        self.assertEqual(label_name('a:b.c'), 'a_b_c')
+        self.assertEqual(label_name('0x'), '_0x')
+
+    def test_labels(self):
+        self.assertEqual(format_labels({}), '')
+        self.assertEqual(format_labels({'b': 1, 'a:x': 'q"\\\n'}),
+                '{a_x="q\\"\\\\\\n",b="1"}')
+
+    def test_value(self):
+        self.assertEqual(format_value(1), '1.0')
+        self.assertEqual(format_value(float('nan')), 'NaN')
+        self.assertEqual(format_value(float('inf')), '+Inf')
+        self.assertEqual(format_value(float('-inf')), '-Inf')
+
+
+class ExpositionTest(unittest.TestCase):
+    def test_render(self):
+        exposition = Exposition()
+        exposition.set('b', 2, '{x="1"}')
+        exposition.set('a', 1, kind='counter', help='things')
+        exposition.set('b', 3, '{x="0"}')
+        self.assertEqual(exposition.render(),
+                '# TYPE a counter\n# HELP a things\na_total 1.0\n'
+                '# TYPE b gauge\nb{x="0"} 3.0\nb{x="1"} 2.0\n# EOF\n')
+
+    def test_cached_until_changed(self):
+        exposition = Exposition()
+        exposition.set('a', 1)
+        text = exposition.render()
+        self.assertTrue(exposition.render() is text)
+        exposition.set('a', 2)
+        self.assertEqual(exposition.render(), '# TYPE a gauge\na 2.0\n# EOF\n')
+
+    def test_remove(self):
+        exposition = Exposition()
+        exposition.set('a', 1, '{x="1"}')
+        exposition.set('a', 1, '{x="2"}')
+        exposition.remove('a', '{x="1"}')
+        self.assertEqual(exposition.render(),
+                '# TYPE a gauge\na{x="2"} 1.0\n# EOF\n')
+        exposition.remove('a', '{x="2"}')
+        exposition.remove('missing')
+        self.assertEqual(exposition.render(), '# EOF\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
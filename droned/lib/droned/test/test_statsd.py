@@ -0,0 +1,103 @@
+###############################################################################
+#   Copyright 2006 to the present, Orbitz Worldwide, LLC.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+###############################################################################
+
+import time
+import unittest
+from droned.models.graphite import TimeSeriesData
+from droned.protocols.statsd import parse, StatsdProtocol
+from services import statsd
+
+
+class ParseTest(unittest.TestCase):
+    def test_counter(self):
+        self.assertEqual(parse('hits:3|c'), ('hits', 3.0, 'c', 1.0, False))
+        self.assertEqual(parse('hits:1|c|@0.1'), ('hits', 1.0, 'c', 0.1, False))
+
+    def test_gauge(self):
+        self.assertEqual(parse('load:5|g'), ('load', 5.0, 'g', 1.0, False))
+        self.assertEqual(parse('load:-2|g'), ('load', -2.0, 'g', 1.0, True))
+        self.assertEqual(parse('load:+2|g')[4], True)
+
+    def test_timer(self):
+        self.assertEqual(parse('a b/c:320|ms'), ('a_b-c', 320.0, 'ms', 1.0, False))
+
+    def test_malformed(self):
+        for line in ('hits', 'hits:1', ':1|c', 'hits:x|c', 'hits:1|c|@0',
+                'hits:1|c|@2'):
+            self.assertRaises(ValueError, parse, line)
+
+
+class ProtocolTest(unittest.TestCase):
+    def test_datagram(self):
+        samples = []
+        protocol = StatsdProtocol(lambda *s: samples.append(s))
+        protocol.datagramReceived('a:1|c\n\nbad\nb:2|g\n', ('127.0.0.1', 1))
+        self.assertEqual([s[0] for s in samples], ['a', 'b'])
+        self.assertEqual((protocol.received, protocol.malformed), (2, 1))
+
+
+class StatsdServiceTest(unittest.TestCase):
+    def setUp(self):
+        TimeSeriesData.dirty = set()
+        self.service = statsd.Statsd()
+
+    def tearDown(self):
+        TimeSeriesData._instanceMap.clear()
+        TimeSeriesData.dirty = set()
+
+    def value(self, metricID):
+        return list(TimeSeriesData(metricID).dataPoints)[-1][1]
+
+    def test_counter_scaled_by_rate(self):
+        self.service.sample('hits', 1.0, 'c', 0.1, False)
+        self.service.sample('hits', 2.0, 'c', 1.0, False)
+        self.assertAlmostEqual(self.value('stats.counters.hits.count'), 12.0)
+
+    def test_timer(self):
+        self.service.sample('req', 100.0, 'ms', 0.5, False)
+        self.service.sample('req', 300.0, 'ms', 0.5, False)
+        self.assertEqual(self.value('stats.timers.req.mean'), 200.0)
+        self.assertEqual(self.value('stats.timers.req.upper'), 300.0)
+        self.assertEqual(self.value('stats.timers.req.lower'), 100.0)
+        self.assertEqual(self.value('stats.timers.req.count'), 4.0)
+
+    def test_relative_gauge(self):
+        self.service.sample('load', 5.0, 'g', 1.0, False)
+        self.service.sample('load', -2.0, 'g', 1.0, True)
+        self.assertEqual(self.value('stats.gauges.load'), 3.0)
+
+    def test_unknown_type(self):
+        self.service.sample('x', 1.0, 'h', 1.0, False)
+        self.assertEqual(self.service.unknown, 1)
+        self.assertEqual(self.service.rollups, {})
+
+    def test_evicts_idle_names(self):
+        self.service.sample('old', 5.0, 'g', 1.0, False)
+        self.service.sample('req', 1.0, 'ms', 1.0, False)
+        self.service.touched['stats.gauges.old'] = time.time() - 7200
+        self.assertEqual(self.service.evict(3600), 1)
+        self.assertFalse('stats.gauges.old' in self.service.rollups)
+        self.assertFalse('stats.gauges.old' in self.service.gauges)
+        self.assertEqual(len(self.service.rollups), 4)
+        self.service.sample('old', 1.0, 'g', 1.0, True) #starts over
+        self.assertEqual(self.service.gauges['stats.gauges.old'], 1.0)
+
+    def test_idle_ttl_defaults_without_graphite(self):
+        self.assertEqual(self.service.statsd_idle_ttl, 3600.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
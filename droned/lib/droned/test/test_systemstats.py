@@ -0,0 +1,193 @@
+###############################################################################
+#   Copyright 2006 to the present, Orbitz Worldwide, LLC.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+###############################################################################
+
+import sys
+import types
+import unittest
+from twisted.internet import task
+
+if 'config' not in sys.modules: #provided by the daemon's ConfigManager
+    config = types.ModuleType('config')
+    config.HOSTNAME = 'localhost'
+    config.DRONED_PORT = 5500
+    config.DRONED_POLL_INTERVAL = 30
+    config.DRONED_KEY_DIR = '/etc/pki/droned'
+    config.DEBUG_EVENTS = False
+    sys.modules['config'] = config
+
+import droned.models.server #models load in the daemon's order
+from droned.models.graphite import DataPoint
+from droned.models.systemstats import StatBlock, ProcessStat, MetricTemplate, \
+        InvalidStatBlockDefinition, InvalidOutputBlockDefinition
+
+
+class AdaptiveBlock(StatBlock):
+    TYPE = "cpu"
+
+
+class FakeIdentity(object):
+    def __init__(self, pid, name, user):
+        self.pid = pid
+        self.name = name
+        self.user = user
+
+
+class FakeSample(object):
+    def __init__(self, pid, ppid, name='java', user='app', **values):
+        self.ident = FakeIdentity(pid, name, user)
+        self.ppid = ppid
+        self.values = values
+
+    def meta_data(self):
+        return {'pid': self.ident.pid, 'ppid': self.ppid,
+                'pname': self.ident.name}
+
+
+def sample(value):
+    return DataPoint(value=value, meta_data={"variables": ["usage.percent"]})
+
+
+class BlockTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.blocks = []
+
+    def tearDown(self):
+        for block in self.blocks:
+            for t in (block.collect_task, block.output_task):
+                if t.running: t.stop()
+            block.unexpose()
+
+    def make_block(self, cls, **kw):
+        config = dict(TYPE=cls.TYPE, METRICS=[], OUTPUTS=[])
+        config.update(kw)
+        block = cls(config)
+        for t in (block.collect_task, block.output_task):
+            t.stop()
+            t.clock = self.clock
+        block.collect_task.start(block.collect_interval, False)
+        block.PROTOCOLS = []
+        self.blocks.append(block)
+        return block
+
+
+class AdaptiveIntervalTest(BlockTestCase):
+    def make(self, **kw):
+        return self.make_block(AdaptiveBlock, COLLECT_INTERVAL='60s',
+                MIN_COLLECT_INTERVAL='5s', **kw)
+
+    def test_threshold_is_per_metric(self):
+        block = self.make(ADAPTIVE_THRESHOLD={'cpu.usage.percent': 90,
+                'time.iowait': 20})
+        self.assertEqual(block.ADAPTIVE_THRESHOLD,
+                {'usage.percent': 90.0, 'time.iowait': 20.0})
+        self.assertTrue(block.is_volatile('usage.percent', None, 95))
+        self.assertTrue(block.is_volatile('cpu.time.iowait', None, 20))
+        self.assertFalse(block.is_volatile('time.iowait', None, 19))
+        #a percent threshold says nothing about other metrics
+        self.assertFalse(block.is_volatile('time.user', None, 12345))
+
+    def test_threshold_must_be_a_map(self):
+        self.assertRaises(InvalidStatBlockDefinition, self.make,
+                ADAPTIVE_THRESHOLD=90)
+
+    def test_change(self):
+        block = self.make(ADAPTIVE_CHANGE=0.25)
+        self.assertFalse(block.is_volatile('time.user', None, 10))
+        self.assertFalse(block.is_volatile('time.user', 10, 12))
+        self.assertTrue(block.is_volatile('time.user', 10, 13))
+        self.assertTrue(block.is_volatile('time.user', 0, 1))
+
+    def test_speeds_up_then_backs_off(self):
+        block = self.make(ADAPTIVE_THRESHOLD={'usage.percent': 90})
+        block.save_batch([('usage.percent', sample(95))])
+        self.assertEqual(block.collect_interval, 5)
+        self.assertEqual(block.collect_task.interval, 5)
+        for expected in (10, 20, 40, 60, 60):
+            block.save_batch([('usage.percent', sample(50))])
+            self.assertEqual(block.collect_interval, expected)
+        self.assertEqual(block.collect_task.interval, 60)
+
+
+class MetricTemplateTest(unittest.TestCase):
+    def test_resolve(self):
+        template = MetricTemplate("servers.<hostname>.disk.<partition>.<stat> <value>")
+        self.assertEqual(template.value, 'value')
+        self.assertEqual(template.names, ('hostname', 'partition', 'stat'))
+        self.assertEqual(template.variables,
+                frozenset(['hostname', 'partition', 'stat', 'value']))
+        meta = {'hostname': 'web1.example.com', 'partition': '/var',
+                'stat': 'usage.percent', 'value': 5}
+        self.assertEqual(template.resolve(meta),
+                'servers.web1_example_com.disk./var.usage_percent')
+
+    def test_literal_percent(self):
+        template = MetricTemplate("cpu.100%.<cpu> <value>")
+        self.assertEqual(template.resolve({'cpu': 2}), 'cpu.100%.2')
+
+    def test_malformed(self):
+        for metric in ("servers.<hostname>", "a b c", "servers.<hostname> value"):
+            self.assertRaises(InvalidOutputBlockDefinition, MetricTemplate, metric)
+
+
+class GroupByTest(BlockTestCase):
+    def setUp(self):
+        BlockTestCase.setUp(self)
+        #init(1) <- 10 <- 11 <- 12, 20 <- 21 of another user
+        self.samples = [
+            FakeSample(10, 1, **{'memory.rss': 100, 'threads.count': 4}),
+            FakeSample(11, 10, **{'memory.rss': 10, 'threads.count': 1}),
+            FakeSample(12, 11, name='sh', **{'memory.rss': 1}),
+            FakeSample(20, 1, user='web', **{'memory.rss': 50}),
+            FakeSample(21, 20, user='web', **{'memory.rss': 5}),
+        ]
+
+    def group(self, **kw):
+        block = self.make_block(ProcessStat, **kw)
+        groups = block.group_samples(self.samples)
+        return dict((g.key, g) for g in groups)
+
+    def test_unknown_grouping(self):
+        self.assertRaises(InvalidStatBlockDefinition, self.make_block,
+                ProcessStat, GROUP_BY='host')
+
+    def test_tree(self):
+        groups = self.group(GROUP_BY='tree')
+        self.assertEqual(sorted(groups), ['10', '20'])
+        self.assertEqual(groups['10'].values,
+                {'memory.rss': 111, 'threads.count': 5})
+        self.assertEqual(groups['20'].values, {'memory.rss': 55})
+        #named after the root of the tree
+        meta = groups['10'].meta_data()
+        self.assertEqual((meta['pid'], meta['group']), (10, '10'))
+
+    def test_name_and_user(self):
+        groups = self.group(GROUP_BY='name', GROUP_METHOD='max')
+        self.assertEqual(groups['java'].values['memory.rss'], 100)
+        self.assertEqual(groups['sh'].values['memory.rss'], 1)
+        groups = self.group(GROUP_BY='user')
+        self.assertEqual(groups['app'].values['memory.rss'], 111)
+        self.assertEqual(groups['web'].values['memory.rss'], 55)
+        #meta data of the lowest pid
+        self.assertEqual(groups['web'].meta_data()['pid'], 20)
+
+    def test_appinstance(self):
+        block = self.make_block(ProcessStat, GROUP_BY='appinstance')
+        block.instance_pids = {11: 'tomcat_a'}
+        groups = dict((g.key, g) for g in block.group_samples(self.samples))
+        #11 and its child, the parent of the instance is not part of it
+        self.assertEqual(list(groups), ['tomcat_a'])
+        self.assertEqual(groups['tomcat_a'].values['memory.rss'], 11)
@@ -0,0 +1,101 @@
+###############################################################################
+#   Copyright 2006 to the present, Orbitz Worldwide, LLC.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+###############################################################################
+
+import shutil
+import tempfile
+import unittest
+from twisted.internet import defer
+from kitt.spool import SegmentSpool
+from droned.models.graphite import TimeSeriesData
+from droned.protocols.graphite import GraphiteBackpressure, LineEmitter
+
+
+class FakePool(object):
+    """a pool that is either down or writes everything, refuse limits how
+       many points of the next batch are not written.
+    """
+    available = False
+    refuse = 0
+    def __init__(self):
+        self.sent = []
+
+    def send(self, batch):
+        if self.refuse:
+            failure = GraphiteBackpressure('partly written')
+            failure.unsent = batch[-self.refuse:]
+            batch = batch[:-self.refuse]
+            self.refuse = 0
+            self.sent.extend(batch)
+            return defer.fail(failure)
+        self.sent.extend(batch)
+        return defer.succeed(len(batch))
+
+
+class SpoolReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        TimeSeriesData.spool = SegmentSpool(self.directory, segment_bytes=1)
+        TimeSeriesData.dirty = set()
+        self.pool = FakePool()
+
+    def tearDown(self):
+        TimeSeriesData.spool.close()
+        TimeSeriesData.spool = None
+        TimeSeriesData.dirty = set()
+        TimeSeriesData._instanceMap.clear()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def tick(self, stamp):
+        TimeSeriesData('a.b').append(stamp, float(stamp))
+        out = []
+        TimeSeriesData.produceBatchedMetrics('localhost', 2003, LineEmitter,
+                pool=self.pool).addCallback(out.append)
+        return out[0]
+
+    def test_outage_keeps_order(self):
+        for stamp in (1, 2, 3):
+            self.assertEqual(self.tick(stamp), 0)
+        spool = TimeSeriesData.spool
+        self.assertEqual(spool.segments, [0, 1, 2])
+        self.assertEqual(spool.oldest()[1], [[('a.b', (1, 1.0))]])
+        self.pool.available = True
+        self.assertEqual(self.tick(4), 4)
+        self.assertEqual([p[1][0] for p in self.pool.sent], [1, 2, 3, 4])
+        self.assertEqual(len(spool), 0)
+
+    def test_partial_replay_stays_at_head(self):
+        TimeSeriesData('a.c').append(1, 5.0)
+        self.tick(1)
+        self.tick(2)
+        spool = TimeSeriesData.spool
+        self.assertEqual(spool.segments, [0, 1])
+        self.pool.available = True
+        self.pool.refuse = 1
+        self.assertEqual(self.tick(3), 1)
+        self.assertEqual(spool.segments, [0, 1, 2])
+        seq, records = spool.oldest()
+        self.assertEqual(seq, 0)
+        self.assertEqual(len(records), 1)
+        leftover = records[0]
+        self.assertEqual(len(leftover), 1)
+        self.assertFalse(leftover[0] in self.pool.sent)
+        self.assertEqual(self.tick(4), 4)
+        self.assertEqual(self.pool.sent[1:3], leftover + [('a.b', (2, 2.0))])
+        self.assertEqual(len(spool), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
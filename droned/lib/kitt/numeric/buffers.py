@@ -0,0 +1,156 @@
+###############################################################################
+#   Copyright 2006 to the present, Orbitz Worldwide, LLC.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+###############################################################################
+
+from array import array
+from bisect import bisect_left
+
+__doc__ = '''
+Compact storage for numeric time series. Samples are kept column wise in
+array buffers so storing a sample does not allocate any python objects.
+'''
+
+class RingBuffer(object):
+    '''a fixed capacity series of (stamp,value) samples. once the buffer
+       is full the oldest sample is overwritten by the newest one.
+       #1 index of the oldest sample.
+    '''
+    def __init__(self,capacity):
+        self.capacity = max(1,int(capacity))
+        self.stamps = array('d',[0.0]) * self.capacity
+        self.values = array('d',[0.0]) * self.capacity
+        self.start = 0 #1
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        '''yields (stamp,value) from oldest to newest.'''
+        for i in xrange(self.size):
+            j = (self.start + i) % self.capacity
+            yield (self.stamps[j],self.values[j])
+
+    def append(self,stamp,value):
+        end = (self.start + self.size) % self.capacity
+        self.stamps[end] = stamp
+        self.values[end] = value
+        if self.size < self.capacity: self.size += 1
+        else: self.start = (self.start + 1) % self.capacity
+
+    def _ordered(self,column):
+        end = self.start + self.size
+        if end <= self.capacity: return column[self.start:end]
+        return column[self.start:] + column[:end - self.capacity]
+
+    def get_stamps(self):
+        '''@return: <array> copy of the stamps, oldest first.'''
+        return self._ordered(self.stamps)
+
+    def get_values(self):
+        '''@return: <array> copy of the values, oldest first.'''
+        return self._ordered(self.values)
+
+    def last(self):
+        '''@return: <tuple> newest (stamp,value) or None when empty.'''
+        if not self.size: return None
+        j = (self.start + self.size - 1) % self.capacity
+        return (self.stamps[j],self.values[j])
+
+    def replace(self,stamps,values):
+        '''swap the contents for the given samples, keeps the newest
+           `capacity` of them.
+        '''
+        self.clear()
+        for stamp,value in zip(stamps,values):
+            self.append(stamp,value)
+
+    def clear(self):
+        '''empties the buffer, the storage is kept for reuse.'''
+        self.start = 0
+        self.size = 0
+
+
+class PointStore(object):
+    '''an unbounded series of (stamp,value) samples kept sorted by stamp
+       in parallel array('l')/array('d') columns, one sample per stamp.
+       #1 index of the oldest sample, popped samples are only reclaimed
+          once they make up half of the columns.
+       #2 samples nearly always arrive in time order, anything else takes
+          the slow path.
+    '''
+    def __init__(self):
+        self.stamps = array('l')
+        self.values = array('d')
+        self.head = 0 #1
+
+    def __len__(self):
+        return len(self.stamps) - self.head
+
+    def __iter__(self):
+        '''yields (stamp,value) from oldest to newest.'''
+        for i in xrange(self.head,len(self.stamps)):
+            yield (self.stamps[i],self.values[i])
+
+    def add(self,stamp,value,replace=True):
+        '''store a sample, an existing sample with the same stamp is
+           overwritten unless replace is False.
+        '''
+        stamps = self.stamps
+        if len(stamps) == self.head or stamp > stamps[-1]: #2
+            stamps.append(stamp)
+            self.values.append(value)
+            return
+        i = bisect_left(stamps,stamp,self.head)
+        if stamps[i] == stamp:
+            if replace: self.values[i] = value
+            return
+        stamps.insert(i,stamp)
+        self.values.insert(i,value)
+
+    def oldest(self):
+        '''@return: <tuple> oldest (stamp,value) or None when empty.'''
+        if not len(self): return None
+        return (self.stamps[self.head],self.values[self.head])
+
+    def pop(self,count=1):
+        '''drop the oldest count samples.'''
+        self.head = min(self.head + count,len(self.stamps))
+        if self.head == len(self.stamps): self.clear()
+        elif self.head * 2 >= len(self.stamps): #1
+            del self.stamps[:self.head]
+            del self.values[:self.head]
+            self.head = 0
+
+    def discard(self,stamps):
+        '''drop the samples at the given ascending stamps, samples added
+           since the stamps were read stay wherever they landed.
+        '''
+        count = 0
+        for stamp in stamps: #nearly always the oldest samples in order
+            i = self.head + count
+            if i == len(self.stamps) or self.stamps[i] != stamp: break
+            count += 1
+        for stamp in stamps[count:]:
+            i = bisect_left(self.stamps,stamp,self.head + count)
+            if i < len(self.stamps) and self.stamps[i] == stamp:
+                del self.stamps[i]
+                del self.values[i]
+        if count: self.pop(count)
+
+    def clear(self):
+        self.stamps = array('l')
+        self.values = array('d')
+        self.head = 0
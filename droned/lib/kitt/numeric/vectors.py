@@ -4,10 +4,18 @@ Created on Jun 13, 2011
 @author: cbrinley
 '''
 
+import math
 from zope.interface import implements, Interface, Attribute
 from kitt.decorators import raises
 from kitt.util import ClassLoader
 
+try:
+    import numpy
+    NUMPY_AVAILABLE = True
+except ImportError:
+    numpy = None
+    NUMPY_AVAILABLE = False
+
 class TransformFailure(Exception):pass
 
 class ISimpleVectorTransform(Interface):
@@ -20,45 +28,196 @@ class ISimpleVectorTransform(Interface):
     TYPE = Attribute("<string>: specifies the type of transform. this should correspond to what is used in config.")
     def compute(vector):
         '''takes in a metric set and returns the transform of that set.'''
-        
+
+    def compute_many(vectors,stamps=None):
+        '''takes a list of metric sets, and optionally the sample times of
+           each set, and returns the transform of every set in order. this
+           is computed in one batched pass where possible.
+        '''
+
 
 class SimpleVectorTransformLoader(ClassLoader):
     interface_type = ISimpleVectorTransform
     subloaders = []
- 
+
 
 class VectorTransform(object):
+    '''base transform. subclasses implement compute() and, to take part
+       in batched numpy computation, compute_matrix() which receives every
+       same length vector of a batch as the rows of a 2d array.
+       #1 transforms that need sample times override compute_stamped().
+       #2 numpy only helps with a matrix to work on, group by length.
+    '''
     implements(ISimpleVectorTransform)
     TYPE = "none"
-    
+    compute_matrix = None
+
     @raises(TransformFailure)
     def compute(self,vector):
         return vector
-    
+
+    def compute_stamped(self,vector,stamps): #1
+        return self.compute(vector)
+
+    @raises(TransformFailure)
+    def compute_many(self,vectors,stamps=None):
+        if stamps is None: stamps = [None] * len(vectors)
+        if not (NUMPY_AVAILABLE and self.compute_matrix):
+            return [self.compute_stamped(list(v),s) for v,s in zip(vectors,stamps)]
+        out = [None] * len(vectors)
+        groups = {} #2
+        for i,v in enumerate(vectors):
+            groups.setdefault(len(v),[]).append(i)
+        for length,members in groups.items():
+            if not length:
+                for i in members: out[i] = []
+                continue
+            matrix = numpy.array([vectors[i] for i in members],dtype=float)
+            times = None
+            if stamps[members[0]] is not None:
+                times = numpy.array([stamps[i] for i in members],dtype=float)
+            result = self.compute_matrix(matrix,times).tolist()
+            for i,row in zip(members,result): out[i] = row
+        return out
+
 class SeriesAverage(VectorTransform):
     TYPE = "average"
-    
+
     @raises(TransformFailure)
     def compute(self, vector):
         return [sum(vector) / len(vector)]
-    
+
+    def compute_matrix(self,matrix,times):
+        return matrix.mean(axis=1).reshape(-1,1)
+
 class SeriesSum(VectorTransform):
     TYPE = "sum"
-    
+
     @raises(TransformFailure)
     def compute(self,vector):
         return [sum(vector)]
-    
+
+    def compute_matrix(self,matrix,times):
+        return matrix.sum(axis=1).reshape(-1,1)
+
 class SeriesMax(VectorTransform):
     TYPE = "max"
-    
+
     @raises(TransformFailure)
     def compute(self,vector):
         return [max(vector)]
-    
+
+    def compute_matrix(self,matrix,times):
+        return matrix.max(axis=1).reshape(-1,1)
+
 class SeriesMin(VectorTransform):
     TYPE = "min"
-    
+
     @raises(TransformFailure)
     def compute(self,vector):
         return [min(vector)]
+
+    def compute_matrix(self,matrix,times):
+        return matrix.min(axis=1).reshape(-1,1)
+
+class SeriesFirst(VectorTransform):
+    TYPE = "first"
+
+    @raises(TransformFailure)
+    def compute(self,vector):
+        return [vector[0]]
+
+    def compute_matrix(self,matrix,times):
+        return matrix[:,:1]
+
+class SeriesLast(VectorTransform):
+    TYPE = "last"
+
+    @raises(TransformFailure)
+    def compute(self,vector):
+        return [vector[-1]]
+
+    def compute_matrix(self,matrix,times):
+        return matrix[:,-1:]
+
+class SeriesStdDev(VectorTransform):
+    '''population standard deviation.'''
+    TYPE = "stddev"
+
+    @raises(TransformFailure)
+    def compute(self,vector):
+        mean = sum(vector) / float(len(vector))
+        return [math.sqrt(sum((v - mean) ** 2 for v in vector) / len(vector))]
+
+    def compute_matrix(self,matrix,times):
+        return matrix.std(axis=1).reshape(-1,1)
+
+class SeriesP50(VectorTransform):
+    '''percentile with linear interpolation between the closest ranks,
+       the same method numpy.percentile uses by default.
+    '''
+    TYPE = "p50"
+    PERCENTILE = 50
+
+    @raises(TransformFailure)
+    def compute(self,vector):
+        ordered = sorted(vector)
+        rank = (len(ordered) - 1) * self.PERCENTILE / 100.0
+        low = int(math.floor(rank))
+        high = int(math.ceil(rank))
+        return [ordered[low] + (ordered[high] - ordered[low]) * (rank - low)]
+
+    def compute_matrix(self,matrix,times):
+        return numpy.percentile(matrix,self.PERCENTILE,axis=1).reshape(-1,1)
+
+class SeriesP90(SeriesP50):
+    TYPE = "p90"
+    PERCENTILE = 90
+
+class SeriesP99(SeriesP50):
+    TYPE = "p99"
+    PERCENTILE = 99
+
+class SeriesDelta(VectorTransform):
+    '''total increase of a monotonic counter across the vector. a sample
+       lower than the one before it means the counter was reset, the
+       counter is then assumed to have restarted from zero.
+    '''
+    TYPE = "delta"
+
+    @raises(TransformFailure)
+    def compute(self,vector):
+        total = 0
+        for previous,current in zip(vector,vector[1:]):
+            if current < previous: total += current
+            else: total += current - previous
+        return [total]
+
+    def compute_matrix(self,matrix,times):
+        steps = numpy.diff(matrix,axis=1)
+        steps = numpy.where(steps < 0,matrix[:,1:],steps)
+        return steps.sum(axis=1).reshape(-1,1)
+
+class SeriesRate(SeriesDelta):
+    '''per second rate of a monotonic counter, counter resets are handled
+       like delta. without sample times every sample is one second apart.
+    '''
+    TYPE = "rate"
+
+    @raises(TransformFailure)
+    def compute(self,vector):
+        return self.compute_stamped(vector,None)
+
+    def compute_stamped(self,vector,stamps):
+        delta = SeriesDelta.compute(self,vector)[0]
+        if stamps: elapsed = stamps[-1] - stamps[0]
+        else: elapsed = len(vector) - 1
+        if elapsed <= 0: return [0.0]
+        return [delta / float(elapsed)]
+
+    def compute_matrix(self,matrix,times):
+        delta = SeriesDelta.compute_matrix(self,matrix,times).reshape(-1)
+        if times is not None: elapsed = times[:,-1] - times[:,0]
+        else: elapsed = numpy.zeros(len(matrix)) + (matrix.shape[1] - 1)
+        safe = numpy.where(elapsed > 0,elapsed,1.0)
+        return numpy.where(elapsed > 0,delta / safe,0.0).reshape(-1,1)
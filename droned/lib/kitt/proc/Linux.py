@@ -21,6 +21,7 @@ import sys, os, re, time, platform
 #all backends need to import these at minimum
 from kitt.interfaces import IKittProcModule, IKittProcess, \
         IKittProcessSnapshot, IKittLiveProcess, implements, moduleProvides
+from kitt.proc.pidfd import watcher
 
 if platform.system() != 'Linux':
     raise OSError("Sorry, only Linux is supported")
@@ -51,6 +52,8 @@ STATES = {
 }
 PAGESIZE = os.sysconf('SC_PAGESIZE')
 JIFFIES_PER_SECOND = os.sysconf('SC_CLK_TCK')
+#seconds a read of /proc/<pid>/* is reused, see Process._cached
+SNAPSHOT_TTL = 0.05
 
 stat_attribs = ('comm','state','ppid','pgrp','session','tty_nr','tpgid','flags', \
            'minflt','cminflt','majflt','cmajflt','utime','stime','cutime', \
@@ -87,10 +90,30 @@ class Process(object):
     def readFile(self,f):
         return open('%s/%s' % (self.path,f)).read()
 
+    def _cached(self,key,func,*args):
+        """snapshot on demand, the result of func(*args) is reused for
+           SNAPSHOT_TTL seconds so that reading several attributes in a
+           row opens and parses each /proc file once.
+           @return func(*args)
+        """
+        cache = self.__dict__.setdefault('_snapshot',{})
+        now = time.time()
+        entry = cache.get(key)
+        if entry and 0 <= now - entry[0] < SNAPSHOT_TTL: return entry[1]
+        value = func(*args)
+        cache[key] = (now,value)
+        return value
+
     def isRunning(self):
-        """is a process running
+        """is a process running, processes watched through a pidfd
+           are known to run until the watcher says otherwise.
            @return (bool)
         """
+        alive = watcher.alive(self.pid, self.inode)
+        if alive is not None: return alive
+        return self._cached('running',self._isRunning)
+
+    def _isRunning(self):
         try:
             if self.pid > 0:
                 #in case the process is an unreaped child
@@ -131,6 +154,9 @@ class Process(object):
         """Get all open file descriptors
            @return (dict)
         """
+        return self._cached('fd',self._readFD)
+
+    def _readFD(self):
         fd = {}
         try:
             for link in os.listdir('%s/fd' % self.path):
@@ -143,6 +169,9 @@ class Process(object):
         """Get all open tasks/threads
            @return (set)
         """
+        return self._cached('tasks',self._readTasks)
+
+    def _readTasks(self):
         try:
             if KERNEL26 or KERNEL3x:
                 taskDir = os.path.join(self.path,'task')
@@ -165,9 +194,13 @@ class Process(object):
         return set()
 
     def getStats(self):
-        """Get the process' stats
+        """Get the process' stats, the dict is shared until the
+           snapshot expires so don't modify it.
            @return (dict)
         """
+        return self._cached('stat',self._readStats)
+
+    def _readStats(self):
         stats = {}
         statstr = self.readFile('stat')
         begin,end = statstr.find('('),statstr.rfind(')')
@@ -245,8 +278,11 @@ class LiveProcess(Process):
         """
         baseline = self.cpuTime
         self.cpuTime = self.__cpuSnapShot()
-        u = (self.cpuTime[0] - baseline[0]) / (self.cpuTime[2] - baseline[2])
-        s = (self.cpuTime[1] - baseline[1]) / (self.cpuTime[2] - baseline[2])
+        elapsed = self.cpuTime[2] - baseline[2]
+        if elapsed <= 0: #same cpu snapshot as the baseline
+            return {'user_util' : 0.0, 'sys_util' : 0.0}
+        u = (self.cpuTime[0] - baseline[0]) / elapsed
+        s = (self.cpuTime[1] - baseline[1]) / elapsed
         return {
             'user_util' : 100 * u,
             'sys_util' : 100 * s
@@ -270,7 +306,8 @@ class LiveProcess(Process):
             try: return os.readlink('%s/root' % self.path)
             except: return None
         elif attr == 'tgid':
-            return int( self.readFile('status').split('Tgid:',1)[1].split(None,1)[0] )
+            status = self._cached('status',self.readFile,'status')
+            return int( status.split('Tgid:',1)[1].split(None,1)[0] )
         elif attr in stat_attribs: return self.getStats()[attr]
         elif attr == 'uid': 
             try: return os.stat(self.path).st_uid
@@ -316,37 +353,38 @@ def isRunning(pid):
     """is a given process id running, returns Boolean"""
     return bool(os.path.exists('%s/%d' % (PROCDIR,int(pid))))
 
+#order matters in this list, as new fields are add this list needs updated
+CPU_FIELDS = ('user','nice','system','idle','iowait','irq','softirq','steal','guest')
+#(time read, jiffies per field) shared by every caller, see _cpuJiffies
+_cpu_snapshot = [0.0, None]
+
+def _cpuJiffies():
+    """the aggregate cpu line of /proc/stat, it is always the first one.
+       the result is reused for SNAPSHOT_TTL seconds so sampling many
+       processes reads the file once.
+       @return (list) of jiffies in CPU_FIELDS order
+    """
+    now = time.time()
+    stamp, jiffies = _cpu_snapshot
+    if jiffies is None or not 0 <= now - stamp < SNAPSHOT_TTL:
+        fd = open('%s/stat' % PROCDIR)
+        try: line = fd.readline()
+        finally: fd.close()
+        jiffies = [int(b) for b in line.split()[1:]] #pops off cpu
+        _cpu_snapshot[:] = [now, jiffies]
+    return jiffies
+
 def cpuStats():
     """Returns a dictionary of cpu stats"""
-    a = [ b for b in [ i for i in open('%s/stat' % PROCDIR).read().split('\n') \
-	if i.startswith('cpu ') ][0].split(' ') if b != '' ]
-    a.pop(0) #pops off cpu from the list
-    #order matters in this list, as new fields are add this list needs updated
-    x = [ 
-        'user',
-        'nice',
-        'system',
-        'idle',
-        'iowait',
-        'irq',
-        'softirq',
-        'steal',
-        'guest'
-    ]
-    if len(a) != len(x):
-        while len(a) < len(x): x.pop() #not all entries exist on all systems
-        unknown = 0
-        while len(x) < len(a): #add unknown for safety
-            x.append("unknown%d" % unknown)
-            unknown += 1
-    #the names in "x" are keys for the dictionary and position is lookup for "a"
-    return dict([ (b, int( a[x.index(b)] )) for b in x ])
+    a = _cpuJiffies()
+    x = list(CPU_FIELDS[:len(a)]) #not all entries exist on all systems
+    while len(x) < len(a): #add unknown for safety
+        x.append("unknown%d" % (len(x) - len(CPU_FIELDS)))
+    return dict(zip(x, a))
 
 def cpuTotalTime():
     """Returns Total CPU Time Used in seconds"""
-    #throws away the keys and sums cpuStats dictionary
-    return float( sum( val for var, val in cpuStats().items()) ) / \
-            JIFFIES_PER_SECOND
+    return float( sum(_cpuJiffies()) ) / JIFFIES_PER_SECOND
 
 #no new attributes, methods, or classes to expose
 __all__ = []
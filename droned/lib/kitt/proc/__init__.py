@@ -16,6 +16,8 @@
 
 import os
 import sys
+import time
+import threading
 import warnings
 import platform
 import traceback
@@ -83,9 +85,17 @@ guarentees.
     class NullProcess(Process):
         '''Represents a non-existant process'''
         implements(IKittNullProcess)
+
+  SHARED STATE:
+    processTable = ProcessTable()
+        '''the process table as of the last scan() and what changed since
+           the scan before it, shared by everything that walks the table.
+           scan() only from the reactor, threads use snapshot().
+        '''
 """
 
 CPU_COUNT = os.sysconf('SC_NPROCESSORS_CONF')
+PROCDIR = '/proc' #platforms without a procfs override identify()
 
 class InvalidProcess(Exception): pass
 
@@ -220,6 +230,125 @@ class RemoteProcess(NullProcess):
     def __str__(self): return '%s(pid=%d)' % (self.__class__.__name__, self.pid)
     __repr__ = __str__
 
+class ProcessTable(object):
+    """A snapshot of the process table that is diffed against the previous
+       snapshot on every scan.  A process is identified by its pid and the
+       inode of its /proc entry, so a pid that was reused in between two
+       scans shows up in both ``exited`` and ``started`` (and ``reused``).
+
+       Values derived from a process can be memoized until the next scan
+       with ``memo()`` so that every consumer of the same snapshot shares
+       one read.
+
+       Only the reactor scans, worker threads get a ``snapshot()``.
+       #1 guards the memo, a scan replaces it instead of changing it.
+    """
+    def __init__(self):
+        self.processes = {} #pid -> identity
+        self.started = set()
+        self.exited = set()
+        self.reused = set()
+        self.stamp = 0 #time of the last scan
+        self.tick = 0 #number of scans
+        self.cache = {} #pid -> {name: value}
+        self.lock = threading.Lock() #1
+
+    def identify(self, pid):
+        """@return the identity of a running pid
+           @raise OSError if the pid is gone
+        """
+        return os.stat('%s/%d' % (PROCDIR, pid)).st_ino
+
+    def scan(self):
+        """take a new snapshot and compute the changes since the last one
+           @return self
+        """
+        stamp = time.time()
+        current = {}
+        for pid in listProcesses():
+            try: current[pid] = self.identify(pid)
+            except OSError: pass #exited while we were looking
+        previous = self.processes
+        self.started = set(pid for (pid, ident) in current.iteritems() \
+                if previous.get(pid) != ident)
+        self.exited = set(pid for (pid, ident) in previous.iteritems() \
+                if current.get(pid) != ident)
+        self.reused = self.started & self.exited
+        self.processes = current
+        self.lock.acquire()
+        try: self.cache = {}
+        finally: self.lock.release()
+        self.stamp = stamp
+        self.tick += 1
+        return self
+
+    def snapshot(self):
+        """@return (TableSnapshot) the last scan, safe to hand to a thread"""
+        return TableSnapshot(self)
+
+    def memo(self, pid, name, func, *args, **kwargs):
+        """@return func(*args, **kwargs), computed once per pid and name
+           until the next scan.
+        """
+        return memoize(self.cache, self.lock, pid, name, func, args, kwargs)
+
+    def invalidate(self, pid):
+        """forget what was memoized for pid, i.e. after it called exec"""
+        self.lock.acquire()
+        try: self.cache.pop(pid, None)
+        finally: self.lock.release()
+
+    def __contains__(self, pid):
+        return pid in self.processes
+
+    def __iter__(self):
+        return iter(sorted(self.processes))
+
+    def __len__(self):
+        return len(self.processes)
+
+
+class TableSnapshot(object):
+    """A read-only copy of one ProcessTable scan.  The memo is shared with
+       the table until the table scans again.
+    """
+    def __init__(self, table):
+        self.processes = dict(table.processes)
+        self.stamp = table.stamp
+        self.tick = table.tick
+        self.cache = table.cache
+        self.lock = table.lock
+
+    def memo(self, pid, name, func, *args, **kwargs):
+        """see ProcessTable.memo()"""
+        return memoize(self.cache, self.lock, pid, name, func, args, kwargs)
+
+    def __contains__(self, pid):
+        return pid in self.processes
+
+    def __iter__(self):
+        return iter(sorted(self.processes))
+
+    def __len__(self):
+        return len(self.processes)
+
+
+def memoize(cache, lock, pid, name, func, args, kwargs):
+    """the value is computed without holding the lock, two threads may
+       both compute it and the first one stored wins.
+    """
+    lock.acquire()
+    try: values = cache.setdefault(pid, {})
+    finally: lock.release()
+    if name in values: return values[name]
+    value = func(*args, **kwargs)
+    lock.acquire()
+    try: return values.setdefault(name, value)
+    finally: lock.release()
+
+#shared snapshot, see ProcessTable
+processTable = ProcessTable()
+
 ###############################################################################
 # Platform Agnostic Implemenation
 ###############################################################################
@@ -272,7 +401,8 @@ _backend = os.path.join(os.path.abspath(os.path.dirname(__file__)),
     _platform + '.py'
 )
 #exportable interfaces
-_EXPORTED = set(_process_interfaces.keys() + _required_methods)
+_EXPORTED = set(_process_interfaces.keys() + _required_methods + \
+        ['ProcessTable', 'TableSnapshot', 'processTable'])
 
 if os.path.exists(_backend):
     name = None
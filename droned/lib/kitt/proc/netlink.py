@@ -0,0 +1,160 @@
+###############################################################################
+#   Copyright 2006 to the present, Orbitz Worldwide, LLC.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+###############################################################################
+
+import os
+import errno
+import socket
+import struct
+from zope.interface import implements
+from twisted.internet.interfaces import IReadDescriptor
+from twisted.internet import reactor
+from twisted.python.log import msg
+
+__doc__ = """Linux process events from the kernel proc connector.
+
+The kernel multicasts fork, exec and exit of every process over a
+NETLINK_CONNECTOR socket.  Listening requires CAP_NET_ADMIN (root),
+``ProcConnector.start()`` raises ``socket.error`` when the socket can not
+be opened or subscribed so the caller can fall back to polling.  When
+the kernel drops events because we fell behind ``overrun()`` is called,
+the caller should rescan whatever it tracks.
+
+usage:
+    def handler(what, pid, tgid, data): ...
+    def overrun(): ...
+    connector = ProcConnector(handler, overrun)
+    connector.start() #registers with the reactor
+"""
+
+NETLINK_CONNECTOR = 11
+CN_IDX_PROC = 1
+CN_VAL_PROC = 1
+NLMSG_DONE = 3
+PROC_CN_MCAST_LISTEN = 1
+PROC_CN_MCAST_IGNORE = 2
+
+PROC_EVENT_EXEC = 0x00000002
+PROC_EVENT_EXIT = 0x80000000
+
+NLMSGHDR = struct.Struct('=LHHLL') #len, type, flags, seq, pid
+CN_MSG = struct.Struct('=LLLLHH') #idx, val, seq, ack, len, flags
+PROC_EVENT = struct.Struct('=LLQ') #what, cpu, timestamp_ns
+#event data following PROC_EVENT, the pid and tgid always come first
+EVENT_DATA = {
+    PROC_EVENT_EXEC: struct.Struct('=LL'), #pid, tgid
+    PROC_EVENT_EXIT: struct.Struct('=LLLL'), #pid, tgid, exit code, signal
+}
+
+
+def subscription(op=PROC_CN_MCAST_LISTEN):
+    """@return (string) the netlink message that (un)subscribes us"""
+    payload = struct.pack('=L', op)
+    msg = CN_MSG.pack(CN_IDX_PROC, CN_VAL_PROC, 0, 0, len(payload), 0)
+    size = NLMSGHDR.size + len(msg) + len(payload)
+    return NLMSGHDR.pack(size, NLMSG_DONE, 0, 0, os.getpid()) + msg + payload
+
+
+def parse(data):
+    """parse the netlink messages of one datagram
+
+       @return (list) - [(what, pid, tgid, data), ...] where data is the
+           full event data tuple, only exec and exit events are kept.
+    """
+    events = []
+    offset = 0
+    while offset + NLMSGHDR.size <= len(data):
+        size = NLMSGHDR.unpack_from(data, offset)[0]
+        if size < NLMSGHDR.size: break
+        start = offset + NLMSGHDR.size + CN_MSG.size
+        offset += (size + 3) & ~3 #messages are 4 byte aligned
+        if start + PROC_EVENT.size > len(data): break
+        what = PROC_EVENT.unpack_from(data, start)[0]
+        layout = EVENT_DATA.get(what)
+        if not layout: continue #events we did not ask about
+        start += PROC_EVENT.size
+        if start + layout.size > len(data): break
+        fields = layout.unpack_from(data, start)
+        events.append((what, fields[0], fields[1], fields))
+    return events
+
+
+class ProcConnector(object):
+    """reads process events from the proc connector in the reactor and
+       hands each one to ``handler(what, pid, tgid, data)``.
+
+       #1 the socket buffer overflowed, the kernel dropped events.
+    """
+    implements(IReadDescriptor)
+    BUFSIZE = 65536
+
+    def __init__(self, handler, overrun=None):
+        self.handler = handler
+        self.overrun = overrun
+        self.sock = None
+        self.lost = 0 #times the kernel dropped events, we fell behind
+
+    running = property(lambda s: s.sock is not None)
+
+    def start(self):
+        """@raise socket.error - when not privileged or not on linux"""
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM,
+                NETLINK_CONNECTOR)
+        try:
+            sock.bind((os.getpid(), CN_IDX_PROC))
+            sock.send(subscription(PROC_CN_MCAST_LISTEN))
+            sock.setblocking(False)
+        except:
+            sock.close()
+            raise
+        self.sock = sock
+        reactor.addReader(self)
+
+    def stop(self):
+        if not self.sock: return
+        reactor.removeReader(self)
+        try: self.sock.send(subscription(PROC_CN_MCAST_IGNORE))
+        except socket.error: pass
+        self.sock.close()
+        self.sock = None
+
+    def fileno(self):
+        if not self.sock: return -1
+        return self.sock.fileno()
+
+    def doRead(self):
+        overrun = False
+        while self.sock:
+            try: data = self.sock.recv(self.BUFSIZE)
+            except socket.error, e:
+                if e.args[0] == errno.ENOBUFS: #1
+                    overrun = True
+                    continue
+                break #EAGAIN, drained
+            for event in parse(data):
+                self.handler(*event)
+        if not overrun: return
+        self.lost += 1
+        msg('process events were lost (%d times so far), rescanning' % \
+                (self.lost,), system='ProcConnector')
+        if self.overrun: self.overrun()
+
+    def connectionLost(self, reason):
+        self.stop()
+
+    def logPrefix(self):
+        return 'ProcConnector'
+
+__all__ = ['ProcConnector', 'PROC_EVENT_EXEC', 'PROC_EVENT_EXIT']
@@ -0,0 +1,176 @@
+###############################################################################
+#   Copyright 2006 to the present, Orbitz Worldwide, LLC.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+###############################################################################
+
+import os
+import ctypes
+from zope.interface import implements
+from twisted.internet.interfaces import IReadDescriptor
+from twisted.python.log import err
+
+__doc__ = """Exit notification for individual processes through pidfds.
+
+A pidfd (linux 5.3+) becomes readable when its process exits, so a
+watched process costs nothing until it dies.  While a process is watched
+``PidfdWatcher.alive()`` answers whether it is running without touching
+/proc.
+
+usage:
+    def exited(pid): ...
+    if watcher.available: watcher.watch(pid, exited, inode=inode)
+"""
+
+SYS_pidfd_open = 434 #the same on every architecture using the generic table
+
+try:
+    _libc = ctypes.CDLL(None, use_errno=True)
+    _syscall = _libc.syscall
+except (OSError, AttributeError):
+    _syscall = None
+
+
+def pidfd_open(pid):
+    """@return (int) a pidfd for pid
+       @raise OSError - if the kernel has no pidfds or pid is gone
+    """
+    if not _syscall:
+        raise OSError(38, 'pidfd_open is not available')
+    fd = _syscall(SYS_pidfd_open, ctypes.c_int(pid), ctypes.c_uint(0))
+    if fd < 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+    return fd
+
+
+class Pidfd(object):
+    """one watched process registered with the reactor"""
+    implements(IReadDescriptor)
+
+    def __init__(self, watcher, pid, fd, inode):
+        self.watcher = watcher
+        self.pid = pid
+        self.fd = fd
+        self.inode = inode
+
+    def fileno(self):
+        return self.fd
+
+    def doRead(self):
+        self.watcher.exited(self)
+
+    def connectionLost(self, reason):
+        self.close()
+
+    def close(self):
+        if self.fd < 0: return
+        try: os.close(self.fd)
+        except OSError: pass
+        self.fd = -1
+
+    def logPrefix(self):
+        return 'Pidfd(pid=%d)' % (self.pid,)
+
+
+class PidfdWatcher(object):
+    """watches processes by pid, ``callback(pid)`` runs in the reactor
+       once the process exits.
+
+       #1 the pid may have been reused between deciding to watch it and
+          opening the pidfd, the /proc inode tells. a process that is
+          already gone is reported on the next reactor iteration.
+       #2 reap our own children, isRunning used to do that when polled.
+       #3 kitt.proc imports this module before droned picks a reactor,
+          importing the reactor here would install the default one.
+    """
+    def __init__(self):
+        self.watches = {} #pid -> Pidfd
+        self.callbacks = {} #pid -> [callback, ...]
+        self._available = None
+
+    @property
+    def available(self):
+        """whether the kernel supports pidfds, checked once"""
+        if self._available is None:
+            try:
+                os.close(pidfd_open(os.getpid()))
+                self._available = True
+            except OSError:
+                self._available = False
+        return self._available
+
+    def watching(self, pid):
+        return pid in self.watches
+
+    def alive(self, pid, inode=None):
+        """@return (bool) whether a watched process is running or None
+           when the process is not watched.
+        """
+        watch = self.watches.get(pid)
+        if watch is None: return None
+        if inode is not None and watch.inode != inode: return None
+        return True
+
+    def watch(self, pid, callback, inode=None):
+        """start watching pid, watching a pid twice adds the callback
+
+           @raise OSError - when pidfds are not supported
+        """
+        from twisted.internet import reactor #3
+        pid = int(pid)
+        if pid in self.watches:
+            self.callbacks[pid].append(callback)
+            return
+        try: fd = pidfd_open(pid)
+        except OSError, e:
+            if e.errno != 3: raise #ESRCH, it is gone already
+            reactor.callLater(0, callback, pid)
+            return
+        try: current = os.stat('/proc/%d' % (pid,)).st_ino
+        except OSError: current = None
+        if inode is not None and current != inode: #1
+            os.close(fd)
+            reactor.callLater(0, callback, pid)
+            return
+        watch = Pidfd(self, pid, fd, current)
+        self.watches[pid] = watch
+        self.callbacks[pid] = [callback]
+        reactor.addReader(watch)
+
+    def unwatch(self, pid):
+        watch = self.watches.pop(pid, None)
+        self.callbacks.pop(pid, None)
+        if watch:
+            from twisted.internet import reactor #3
+            reactor.removeReader(watch)
+            watch.close()
+
+    def exited(self, watch):
+        pid = watch.pid
+        callbacks = self.callbacks.get(pid, [])
+        self.unwatch(pid)
+        try: os.waitpid(pid, os.WNOHANG) #2
+        except OSError: pass
+        for callback in callbacks:
+            try: callback(pid)
+            except: err() #one bad callback must not starve the others
+
+    def stop(self):
+        for pid in self.watches.keys():
+            self.unwatch(pid)
+
+#shared by kitt.proc and droned
+watcher = PidfdWatcher()
+
+__all__ = ['PidfdWatcher', 'watcher', 'pidfd_open']
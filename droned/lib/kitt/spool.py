@@ -0,0 +1,153 @@
+###############################################################################
+#   Copyright 2006 to the present, Orbitz Worldwide, LLC.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+###############################################################################
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+import struct
+import os
+
+__doc__ = """
+An append only on disk spool made of numbered segment files. Records are
+pickled and length prefixed, they are read back a whole segment at a time
+oldest first. Once the spool is over its size cap whole segments are
+evicted oldest first.
+"""
+
+HEADER = struct.Struct('!L')
+
+class SegmentSpool(object):
+    """spool of pickleable records kept in DIRECTORY/<sequence>.spool files
+
+       #1 never append to a segment left over from a previous run, its
+          last record may have been cut short.
+       #2 the newest segment is always kept, even when it is over the cap.
+       #3 a truncated record ends the segment.
+       #4 written next to the segment and renamed over it, a crash leaves
+          either the old or the new records.
+    """
+    SUFFIX = '.spool'
+
+    def __init__(self, directory, max_bytes=64*1024*1024,
+            segment_bytes=1024*1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.segments = []
+        self.sizes = {}
+        self.current = None #(sequence, file) being appended to
+        self.evicted = 0 #segments dropped because of the cap
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        for name in os.listdir(directory):
+            if not name.endswith(self.SUFFIX): continue
+            try: seq = int(name[:-len(self.SUFFIX)])
+            except ValueError: continue
+            self.segments.append(seq)
+            self.sizes[seq] = os.path.getsize(self.path(seq))
+        self.segments.sort() #1
+
+    def __len__(self):
+        """@return number of segments holding records"""
+        return len(self.segments)
+
+    size = property(lambda s: sum(s.sizes.values()))
+
+    def path(self, seq):
+        return os.path.join(self.directory, '%012d%s' % (seq, self.SUFFIX))
+
+    def append(self, record):
+        """write a record to the newest segment"""
+        data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+        if not self.current or self.sizes[self.current[0]] >= self.segment_bytes:
+            self.rotate()
+        seq, fd = self.current
+        fd.write(HEADER.pack(len(data)) + data)
+        fd.flush()
+        self.sizes[seq] += HEADER.size + len(data)
+        self.evict()
+
+    def rotate(self):
+        """start a new segment"""
+        self.close()
+        seq = 0
+        if self.segments: seq = self.segments[-1] + 1
+        self.segments.append(seq)
+        self.sizes[seq] = 0
+        self.current = (seq, open(self.path(seq), 'ab'))
+
+    def evict(self):
+        while self.size > self.max_bytes and len(self.segments) > 1: #2
+            self.remove(self.segments[0])
+            self.evicted += 1
+
+    def oldest(self):
+        """@return (sequence, [record, ...]) of the oldest segment or None"""
+        if not self.segments: return None
+        seq = self.segments[0]
+        if self.current and self.current[0] == seq:
+            self.close() #the next append starts a new segment
+        records = []
+        fd = open(self.path(seq), 'rb')
+        try:
+            while True:
+                header = fd.read(HEADER.size)
+                if len(header) < HEADER.size: break
+                length, = HEADER.unpack(header)
+                data = fd.read(length)
+                if len(data) < length: break #3
+                try: records.append(pickle.loads(data))
+                except: break #3
+        finally:
+            fd.close()
+        return (seq, records)
+
+    def rewrite(self, seq, records):
+        """replace the records of a segment in place, usually with the ones
+           that could not be replayed, so they keep their place in line.
+        """
+        if not records: return self.remove(seq)
+        if seq not in self.segments: return
+        if self.current and self.current[0] == seq:
+            self.close()
+        path = self.path(seq)
+        fd = open(path + '.tmp', 'wb') #4
+        try:
+            for record in records:
+                data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+                fd.write(HEADER.pack(len(data)) + data)
+        finally:
+            fd.close()
+        os.rename(path + '.tmp', path)
+        self.sizes[seq] = os.path.getsize(path)
+
+    def remove(self, seq):
+        """delete a segment, usually after its records were replayed"""
+        if self.current and self.current[0] == seq:
+            self.close()
+        if seq in self.segments:
+            self.segments.remove(seq)
+        self.sizes.pop(seq, None)
+        try: os.unlink(self.path(seq))
+        except OSError: pass
+
+    def close(self):
+        if self.current:
+            self.current[1].close()
+            self.current = None
+
+__all__ = ['SegmentSpool']
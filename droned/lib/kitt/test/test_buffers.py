@@ -0,0 +1,112 @@
+###############################################################################
+#   Copyright 2006 to the present, Orbitz Worldwide, LLC.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+###############################################################################
+
+import unittest
+from kitt.numeric.buffers import RingBuffer, PointStore
+
+
+class RingBufferTest(unittest.TestCase):
+    def test_empty(self):
+        buf = RingBuffer(3)
+        self.assertEqual(len(buf), 0)
+        self.assertEqual(list(buf), [])
+        self.assertEqual(buf.last(), None)
+
+    def test_overwrites_oldest(self):
+        buf = RingBuffer(3)
+        for i in range(5):
+            buf.append(i, i * 10)
+        self.assertEqual(len(buf), 3)
+        self.assertEqual(list(buf), [(2, 20), (3, 30), (4, 40)])
+        self.assertEqual(list(buf.get_stamps()), [2, 3, 4])
+        self.assertEqual(list(buf.get_values()), [20, 30, 40])
+        self.assertEqual(buf.last(), (4, 40))
+
+    def test_replace_keeps_newest(self):
+        buf = RingBuffer(2)
+        buf.append(9, 9)
+        buf.replace([1, 2, 3], [10, 20, 30])
+        self.assertEqual(list(buf), [(2, 20), (3, 30)])
+
+    def test_clear(self):
+        buf = RingBuffer(2)
+        buf.append(1, 1)
+        buf.clear()
+        self.assertEqual(len(buf), 0)
+        buf.append(2, 2)
+        self.assertEqual(list(buf), [(2, 2)])
+
+    def test_capacity_is_at_least_one(self):
+        buf = RingBuffer(0)
+        buf.append(1, 1)
+        buf.append(2, 2)
+        self.assertEqual(list(buf), [(2, 2)])
+
+
+class PointStoreTest(unittest.TestCase):
+    def store(self, *stamps):
+        points = PointStore()
+        for stamp in stamps:
+            points.add(stamp, float(stamp))
+        return points
+
+    def test_sorted_by_stamp(self):
+        points = self.store(3, 1, 2)
+        self.assertEqual([s for s, v in points], [1, 2, 3])
+        self.assertEqual(points.oldest(), (1, 1.0))
+
+    def test_same_stamp(self):
+        points = self.store(1)
+        points.add(1, 5.0, replace=False)
+        self.assertEqual(list(points), [(1, 1.0)])
+        points.add(1, 5.0)
+        self.assertEqual(list(points), [(1, 5.0)])
+
+    def test_pop(self):
+        points = self.store(1, 2, 3, 4)
+        points.pop()
+        self.assertEqual(points.oldest(), (2, 2.0))
+        points.pop(2)
+        self.assertEqual(list(points), [(4, 4.0)])
+        points.pop(5)
+        self.assertEqual(len(points), 0)
+        self.assertEqual(points.oldest(), None)
+
+    def test_pop_reclaims_space(self):
+        points = self.store(*range(10))
+        points.pop(6)
+        self.assertEqual(points.head, 0)
+        self.assertEqual(len(points.stamps), 4)
+        self.assertEqual(points.oldest(), (6, 6.0))
+
+    def test_discard_keeps_points_added_meanwhile(self):
+        points = self.store(10, 20, 30)
+        sent = [s for s, v in points]
+        points.add(5, 5.0)
+        points.add(40, 40.0)
+        points.discard(sent)
+        self.assertEqual(list(points), [(5, 5.0), (40, 40.0)])
+
+    def test_discard(self):
+        points = self.store(1, 2, 3, 4, 5)
+        points.discard([1, 2])
+        self.assertEqual([s for s, v in points], [3, 4, 5])
+        points.discard([4, 6])
+        self.assertEqual([s for s, v in points], [3, 5])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+###############################################################################
+#   Copyright 2006 to the present, Orbitz Worldwide, LLC.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+###############################################################################
+
+import errno
+import socket
+import struct
+import unittest
+from kitt.proc import netlink
+from kitt.proc.netlink import parse, subscription, ProcConnector, \
+        PROC_EVENT_EXEC, PROC_EVENT_EXIT, NLMSGHDR, CN_MSG, PROC_EVENT
+
+
+def message(what, data):
+    """one netlink message carrying a proc event"""
+    event = PROC_EVENT.pack(what, 0, 0) + data
+    cn = CN_MSG.pack(netlink.CN_IDX_PROC, netlink.CN_VAL_PROC, 0, 0,
+            len(event), 0)
+    size = NLMSGHDR.size + len(cn) + len(event)
+    return NLMSGHDR.pack(size, netlink.NLMSG_DONE, 0, 0, 0) + cn + event
+
+
+class FakeSocket(object):
+    """returns the queued datagrams or raises the queued errnos"""
+    def __init__(self, *reads):
+        self.reads = list(reads)
+
+    def recv(self, size):
+        if not self.reads: raise socket.error(errno.EAGAIN, 'drained')
+        read = self.reads.pop(0)
+        if isinstance(read, int): raise socket.error(read, 'error')
+        return read
+
+
+class ParseTest(unittest.TestCase):
+    def test_exit(self):
+        data = message(PROC_EVENT_EXIT, struct.pack('=LLLL', 10, 10, 9, 0))
+        self.assertEqual(parse(data), [(PROC_EVENT_EXIT, 10, 10, (10, 10, 9, 0))])
+
+    def test_exec_and_exit_in_one_datagram(self):
+        data = message(PROC_EVENT_EXEC, struct.pack('=LL', 11, 10)) + \
+                message(PROC_EVENT_EXIT, struct.pack('=LLLL', 12, 12, 0, 0))
+        self.assertEqual([(e[0], e[1], e[2]) for e in parse(data)],
+                [(PROC_EVENT_EXEC, 11, 10), (PROC_EVENT_EXIT, 12, 12)])
+
+    def test_ignores_other_events(self):
+        fork = message(0x00000001, struct.pack('=LLLL', 1, 1, 2, 2))
+        self.assertEqual(parse(fork), [])
+
+    def test_truncated(self):
+        data = message(PROC_EVENT_EXIT, struct.pack('=LLLL', 10, 10, 9, 0))
+        self.assertEqual(parse(data[:-4]), [])
+        self.assertEqual(parse(data[:8]), [])
+
+    def test_subscription(self):
+        data = subscription()
+        size, kind = NLMSGHDR.unpack_from(data)[:2]
+        self.assertEqual((size, kind), (len(data), netlink.NLMSG_DONE))
+        self.assertEqual(struct.unpack('=L', data[-4:])[0],
+                netlink.PROC_CN_MCAST_LISTEN)
+
+
+class ConnectorTest(unittest.TestCase):
+    def setUp(self):
+        self.events = []
+        self.overruns = []
+        self.connector = ProcConnector(lambda *e: self.events.append(e),
+                lambda: self.overruns.append(True))
+
+    def test_reads_until_drained(self):
+        self.connector.sock = FakeSocket(
+                message(PROC_EVENT_EXIT, struct.pack('=LLLL', 1, 1, 0, 0)),
+                message(PROC_EVENT_EXIT, struct.pack('=LLLL', 2, 2, 0, 0)))
+        self.connector.doRead()
+        self.assertEqual([e[1] for e in self.events], [1, 2])
+        self.assertEqual(self.overruns, [])
+
+    def test_overrun(self):
+        self.connector.sock = FakeSocket(errno.ENOBUFS,
+                message(PROC_EVENT_EXIT, struct.pack('=LLLL', 1, 1, 0, 0)),
+                errno.ENOBUFS)
+        self.connector.doRead()
+        self.assertEqual(len(self.events), 1)
+        self.assertEqual(self.overruns, [True])
+        self.assertEqual(self.connector.lost, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
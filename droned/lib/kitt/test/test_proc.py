@@ -0,0 +1,130 @@
+###############################################################################
+#   Copyright 2006 to the present, Orbitz Worldwide, LLC.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+###############################################################################
+
+import os
+import threading
+import unittest
+import kitt.proc
+from kitt.proc import ProcessTable
+
+
+class FakeTable(ProcessTable):
+    """process table over a dict of pid -> inode"""
+    def __init__(self, procs):
+        ProcessTable.__init__(self)
+        self.procs = procs
+
+    def identify(self, pid):
+        if pid not in self.procs: raise OSError(3, 'No such process')
+        return self.procs[pid]
+
+
+class ProcessTableTest(unittest.TestCase):
+    def setUp(self):
+        self.listProcesses = kitt.proc.listProcesses
+        self.procs = {}
+        kitt.proc.listProcesses = lambda: list(self.procs)
+
+    def tearDown(self):
+        kitt.proc.listProcesses = self.listProcesses
+
+    def test_diff(self):
+        self.procs.update({1: 100, 2: 200, 3: 300})
+        table = FakeTable(self.procs).scan()
+        self.assertEqual(table.started, set([1, 2, 3]))
+        self.assertEqual(table.exited, set())
+        del self.procs[2]
+        self.procs[4] = 400
+        table.scan()
+        self.assertEqual(table.started, set([4]))
+        self.assertEqual(table.exited, set([2]))
+        self.assertEqual(list(table), [1, 3, 4])
+        self.assertEqual(table.tick, 2)
+
+    def test_reused_pid(self):
+        self.procs.update({1: 100})
+        table = FakeTable(self.procs).scan()
+        self.procs[1] = 101
+        table.scan()
+        self.assertEqual(table.reused, set([1]))
+        self.assertTrue(1 in table.started and 1 in table.exited)
+
+    def test_vanished_while_scanning(self):
+        table = FakeTable(self.procs)
+        kitt.proc.listProcesses = lambda: [1, 2]
+        self.procs[1] = 100
+        table.scan()
+        self.assertEqual(list(table), [1])
+
+    def test_memo_until_next_scan(self):
+        self.procs[1] = 100
+        table = FakeTable(self.procs).scan()
+        calls = []
+        def read(value):
+            calls.append(value)
+            return value
+        self.assertEqual(table.memo(1, 'x', read, 'a'), 'a')
+        self.assertEqual(table.memo(1, 'x', read, 'b'), 'a')
+        table.invalidate(1)
+        self.assertEqual(table.memo(1, 'x', read, 'c'), 'c')
+        table.scan()
+        self.assertEqual(table.memo(1, 'x', read, 'd'), 'd')
+        self.assertEqual(calls, ['a', 'c', 'd'])
+
+    def test_snapshot_is_not_changed_by_scans(self):
+        self.procs.update({1: 100, 2: 200})
+        table = FakeTable(self.procs).scan()
+        snapshot = table.snapshot()
+        del self.procs[2]
+        table.scan()
+        self.assertEqual(list(snapshot), [1, 2])
+        self.assertEqual(list(table), [1])
+        self.assertEqual(snapshot.tick, 1)
+
+    def test_snapshot_shares_memo_until_next_scan(self):
+        self.procs[1] = 100
+        table = FakeTable(self.procs).scan()
+        snapshot = table.snapshot()
+        self.assertEqual(snapshot.memo(1, 'x', lambda: 'a'), 'a')
+        self.assertEqual(table.memo(1, 'x', lambda: 'b'), 'a')
+        table.scan()
+        self.assertEqual(table.memo(1, 'x', lambda: 'c'), 'c')
+        self.assertEqual(snapshot.memo(1, 'x', lambda: 'd'), 'a')
+
+    def test_memo_from_threads(self):
+        self.procs.update(dict((pid, pid) for pid in range(50)))
+        table = FakeTable(self.procs).scan()
+        snapshot = table.snapshot()
+        results = []
+        def walk():
+            results.append([snapshot.memo(pid, 'x', lambda: object()) \
+                    for pid in snapshot])
+        threads = [threading.Thread(target=walk) for i in range(4)]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        for result in results[1:]:
+            self.assertEqual(map(id, result), map(id, results[0]))
+
+    def test_live_scan(self):
+        table = ProcessTable()
+        kitt.proc.listProcesses = self.listProcesses
+        if not os.path.isdir(kitt.proc.PROCDIR): return
+        table.scan()
+        self.assertTrue(os.getpid() in table)
+
+
+if __name__ == '__main__':
+    unittest.main()
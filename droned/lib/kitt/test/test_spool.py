@@ -0,0 +1,105 @@
+###############################################################################
+#   Copyright 2006 to the present, Orbitz Worldwide, LLC.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+###############################################################################
+
+import os
+import shutil
+import tempfile
+import unittest
+from kitt.spool import SegmentSpool
+
+
+class SegmentSpoolTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def spool(self, **kwargs):
+        return SegmentSpool(self.directory, **kwargs)
+
+    def test_replay_oldest_first(self):
+        spool = self.spool(segment_bytes=1)
+        for i in range(3):
+            spool.append(('metric', (i, float(i))))
+        self.assertEqual(len(spool), 3)
+        seq, records = spool.oldest()
+        self.assertEqual(records, [('metric', (0, 0.0))])
+        spool.remove(seq)
+        self.assertEqual(spool.oldest()[1], [('metric', (1, 1.0))])
+
+    def test_survives_restart(self):
+        spool = self.spool()
+        spool.append('a')
+        spool.append('b')
+        spool.close()
+        spool = self.spool()
+        self.assertEqual(spool.oldest()[1], ['a', 'b'])
+        spool.append('c') #never appended to a previous run's segment
+        self.assertEqual(len(spool), 2)
+
+    def test_reading_closes_current_segment(self):
+        spool = self.spool()
+        spool.append('a')
+        seq, records = spool.oldest()
+        spool.append('b')
+        self.assertEqual(records, ['a'])
+        self.assertEqual(len(spool), 2)
+        spool.remove(seq)
+        self.assertEqual(spool.oldest()[1], ['b'])
+
+    def test_evicts_oldest_segments(self):
+        spool = self.spool(max_bytes=200, segment_bytes=1)
+        for i in range(20):
+            spool.append('x' * 50)
+        self.assertTrue(spool.size <= 200)
+        self.assertTrue(spool.evicted > 0)
+        self.assertEqual(len(os.listdir(self.directory)), len(spool))
+
+    def test_keeps_newest_segment_over_cap(self):
+        spool = self.spool(max_bytes=1)
+        spool.append('x' * 100)
+        self.assertEqual(spool.oldest()[1], ['x' * 100])
+
+    def test_truncated_record(self):
+        spool = self.spool()
+        spool.append('a')
+        spool.append('b')
+        spool.close()
+        path = spool.path(spool.segments[0])
+        fd = open(path, 'r+b')
+        fd.truncate(os.path.getsize(path) - 1)
+        fd.close()
+        self.assertEqual(self.spool().oldest()[1], ['a'])
+
+    def test_rewrite_keeps_place(self):
+        spool = self.spool(segment_bytes=1)
+        spool.append(['a', 'b'])
+        spool.append(['c'])
+        seq, records = spool.oldest()
+        spool.rewrite(seq, [['b']])
+        self.assertEqual(spool.oldest(), (seq, [['b']]))
+        self.assertEqual(spool.sizes[seq], os.path.getsize(spool.path(seq)))
+        spool.rewrite(seq, [])
+        self.assertEqual(spool.oldest()[1], [['c']])
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+
+    def test_empty(self):
+        self.assertEqual(self.spool().oldest(), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+###############################################################################
+#   Copyright 2006 to the present, Orbitz Worldwide, LLC.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+###############################################################################
+
+import unittest
+from kitt.numeric import vectors
+from kitt.numeric.vectors import SeriesAverage, SeriesSum, SeriesMax, \
+        SeriesMin, SeriesFirst, SeriesLast, SeriesStdDev, SeriesP50, \
+        SeriesP90, SeriesDelta, SeriesRate, VectorTransform
+
+
+class TransformTest(unittest.TestCase):
+    vector = [4.0, 1.0, 3.0, 2.0]
+
+    def check(self, transform, expected, vector=None):
+        if vector is None: vector = self.vector
+        self.assertAlmostEqual(transform().compute(vector)[0], expected)
+
+    def test_simple(self):
+        self.check(SeriesAverage, 2.5)
+        self.check(SeriesSum, 10.0)
+        self.check(SeriesMax, 4.0)
+        self.check(SeriesMin, 1.0)
+        self.check(SeriesFirst, 4.0)
+        self.check(SeriesLast, 2.0)
+        self.check(SeriesStdDev, 1.118033988749895)
+
+    def test_percentiles_interpolate(self):
+        self.check(SeriesP50, 2.5)
+        self.check(SeriesP90, 3.7)
+
+    def test_delta_handles_reset(self):
+        self.check(SeriesDelta, 15.0, [10.0, 15.0, 5.0, 10.0])
+
+    def test_rate(self):
+        self.check(SeriesRate, 5.0, [10.0, 15.0, 5.0, 10.0])
+        self.assertEqual(SeriesRate().compute_stamped([1.0, 5.0], [10, 12]), [2.0])
+        self.assertEqual(SeriesRate().compute([1.0]), [0.0])
+
+    def test_none_is_identity(self):
+        self.assertEqual(VectorTransform().compute(self.vector), self.vector)
+
+
+class ComputeManyTest(unittest.TestCase):
+    """compute_many must agree with compute, with and without numpy"""
+    transforms = (SeriesAverage, SeriesSum, SeriesMax, SeriesMin, SeriesFirst,
+            SeriesLast, SeriesStdDev, SeriesP50, SeriesP90, SeriesDelta)
+    vectors = [[4.0, 1.0, 3.0], [1.0, 2.0, 3.0], [7.0], [2.0, 9.0, 1.0, 5.0]]
+
+    def compare(self):
+        for transform in self.transforms:
+            obj = transform()
+            result = obj.compute_many(self.vectors)
+            self.assertEqual(len(result), len(self.vectors))
+            for vector, row in zip(self.vectors, result):
+                self.assertAlmostEqual(row[0], obj.compute(vector)[0])
+
+    def test_compute_many(self):
+        self.compare()
+
+    def test_compute_many_without_numpy(self):
+        available = vectors.NUMPY_AVAILABLE
+        vectors.NUMPY_AVAILABLE = False
+        try: self.compare()
+        finally: vectors.NUMPY_AVAILABLE = available
+
+    def test_rate_with_stamps(self):
+        stamps = [[0, 2, 4], [0, 1, 2], [5], [0, 1, 2, 10]]
+        result = SeriesRate().compute_many(self.vectors, stamps)
+        for vector, times, row in zip(self.vectors, stamps, result):
+            expected = SeriesRate().compute_stamped(vector, times)[0]
+            self.assertAlmostEqual(row[0], expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -21,13 +21,25 @@ __doc__ = """
 The application service is responsible for configuring and managing the life
 cycle of AppManager models.  It will scan crashed AppInstance models and fire
 events accordingly.  This service is driven completely of of romeo.
+
+On Linux when droned runs as root process exits are received from the
+kernel proc connector as they happen, crashed instances are found right
+away and the crash search only runs every ``event_recover_interval``
+seconds as a safety net, or right away when the kernel dropped events.
+Otherwise, or with ``process_events`` set to
+False, crashes are found by the crash search every ``recover_interval``
+seconds.
+
+With ``pidfd_watch`` set to True the process of every running local
+instance is watched through a pidfd, its exit is handled as soon as it
+happens and checking whether it runs no longer touches /proc.
 """
 
 from twisted.python.failure import Failure
 from twisted.internet import task, defer, reactor
 from twisted.application.service import Service
 from droned.logging import logWithContext, err
-from kitt.proc import listProcesses, isRunning
+from kitt.proc import listProcesses, isRunning, processTable
 from kitt.util import crashReport, dictwrapper
 from kitt.decorators import deferredAsThread, debugCall
 import config
@@ -41,7 +53,10 @@ SERVICECONFIG = dictwrapper({
     'initial_delay': 1.0, #number of seconds to wait on start before scanning
     'assimilate_interval': 60.0, #number of seconds to wait between assimilations
     'recover_interval': 10.0, #number of seconds to wait in between crash searches
-    'recovery_period': 60 #number of seconds between recovery attempts
+    'recovery_period': 60, #number of seconds between recovery attempts
+    'process_events': True, #use the linux proc connector when privileged
+    'event_recover_interval': 60.0, #crash search interval with process events
+    'pidfd_watch': False, #watch running instances through pidfds (linux 5.3+)
 })
 
 log = logWithContext(type=SERVICENAME)
@@ -53,6 +68,7 @@ class ApplicationLoader(Service):
    scanning = defer.succeed(None)
    assimilating = defer.succeed(None)
    tracking = set()
+   connector = None
   
    def startService(self):
        """Start All AppManager Services"""
@@ -87,6 +103,8 @@ class ApplicationLoader(Service):
                except: crashReport('ApplicationLoader', self)
        Service.startService(self)
        Event('instance-started').subscribe(self.reset_tracking)
+       Event('instance-started').subscribe(self.watch_instances)
+       Event('instance-found').subscribe(self.watch_instances)
        #wire allapps action into the server
        drone.builtins.update({
            'allapps': self.allapps_action,
@@ -97,7 +115,10 @@ class ApplicationLoader(Service):
 
    def _start_all_tasks(self):
        self.assimilate_app_instances() #make sure this runs first
-       self._task.start(SERVICECONFIG.recover_interval)
+       interval = SERVICECONFIG.recover_interval
+       if self._start_process_events():
+           interval = max(interval, SERVICECONFIG.event_recover_interval)
+       self._task.start(interval)
        self._task2.start(SERVICECONFIG.assimilate_interval)
 
    def scan_app_instances(self):
@@ -114,12 +135,78 @@ class ApplicationLoader(Service):
        else:
            log('busy assimilating from last interation')
 
+   def _start_process_events(self):
+       """listen for process events, @return (bool) whether we are"""
+       if not SERVICECONFIG.process_events: return False
+       try:
+           self.connector = ProcConnector(self.process_event,
+                   self.scan_app_instances)
+           self.connector.start()
+           log('receiving process events from the kernel')
+           return True
+       except:
+           self.connector = None
+           log('process events are not available, polling for crashes')
+           return False
+
+   def process_event(self, what, pid, tgid, data):
+       """handle a kernel process event, runs for every process on the
+          system so it does nothing unless droned knows the process.
+       """
+       if pid != tgid: return #threads
+       if what == PROC_EVENT_EXEC:
+           processTable.invalidate(pid)
+           return
+       if what != PROC_EVENT_EXIT: return
+       self.process_exited(pid)
+
+   def process_exited(self, pid):
+       """drop the process model of pid and check the instances it ran"""
+       processTable.invalidate(pid)
+       server = Server(config.HOSTNAME)
+       if not AppProcess.exists(server, pid): return
+       AppProcess.delete(AppProcess(server, pid))
+       for app in App.objects:
+           if not app.__class__.isValid(app): continue
+           for ai in app.localappinstances:
+               if not ai.__class__.isValid(ai): continue
+               if ai.pid == pid: self.check_instance(ai)
+
+   def watch_instances(self, occurrence=None):
+       """watch the process of running local instances through a pidfd"""
+       if not (SERVICECONFIG.pidfd_watch and watcher.available): return
+       for app in App.objects:
+           if not app.__class__.isValid(app): continue
+           for ai in app.localappinstances:
+               try:
+                   if not ai.__class__.isValid(ai): continue
+                   pid = ai.pid
+                   if not pid or watcher.watching(pid): continue
+                   if not ai.running: continue
+                   watcher.watch(pid, self.process_exited,
+                           inode=ai.process.inode or None)
+               except: err('pidfd watch error')
+
+   def check_instance(self, ai):
+       """fire instance-crashed if the instance crashed"""
+       if ai.running and not ai.shouldBeRunning:
+           ai.shouldBeRunning = True
+           return #work around first assimilated/never started
+       if not ai.crashed: return
+       if not ai.enabled: return #disabled instances are not actionable
+       if ai in self.tracking: return
+       Event('instance-crashed').fire(instance=ai)
+       #cool off on eventing for a little while
+       self.tracking.add(ai)
+       reactor.callLater(SERVICECONFIG.recovery_period,
+           self.tracking.discard, ai
+       )
+
    def reset_tracking(self, occurrence):
        """reset tracking criteria when an instance starts"""
        try: self.tracking.discard(occurrence.instance)
        except: pass
 
-#TODO this loop runs hot b/c of IO, consider a thread
    @defer.deferredGenerator
    def _scan(self):
        #wait for assimilation to finish
@@ -127,8 +214,21 @@ class ApplicationLoader(Service):
        yield wfd
        try: wfd.getResult()
        except: err('assimilation had an error')
-       #scan for all processes, hopefully we have seen them before
-       for pid in listProcesses():
+       #one snapshot of the process table per tick, shared with _borg
+       table = processTable.scan()
+       #drop process objects that exited or whose pid was reused
+       for process in AppProcess.objects:
+           try:
+               if not process.localInstall: continue
+               if process.created > table.stamp: continue #newer than the scan
+               if process.pid in table.reused and not process.running:
+                   AppProcess.delete(process)
+               elif process.pid not in table:
+                   AppProcess.delete(process)
+           except:
+               err('process book keeping error')
+       #only processes that are new since the last scan need a look
+       for pid in sorted(table.started):
            try: AppProcess(Server(config.HOSTNAME), pid)
            except InvalidProcess: pass
            except IOError: pass #happens on linux when a pid dies
@@ -138,26 +238,8 @@ class ApplicationLoader(Service):
            if not app.__class__.isValid(app): continue
            for ai in app.localappinstances:
                if not ai.__class__.isValid(ai): continue
-               if ai.running and not ai.shouldBeRunning:
-                   ai.shouldBeRunning = True
-                   continue #work around first assimilated/never started
-               if not ai.crashed: continue
-               if not ai.enabled: continue #disabled instances are not actionable
-               if ai in self.tracking: continue
-               Event('instance-crashed').fire(instance=ai)
-               #cool off on eventing for a little while
-               self.tracking.add(ai)
-               reactor.callLater(SERVICECONFIG.recovery_period,
-                   self.tracking.discard, ai
-               )
-       #keep the process objects up to date
-       for process in AppProcess.objects:
-           try:
-               if not process.localInstall: continue
-               if not process.running:
-                   AppProcess.delete(process)
-           except:
-               err('process book keeping error')
+               self.check_instance(ai)
+       self.watch_instances()
        d = defer.Deferred()
        reactor.callLater(0.01, d.callback, None)
        wfd = defer.waitForDeferred(d)
@@ -174,6 +256,7 @@ class ApplicationLoader(Service):
        yield wfd
        try: wfd.getResult()
        except: err('scanning had an error')
+       if not processTable.tick: processTable.scan() #assimilation runs first
        for manager in AppManager.objects:
            if not manager.running:
                continue #skip managers that are not running
@@ -204,6 +287,9 @@ class ApplicationLoader(Service):
            if x in drone.builtins:
                del drone.builtins[x]
        Event('instance-started').unsubscribe(self.reset_tracking)
+       Event('instance-started').unsubscribe(self.watch_instances)
+       Event('instance-found').unsubscribe(self.watch_instances)
+       watcher.stop()
        for manager in AppManager.objects:
            if manager.running:
                mesg = 'Stopping Application Manager'
@@ -213,6 +299,9 @@ class ApplicationLoader(Service):
                pluginFactory.delete_plugin(manager.model)
        if self._task.running: self._task.stop()
        if self._task2.running: self._task2.stop()
+       if self.connector:
+           self.connector.stop()
+           self.connector = None
        Service.stopService(self)
 
    #!!!Note docstring is funny for admin usage over blaster
@@ -301,6 +390,9 @@ def running():
     return bool(service) and service.running
 
 from kitt.proc import listProcesses, InvalidProcess
+from kitt.proc.netlink import ProcConnector, PROC_EVENT_EXEC, \
+        PROC_EVENT_EXIT
+from kitt.proc.pidfd import watcher
 from droned.models.appmgr import AppManager, InvalidPlugin
 from droned.models.event import Event
 from droned.models.app import App, AppProcess, AppInstance
@@ -71,6 +71,7 @@ server.version = 'DroneD/twisted'
 
 #get the droneserver model
 from droned.models.server import drone
+from droned.models.openmetrics import exposition, CONTENT_TYPE
 
 
 class Gremlin(resource.Resource):
@@ -106,6 +107,22 @@ class Gremlin(resource.Resource):
         return server.NOT_DONE_YET
         
 
+class Metrics(resource.Resource):
+    """OpenMetrics text exposition for scrapers, the text is maintained
+       by the collectors so a scrape only writes it out.
+    """
+    isLeaf = True
+    def render_GET(self, request):
+        result = exposition.render()
+        request.setHeader("Content-Type", CONTENT_TYPE)
+        request.setHeader("Content-Length", str(len(result)))
+        request.setHeader("Pragma", "no-cache")
+        request.setHeader("Cache-Control", "no-cache")
+        request.write(result)
+        request.finish()
+        return server.NOT_DONE_YET
+
+
 class Prime(resource.Resource):
     """Handles Prime Number Allocation"""
     def __init__(self):
@@ -263,7 +280,8 @@ class DroneSite(server.Site):
 
        #filter this junk out otherwise the logs are very chatty
        if ('_command' in line) or ('_getprime' in line) or \
-                ('favicon.ico' in line) or ('gremlin' in line):
+                ('favicon.ico' in line) or ('gremlin' in line) or \
+                ('/metrics' in line):
             return
 
        http_log(line)
@@ -290,6 +308,7 @@ def start():
         dr.putChild('_getprime', Prime())
         dr.putChild('_command', Control())
         dr.putChild('gremlin', Gremlin())
+        dr.putChild('metrics', Metrics())
 
         site = DroneSite(dr, **kwargs)
         
@@ -26,6 +26,47 @@ __doc__ = """
 The graphite services will write all TimeSeriesData models to
 a given graphite server.  This service is configured through
 romeo.
+
+Metrics are streamed over GRAPHITE_POOL_SIZE persistent connections
+(default 1) that reconnect with backoff. Set GRAPHITE_POOL_SIZE to 0
+to open a connection per frame instead.
+
+The points of all metric ids are sent together in frames of at most
+GRAPHITE_BATCH_SIZE points (default 500) and about GRAPHITE_BATCH_BYTES
+bytes (default 65536). Setting GRAPHITE_DELAY sends one metric id at a
+time with that many seconds in between, as older versions did.
+
+When GRAPHITE_SPOOL_DIR is set points that could not be sent are written
+to an on disk spool of GRAPHITE_SPOOL_SEGMENT_BYTES sized segments
+instead of being kept in memory. The spool is capped at
+GRAPHITE_SPOOL_MAX_BYTES, the oldest segments are dropped first. Spooled
+points are replayed oldest first once graphite accepts data again and
+are no longer saved by the journal.
+
+To shard metrics over several relays list them in GRAPHITE_RELAYS as
+host:port or host:port:instance, they are used in place of GRAPHITE_HOST
+and GRAPHITE_PORT. Metric names are mapped to relays with the consistent
+hash ring carbon-relay uses (GRAPHITE_REPLICAS, default 100, must match
+carbon). Each relay gets its own connection pool and the shards of a
+batch are written concurrently. While a relay has no connection up its
+metrics go to the next relay of the ring. example:
+    GRAPHITE_RELAYS: [relay1.mydomain.com:2004:a, relay2.mydomain.com:2004:b]
+
+Pickles are written with protocol 2. Set GRAPHITE_COMPRESSION to zlib or
+gzip to compress the stream of each pooled connection, at
+GRAPHITE_COMPRESSION_LEVEL (default 6). Only use it with a relay that
+expects a compressed stream, carbon itself does not.
+
+Series that have not received a point in GRAPHITE_IDLE_TTL seconds
+(default 3600) and have nothing left to send are forgotten.
+
+GRAPHITE_ROLLUP rolls samples up into one point per bucket as they are
+added, the first rule whose MATCH regex matches a metric id applies.
+WIDTH is the bucket size in seconds and METHOD is one of avg, max, min,
+sum, last or count. example:
+    GRAPHITE_ROLLUP:
+        - {MATCH: "servers\\..*\\.cpu\\..*", WIDTH: 60, METHOD: max}
+        - {MATCH: ".*", WIDTH: 60, METHOD: avg}
 """
 
 from twisted.python.log import msg, err
@@ -34,7 +75,9 @@ from twisted.internet import defer, task
 from twisted.application.service import Service
 from droned.logging import logWithContext
 from droned.models.graphite import TimeSeriesData
-from droned.protocols.graphite import PickleEmitter, LineEmitter
+from droned.protocols.graphite import PickleEmitter, LineEmitter, GraphitePool, \
+        GraphiteRouter
+from kitt.spool import SegmentSpool
 import time
 
 log = logWithContext(type=SERVICENAME)
@@ -51,28 +94,94 @@ class Graphite(Service):
     graphite_port = property(lambda s: int(SERVICECONFIG.wrapped.get('GRAPHITE_PORT',0)))
     graphite_timeout = property(lambda s: float(SERVICECONFIG.wrapped.get('GRAPHITE_TIMEOUT',5.0)))
     graphite_delay_iteration = property(lambda s: float(SERVICECONFIG.wrapped.get('GRAPHITE_DELAY',0)))
+    graphite_pool_size = property(lambda s: int(SERVICECONFIG.wrapped.get('GRAPHITE_POOL_SIZE',1)))
+    graphite_batch_size = property(lambda s: int(SERVICECONFIG.wrapped.get('GRAPHITE_BATCH_SIZE',500)))
+    graphite_batch_bytes = property(lambda s: int(SERVICECONFIG.wrapped.get('GRAPHITE_BATCH_BYTES',65536)))
+    graphite_spool_dir = property(lambda s: SERVICECONFIG.wrapped.get('GRAPHITE_SPOOL_DIR'))
+    graphite_spool_max_bytes = property(lambda s: int(SERVICECONFIG.wrapped.get('GRAPHITE_SPOOL_MAX_BYTES',64*1024*1024)))
+    graphite_spool_segment_bytes = property(lambda s: int(SERVICECONFIG.wrapped.get('GRAPHITE_SPOOL_SEGMENT_BYTES',1024*1024)))
+    graphite_compression = property(lambda s: SERVICECONFIG.wrapped.get('GRAPHITE_COMPRESSION'))
+    graphite_compression_level = property(lambda s: int(SERVICECONFIG.wrapped.get('GRAPHITE_COMPRESSION_LEVEL',6)))
+    graphite_replicas = property(lambda s: int(SERVICECONFIG.wrapped.get('GRAPHITE_REPLICAS',100)))
+    graphite_rollup = property(lambda s: [(r['MATCH'], r.get('WIDTH',60), r.get('METHOD','avg')) \
+            for r in SERVICECONFIG.wrapped.get('GRAPHITE_ROLLUP',[])])
+    graphite_idle_ttl = property(lambda s: float(SERVICECONFIG.wrapped.get('GRAPHITE_IDLE_TTL',3600)))
     _task = None
+    _evict_task = None
+    pool = None
+
+    @property
+    def graphite_relays(self):
+        """@return (list) [(host, port, instance), ...]"""
+        relays = []
+        for relay in SERVICECONFIG.wrapped.get('GRAPHITE_RELAYS',[]):
+            parts = str(relay).split(':')
+            instance = None
+            if len(parts) > 2: instance = parts[2]
+            relays.append((parts[0], int(parts[1]), instance))
+        return relays
 
     def success(self,result):
         log('Wrote %d metric points' % (result,))
+        spool = TimeSeriesData.spool
+        if spool is not None and len(spool):
+            log('%d bytes of metric points spooled, %d segments evicted' % \
+                    (spool.size, spool.evicted))
         return result
 
     def write(self):
-        if self.writing.called:
+        if self.writing.called and self.graphite_delay_iteration:
             self.writing = TimeSeriesData.produceAllMetrics(
                     self.graphite_host, self.graphite_port, self.protocol,
                     timeout=self.graphite_timeout,
-                    delay=self.graphite_delay_iteration
+                    delay=self.graphite_delay_iteration,
+                    pool=self.pool
+            )
+            self.writing.addCallback(self.success)
+        elif self.writing.called:
+            self.writing = TimeSeriesData.produceBatchedMetrics(
+                    self.graphite_host, self.graphite_port, self.protocol,
+                    timeout=self.graphite_timeout,
+                    pool=self.pool,
+                    batch_size=self.graphite_batch_size,
+                    batch_bytes=self.graphite_batch_bytes
             )
             self.writing.addCallback(self.success)
         else:
             log('Graphite data is still being written from previous iteration,' + \
                     ' will hold off until next iteration')
 
+    def evict(self):
+        count = TimeSeriesData.evictIdle(self.graphite_idle_ttl)
+        if count: log('Forgot %d idle metric series' % (count,))
+
     def startService(self):
-        if self.graphite_host and self.graphite_port and self.protocol:
+        configured = self.graphite_relays or \
+                (self.graphite_host and self.graphite_port)
+        if configured and self.protocol:
+            TimeSeriesData.setRollups(self.graphite_rollup)
+            if self.graphite_spool_dir:
+                TimeSeriesData.spool = SegmentSpool(self.graphite_spool_dir,
+                        max_bytes=self.graphite_spool_max_bytes,
+                        segment_bytes=self.graphite_spool_segment_bytes)
+            options = dict(size=max(1, self.graphite_pool_size),
+                    timeout=self.graphite_timeout,
+                    frame_size=self.graphite_batch_size,
+                    frame_bytes=self.graphite_batch_bytes,
+                    compression=self.graphite_compression,
+                    compress_level=self.graphite_compression_level)
+            if self.graphite_relays: #relays always use pools
+                self.pool = GraphiteRouter(self.graphite_relays, self.protocol,
+                        replica_count=self.graphite_replicas, **options)
+                self.pool.start()
+            elif self.graphite_pool_size > 0:
+                self.pool = GraphitePool(self.graphite_host, self.graphite_port,
+                        self.protocol, **options)
+                self.pool.start()
             self._task = task.LoopingCall(self.write)
             self._task.start(60.0) #graphite only cares about minutely precision
+            self._evict_task = task.LoopingCall(self.evict)
+            self._evict_task.start(self.graphite_idle_ttl, False)
             Service.startService(self)
         else:
             self.disownServiceParent() #effectively self destruct
@@ -82,8 +191,16 @@ class Graphite(Service):
 
     def stopService(self):
         if self._task and self._task.running: self._task.stop()
+        if self._evict_task and self._evict_task.running: self._evict_task.stop()
+        if self.pool: #fails whatever is still queued
+            self.pool.stop()
+            self.pool = None
         while not self.writing.called:
             time.sleep(1) #block the reactor
+        if TimeSeriesData.spool is not None:
+            log('Spooled %d metric points' % (TimeSeriesData.spoolAll(),))
+            TimeSeriesData.spool.close()
+            TimeSeriesData.spool = None
         Service.stopService(self)
 
 # module state globals
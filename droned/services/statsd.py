@@ -0,0 +1,184 @@
+###############################################################################
+#   Copyright 2006 to the present, Orbitz Worldwide, LLC.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+###############################################################################
+
+from kitt.interfaces import moduleProvides, IDroneDService
+moduleProvides(IDroneDService) #requirement
+from kitt.util import dictwrapper
+
+#api requirements
+SERVICENAME = 'statsd'
+SERVICECONFIG = dictwrapper({})
+
+__doc__ = """
+A statsd compatible UDP listener, applications can push their own
+counters, gauges and timers to the local droned instead of running a
+separate statsd daemon. Samples are rolled up into one point per
+STATSD_FLUSH_INTERVAL seconds (default 60) as they arrive and stored as
+TimeSeriesData, the graphite service sends them with everything else.
+Names that have not been sent a sample in GRAPHITE_IDLE_TTL seconds (see
+the graphite service, default 3600) are forgotten, a relative gauge then
+starts over from 0.
+
+config:
+    STATSD_PORT: 8125
+    STATSD_INTERFACE: 127.0.0.1
+    STATSD_FLUSH_INTERVAL: 60
+    STATSD_PREFIX: stats
+
+series written per sample type:
+    name:1|c[|@0.1]   <prefix>.counters.<name>.count   (sum, scaled by rate)
+    name:5|g          <prefix>.gauges.<name>            (last)
+    name:+5|g         <prefix>.gauges.<name>            (adjusts the last value)
+    name:320|ms       <prefix>.timers.<name>.mean       (avg)
+                      <prefix>.timers.<name>.upper      (max)
+                      <prefix>.timers.<name>.lower      (min)
+                      <prefix>.timers.<name>.count      (count, scaled by rate)
+"""
+
+from twisted.internet import reactor, task
+from twisted.application.service import Service
+from droned.logging import logWithContext
+from droned.models.graphite import TimeSeriesData, Rollup
+from droned.protocols.statsd import StatsdProtocol
+import time
+
+log = logWithContext(type=SERVICENAME)
+
+class Statsd(Service):
+    statsd_port = property(lambda s: int(SERVICECONFIG.wrapped.get('STATSD_PORT',8125)))
+    statsd_interface = property(lambda s: SERVICECONFIG.wrapped.get('STATSD_INTERFACE','127.0.0.1'))
+    statsd_flush_interval = property(lambda s: int(SERVICECONFIG.wrapped.get('STATSD_FLUSH_INTERVAL',60)))
+    statsd_prefix = property(lambda s: SERVICECONFIG.wrapped.get('STATSD_PREFIX','stats'))
+    #series suffix, rollup method and whether the series counts samples
+    #(1/rate each) instead of taking their value, for each sample type
+    SERIES = {
+        'c': (('counters.%s.count', 'sum', False),),
+        'g': (('gauges.%s', 'last', False),),
+        'ms': (('timers.%s.mean', 'avg', False), ('timers.%s.upper', 'max', False),
+               ('timers.%s.lower', 'min', False), ('timers.%s.count', 'sum', True)),
+    }
+    port = None
+    protocol = None
+    _evict_task = None
+
+    def __init__(self):
+        self.rollups = {} #metric id -> Rollup
+        self.gauges = {} #metric id -> last gauge value
+        self.touched = {} #metric id -> time of its last sample
+        self.unknown = 0
+
+    @property
+    def statsd_idle_ttl(self):
+        """GRAPHITE_IDLE_TTL of the graphite service"""
+        import services
+        try: graphite = services.getService('graphite').SERVICECONFIG.wrapped
+        except: graphite = {} #graphite is not loaded
+        return float(graphite.get('GRAPHITE_IDLE_TTL', 3600))
+
+    def sample(self, name, value, kind, rate, relative):
+        """roll a parsed statsd sample into its series"""
+        series = self.SERIES.get(kind)
+        if not series:
+            self.unknown += 1
+            return
+        if kind == 'c': value = value / rate
+        now = time.time()
+        for (template, method, counted) in series:
+            metricID = '%s.%s' % (self.statsd_prefix, template % (name,))
+            point = value
+            if counted: point = 1.0 / rate
+            elif kind == 'g':
+                if relative: point += self.gauges.get(metricID, 0.0)
+                self.gauges[metricID] = point
+            self.touched[metricID] = now
+            rollup = self.rollups.get(metricID)
+            if rollup is None:
+                rollup = self.rollups[metricID] = Rollup(
+                        self.statsd_flush_interval, method)
+            tsd = TimeSeriesData(metricID)
+            #GRAPHITE_ROLLUP rules do not apply to statsd series
+            if tsd.rollup is not rollup: tsd.rollup = rollup
+            tsd.append(now, point)
+
+    def evict(self, ttl=None):
+        """forget the rollups and gauges of series that have not had a
+           sample for ttl seconds, like TimeSeriesData.evictIdle.
+
+           @return (int) - how many series were forgotten
+        """
+        if ttl is None: ttl = self.statsd_idle_ttl
+        cutoff = time.time() - ttl
+        idle = [metricID for (metricID, stamp) in self.touched.items() \
+                if stamp < cutoff]
+        for metricID in idle:
+            del self.touched[metricID]
+            self.rollups.pop(metricID, None)
+            self.gauges.pop(metricID, None)
+        if idle: log('Forgot %d idle statsd series' % (len(idle),))
+        return len(idle)
+
+    def startService(self):
+        self.protocol = StatsdProtocol(self.sample)
+        self.port = reactor.listenUDP(self.statsd_port, self.protocol,
+                interface=self.statsd_interface)
+        log('Listening for statsd metrics on %s:%d' % \
+                (self.statsd_interface, self.statsd_port))
+        self._evict_task = task.LoopingCall(self.evict)
+        self._evict_task.start(self.statsd_idle_ttl, False)
+        Service.startService(self)
+
+    def stopService(self):
+        if self._evict_task and self._evict_task.running: self._evict_task.stop()
+        if self.port:
+            self.port.stopListening()
+            self.port = None
+        if self.protocol:
+            log('Received %d statsd samples, %d malformed, %d unknown type' % \
+                    (self.protocol.received, self.protocol.malformed, self.unknown))
+            self.protocol = None
+        Service.stopService(self)
+
+# module state globals
+parentService = None
+service = None
+
+###############################################################################
+# API Requirements
+###############################################################################
+def install(_parentService):
+    global parentService
+    parentService = _parentService
+
+def start():
+    global service
+    if not running():
+        service = Statsd()
+        service.setName(SERVICENAME)
+        service.setServiceParent(parentService)
+        service.startService()
+
+def stop():
+    global service
+    if running():
+        service.stopService()
+        service.disownServiceParent()
+        service = None
+
+def running():
+    global service
+    return bool(service) and service.running
+
+__all__ = ['install', 'start', 'stop', 'running']
@@ -20,15 +20,16 @@
 #api requirements
 from kitt.util import dictwrapper
 SERVICENAME = 'systemstats'
-SERVICECONFIG = dictwrapper({})
+SERVICECONFIG = dictwrapper({
+    'COLLECT_POOL_SIZE': 2, #maximum threads used to gather stats
+})
 
 __doc__ = """
 !!! NOTE !!!!
-This service does a bunch of small blocking IO operations. in most cases this will not be
-a problem at all however if you are running a lot higher frequency services or services that
-have sub-second requirements for other services you may notice interference from this
-service. This will be fixed in a future release. For the majority of operations oriented
-tasks this is not a big deal.
+This service does a bunch of small blocking IO operations. they are run in a dedicated,
+size limited pool of worker threads (see COLLECT_POOL_SIZE) and the results of each
+collect interval are handed back to the reactor in a single batch, so a slow process
+table will not add latency to command handling or other services.
 
 This service will produce system stats at the assigned poll interval.
 CPU,Memory,Disk,network IO, Process specific stats are available.
@@ -39,6 +40,16 @@ Minimum required config:
 - SERVICE: &systemstats1
     SERVCIENAME: systemstats
 
+Optional service settings:
+    COLLECT_POOL_SIZE: 2 #maximum number of worker threads used to gather stats
+
+The latest value of every series and the counters of every stat block are also
+published in OpenMetrics text format at http://<host>:<DRONED_PORT>/metrics,
+metrics that only ever grow are counters, e.g.
+    droned_disk_usage_percent{partition="var"} 41.0
+    droned_disk_bytes_read_total{partition="var"} 52428800.0
+    droned_systemstats_points_saved_total{block="disk"} 1234.0
+
 **************** EXAMPLE USAGE ******************
 #Collecting basic disk and memory stats
 - SERVICE: &systemstats2
@@ -103,6 +114,7 @@ The string <variable_name> will be replaced by the computed value.
     * <exe> = executable of the current process. only valid in process stat block
     * <user> = username of the current process. only valid in process stat block
     * <status> = status of the current process. only valid in process stat block
+    * <group> = name of the current process group. only valid in process stat block with GROUP_BY
  
 
     
@@ -122,6 +134,8 @@ METRIC NOTES:
 * STATS: defines the start of all stat definitions  
 * - STAT: defines the start of a statistic block. this defines what to capture and where to send resutls of that capture.
   *  TYPE: defines the type of stat valid options are: disk,memory,cpu,network,process
+  *  NAME: optional, the block label of its counters on /metrics [TYPE default]. blocks of the
+	same TYPE without a NAME are numbered, i.e. process, process2.
   *  COLLECT_INTERVAL: how often to poll for stat. format <int><unit> where int is a number (1,3,499) and unit is one of "s,m,h,d"
 	s = seconds. example 60s == 1 minute
 	m = minutes. example 2m == 120 seconds
@@ -129,12 +143,27 @@ METRIC NOTES:
 	d == days. example 5 days == miller time!
 	w == week. example 1 week == 7 days 
 	y == 365 days. example 1 year == 365 days.
+  * MIN_COLLECT_INTERVAL: optional, turns on adaptive collection. COLLECT_INTERVAL is then the slowest
+	interval. as soon as any sample is volatile (see below) collection speeds up to MIN_COLLECT_INTERVAL,
+	after that the interval doubles on every quiet collection until it is back at COLLECT_INTERVAL.
+  * ADAPTIVE_CHANGE: a sample is volatile if it changed by more than this fraction of the previous
+	sample of the same series. example 0.25 == 25%. off by default.
+  * ADAPTIVE_THRESHOLD: optional map of metric names to values, a sample is volatile if it is at or
+	above the value of its metric. example {usage.percent: 90, time.iowait: 20}. off by default.
   * AGGREGATION_METHOD: how to roll up metrics collected during the intermediate collect intervals.
 	none = this is default if nothing is specified. this means all data collected is passed on to output with no processing.
 	average = average all values received during the OUTPUT_INTERVAL period
 	sum = sum all values
 	max = take maximum value
 	min = take minimum value
+	first = take the oldest value
+	last = take the newest value
+	stddev = standard deviation of all values
+	p50, p90, p99 = the 50th, 90th or 99th percentile of all values
+	delta = how much a counter grew, a counter that went backwards is treated as reset
+	rate = per second growth of a counter, resets are handled like delta
+  * LOG_LEVEL: optional, one of info,error,debug [info default]. per datapoint diagnostics are only
+	logged at error or debug, otherwise only the counters shown by the "counters" action are kept.
   * OUPUTS: defines the start of all output definitions.
     *  OUTPUT: defines the start of an output block. this defines where to send captured metrics.
       * TYPE: defines the type of output. currently supported are: graphite
@@ -201,6 +230,16 @@ TYPE: process
   * MATCH_CMDLINE: part of a command line for a target process.
   * MATCH_STATUS: status elements must be one of DEAD,DISK_SLEEP,IDLE,LOCKED,RUNNING,SLEEPING,STOPPED,TRACING_STOP,WAKING,ZOMBIE
                   remember using more than one will match a process of any of the status types specified.
+  * GROUP_BY: optional, report groups of processes instead of every pid [none default]. one of
+	none = every matched process is reported on its own.
+	tree = a matched process and all its matched descendants, named after the pid of the top most one.
+	name = all matched processes with the same short name.
+	user = all matched processes owned by the same user.
+	appinstance = the matched processes of each local droned application instance, named <app>_<label>.
+	     the MATCH lists must let through every process between the instance and its workers.
+	the group name is available as the <group> variable, all other variables come from the group root.
+  * GROUP_METHOD: how the values of a group are combined, sum or max [sum default]. any AGGREGATION_METHOD
+	that yields a single value may be used.
   * METRICS: 
     * threads.count: OS threads this process is using
     * children.count: child processes owned by this PID
@@ -241,7 +280,7 @@ from twisted.python.failure import Failure
 from twisted.internet import defer, task
 from twisted.application.service import Service
 from droned.logging import logWithContext, err
-from droned.models.systemstats import StatBlockLoader
+from droned.models.systemstats import StatBlockLoader, sampler
 from droned.models.action import AdminAction
 
 #becoming a service provider module
@@ -278,6 +317,14 @@ class SystemStats(Service):
 	for h in self.handlers:
 	    h[1].set_log_level(level)
     
+    def show_counters(self,*args):
+	out = []
+	for h in self.handlers:
+	    counters = h[1].counters()
+	    line = ", ".join(["%s=%d" % (k,counters[k]) for k in sorted(counters)])
+	    out.append("%s: %s" % (h[1].NAME,line))
+	return self.action.resultContext("\n".join(out) or "no stat blocks loaded")
+    
     def setup_actions(self):
 	self.action = AdminAction('systemstats')
 	self.action.expose("stop_collect", self.stop_collect, (), "stops collecting metrics")
@@ -286,10 +333,12 @@ class SystemStats(Service):
 	self.action.expose("start_output", self.start_output, (), "starts output of metrics")
 	adoc = "sets log level of this service. valid values are info,error,debug [info default]"
 	self.action.expose("set_log_level", self.set_log_level,("level",),adoc)
+	self.action.expose("counters", self.show_counters, (), "shows datapoints saved, dropped and sent per stat block")
 	self.action.buildDoc()
 	    
     
     def startService(self):
+	sampler.start_pool(SERVICECONFIG.COLLECT_POOL_SIZE)
 	self.handlers = []
 	stat_handlers = StatBlockLoader.load()
 	for STAT in SERVICECONFIG.STATS:
@@ -298,6 +347,7 @@ class SystemStats(Service):
                 for sh in stat_handlers:
                     if sh.TYPE == STAT_BLOCK['TYPE']:
                         inst = sh(STAT_BLOCK)
+                        self.unique_name(inst)
                         self.handlers.append((STAT_BLOCK,inst))
             except:
                 f = Failure()
@@ -305,7 +355,20 @@ class SystemStats(Service):
         self.setup_actions()
         Service.startService(self)
             
+    def unique_name(self,inst):
+        '''number blocks without a NAME of their own that share a TYPE.'''
+        names = [h[1].NAME for h in self.handlers]
+        base,n = inst.NAME,1
+        while inst.NAME in names:
+            n += 1
+            inst.NAME = "%s%d" % (base,n)
+            
     def stopService(self):
+        for h in self.handlers:
+            try: h[1].disable_collect()
+            except: pass #may not have been running
+            h[1].unexpose()
+        sampler.stop_pool()
         Service.stopService(self)
         
 